@@ -0,0 +1,441 @@
+# encoding: utf-8
+"""A local stand-in for AO3, serving synthetic pages, so that url collection can be
+benchmarked end to end without a network.
+
+Usage:
+    python benchmarks/fake_ao3_server.py [--port 8000] [--bookmarks 20000] ...
+
+Point the download command at it with --mirror=http://127.0.0.1:8000.
+
+The pages are modelled on AO3's own markup: bookmarks, marked-for-later, gifts,
+work/series/user subscriptions, author works, series and collections are paginated
+20 entries at a time, with realistically sized blurbs, and work pages have the
+usual work meta. Every page except a work page needs the session cookie.
+
+Each request can be delayed, and 429 (rate limited) and 525 (Cloudflare) errors
+can be injected. GET /__stats returns counts of the requests served, as json.
+"""
+import json
+import re
+import threading
+import time
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PAGE_SIZE = 20
+SESSION_COOKIE = "_otwarchive_session"
+# Work ids of each kind of list start at a different offset, so lists don't overlap.
+ID_OFFSETS = {
+    "bookmarks": 1000000,
+    "later": 2000000,
+    "gifts": 3000000,
+    "work_subscriptions": 4000000,
+    "works": 5000000,
+    "series": 6000000,
+    "collections": 7000000,
+}
+# Every nth bookmark is of a series rather than a work.
+SERIES_BOOKMARK_EVERY = 10
+SUMMARY_WORDS = 150
+TAGS_PER_BLURB = 15
+
+DEFAULT_SETTINGS = {
+    # The value of the session cookie that requests must have.
+    "cookie": "benchmark",
+    # How many entries each list has.
+    "bookmarks": 2000,
+    "later": 500,
+    "gifts": 50,
+    "work_subscriptions": 200,
+    "series_subscriptions": 50,
+    "user_subscriptions": 50,
+    "works_per_user": 40,
+    "works_per_series": 8,
+    "works_per_collection": 200,
+    # Seconds to wait before answering each request.
+    "latency": 0.1,
+    # Every nth request is answered with a 429 or a 525. 0 means never.
+    "rate_limit_every": 0,
+    "cloudflare_error_every": 0,
+}
+
+series_path = re.compile(r"^/series/(\d+)$")
+work_path = re.compile(r"^/works/(\d+)$")
+user_list_path = re.compile(r"^/users/([^/]+)/(bookmarks|readings|gifts|works)$")
+subscriptions_path = re.compile(r"^/users/([^/]+)/subscriptions$")
+collection_path = re.compile(r"^/collections/([^/]+)/works$")
+
+
+def date_of(index):
+    """Entries are dated one per hour, newest first."""
+    return datetime(2026, 1, 1) - timedelta(hours=index)
+
+
+def format_date(date):
+    return date.strftime("%d %b %Y")
+
+
+def work_blurb(work_id, date, list_class="work", entry_id=None, heading_href=None):
+    """A blurb of about the size of a real one, with tags and a summary."""
+    entry_id = entry_id or f"work_{work_id}"
+    heading_href = heading_href or f"/works/{work_id}"
+    tags = "".join(
+        f'<li class="freeforms"><a class="tag" href="/tags/Tag%20{i}/works">'
+        f"Tag {i}</a></li>"
+        for i in range(TAGS_PER_BLURB)
+    )
+    summary = " ".join(["word"] * SUMMARY_WORDS)
+    return f"""<li id="{entry_id}" class="{list_class} blurb group" role="article">
+  <div class="header module">
+    <h4 class="heading"><a href="{heading_href}">Work {work_id}</a> by
+      <a rel="author" href="/users/author{work_id % 1000}/pseuds/author">author</a>
+    </h4>
+    <h5 class="fandoms heading"><a class="tag" href="/tags/Fandom/works">Fandom</a></h5>
+    <p class="datetime">{format_date(date)}</p>
+  </div>
+  <ul class="tags commas">{tags}</ul>
+  <blockquote class="userstuff summary"><p>{summary}</p></blockquote>
+  <dl class="stats"><dt class="words">Words:</dt><dd class="words">12,345</dd>
+    <dt class="chapters">Chapters:</dt><dd class="chapters">3/?</dd></dl>
+</li>"""
+
+
+def pagination(path, query, page, page_count):
+    def link(page_number):
+        params = dict(query, page=[str(page_number)])
+        query_string = "&".join(f"{k}={v[0]}" for k, v in params.items())
+        return f"{path}?{query_string}"
+
+    previous_item = (
+        f'<li class="previous"><a rel="prev" href="{link(page - 1)}">← Previous</a></li>'
+        if page > 1
+        else '<li class="previous"><span class="disabled">← Previous</span></li>'
+    )
+    next_item = (
+        f'<li class="next"><a rel="next" href="{link(page + 1)}">Next →</a></li>'
+        if page < page_count
+        else '<li class="next"><span class="disabled">Next →</span></li>'
+    )
+    pages = "".join(
+        (
+            f'<li><span class="current">{p}</span></li>'
+            if p == page
+            else f'<li><a href="{link(p)}">{p}</a></li>'
+        )
+        for p in range(max(1, page - 4), min(page_count, page + 4) + 1)
+    )
+    return (
+        f'<ol class="pagination actions" role="navigation">'
+        f"{previous_item}{pages}{next_item}</ol>"
+    )
+
+
+def page_of(total, page):
+    """The indexes of the entries on the page, and the number of pages."""
+    page_count = max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
+    start = (page - 1) * PAGE_SIZE
+    return range(start, min(start + PAGE_SIZE, total)), page_count
+
+
+def html_page(title, body):
+    return f"""<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8"><title>{title} | Archive of Our Own</title>
+</head><body><div id="main" class="region" role="main">
+<h2 class="heading">{title}</h2>
+{body}
+</div></body></html>"""
+
+
+class FakeAO3(object):
+    """The content of the fake AO3, and counts of the requests it has served."""
+
+    def __init__(self, settings):
+        self.settings = dict(DEFAULT_SETTINGS, **settings)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "429": 0, "525": 0, "unauthorised": 0}
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+            return self.stats[key]
+
+    def injected_error(self, request_number):
+        for status, setting in [
+            (429, "rate_limit_every"),
+            (525, "cloudflare_error_every"),
+        ]:
+            every = self.settings[setting]
+            if every and request_number % every == 0:
+                self.count(str(status))
+                return status
+        return None
+
+    def work_list(self, kind, total, page, path, query, title):
+        indexes, page_count = page_of(total, page)
+        offset = ID_OFFSETS[kind]
+        blurbs = "".join(work_blurb(offset + i, date_of(i)) for i in indexes)
+        return html_page(
+            title,
+            f'<ol class="work index group">{blurbs}</ol>'
+            + pagination(path, query, page, page_count),
+        )
+
+    def bookmarks(self, page, path, query):
+        indexes, page_count = page_of(self.settings["bookmarks"], page)
+        blurbs = []
+        for i in indexes:
+            if i % SERIES_BOOKMARK_EVERY == 0:
+                series_id = ID_OFFSETS["series"] + i
+                blurbs.append(
+                    work_blurb(
+                        series_id,
+                        date_of(i),
+                        list_class="bookmark",
+                        entry_id=f"bookmark_{i}",
+                        heading_href=f"/series/{series_id}",
+                    )
+                )
+            else:
+                blurbs.append(
+                    work_blurb(
+                        ID_OFFSETS["bookmarks"] + i,
+                        date_of(i),
+                        list_class="bookmark",
+                        entry_id=f"bookmark_{i}",
+                    )
+                )
+        return html_page(
+            "Bookmarks",
+            f'<ol class="bookmark index group">{"".join(blurbs)}</ol>'
+            + pagination(path, query, page, page_count),
+        )
+
+    def readings(self, page, path, query):
+        indexes, page_count = page_of(self.settings["later"], page)
+        blurbs = "".join(
+            work_blurb(
+                ID_OFFSETS["later"] + i, date_of(i), list_class="reading work"
+            ).replace(
+                '<div class="header module">',
+                f'<h4 class="viewed heading"><span>Last viewed:</span> '
+                f"{format_date(date_of(i))}\n\n(Marked for Later.)\n\nViewed once</h4>"
+                f'<div class="header module">',
+            )
+            for i in indexes
+        )
+        return html_page(
+            "History",
+            f'<ol class="reading work index group">{blurbs}</ol>'
+            + pagination(path, query, page, page_count),
+        )
+
+    def subscriptions(self, page, path, query):
+        subscription_type = query.get("type", ["works"])[0]
+        setting, href, offset = {
+            "series": ("series_subscriptions", "/series/{}", ID_OFFSETS["series"]),
+            "users": ("user_subscriptions", "/users/author{}", 0),
+        }.get(
+            subscription_type,
+            ("work_subscriptions", "/works/{}", ID_OFFSETS["work_subscriptions"]),
+        )
+        total = self.settings[setting]
+        indexes, page_count = page_of(total, page)
+        entries = "".join(
+            f'<dt><a href="{href.format(offset + i)}">Subscription {i}</a> by '
+            f'<a rel="author" href="/users/author{i}">author{i}</a></dt>'
+            f'<dd><form class="ajax-remove" action="/subscriptions/{i}" method="post">'
+            f'<input type="submit" value="Unsubscribe"></form></dd>'
+            for i in indexes
+        )
+        return html_page(
+            "My Subscriptions",
+            f'<dl class="subscription index group">{entries}</dl>'
+            + pagination(path, query, page, page_count),
+        )
+
+    def series(self, series_id, page, path, query):
+        total = self.settings["works_per_series"]
+        indexes, page_count = page_of(total, page)
+        blurbs = "".join(
+            work_blurb(series_id * 100 + i, date_of(i), list_class="work")
+            for i in indexes
+        )
+        meta = (
+            f'<dl class="series meta group"><dt>Series Begun:</dt>'
+            f"<dd>{format_date(date_of(total))}</dd><dt>Series Updated:</dt>"
+            f"<dd>{format_date(date_of(0))}</dd>"
+            f'<dt class="stats">Stats:</dt><dd class="stats"><dl class="stats">'
+            f"<dt>Words:</dt><dd>{total * 12345:,}</dd><dt>Works:</dt><dd>{total}</dd>"
+            f"<dt>Complete:</dt><dd>No</dd></dl></dd></dl>"
+        )
+        return html_page(
+            f"Series {series_id}",
+            meta
+            + f'<ul class="series work index group">{blurbs}</ul>'
+            + pagination(path, query, page, page_count),
+        )
+
+    def work(self, work_id):
+        return html_page(
+            f"Work {work_id}",
+            f"""<div class="wrapper"><dl class="work meta group">
+<dt class="rating tags">Rating:</dt><dd class="rating tags"><ul class="commas">
+<li><a class="tag" href="/tags/General/works">General Audiences</a></li></ul></dd>
+<dt class="stats">Stats:</dt><dd class="stats"><dl class="stats">
+<dt class="published">Published:</dt><dd class="published">2024-01-01</dd>
+<dt class="status">Updated:</dt><dd class="status">{date_of(work_id % 1000):%Y-%m-%d}</dd>
+<dt class="words">Words:</dt><dd class="words">12,345</dd>
+<dt class="chapters">Chapters:</dt><dd class="chapters">3/?</dd>
+</dl></dd></dl></div>
+<div class="preface group"><h2 class="title heading">Work {work_id}</h2>
+<h3 class="byline heading"><a rel="author" href="/users/author">author</a></h3></div>
+<div id="chapters" role="article"><div class="userstuff">
+{"<p>" + " ".join(["word"] * 2000) + "</p>"}
+</div></div>""",
+        )
+
+    def respond(self, path, query, cookie):  # noqa: C901
+        """Returns the status and the body of the response."""
+        page = int(query.get("page", ["1"])[0])
+
+        match = work_path.match(path)
+        if match:
+            return 200, self.work(int(match.group(1)))
+
+        if cookie != self.settings["cookie"]:
+            self.count("unauthorised")
+            return 302, "/users/login"
+
+        match = series_path.match(path)
+        if match:
+            return 200, self.series(int(match.group(1)), page, path, query)
+
+        match = collection_path.match(path)
+        if match:
+            return 200, self.work_list(
+                "collections",
+                self.settings["works_per_collection"],
+                page,
+                path,
+                query,
+                f"Works in {match.group(1)}",
+            )
+
+        match = subscriptions_path.match(path)
+        if match:
+            return 200, self.subscriptions(page, path, query)
+
+        match = user_list_path.match(path)
+        if match:
+            username, kind = match.groups()
+            if kind == "bookmarks":
+                return 200, self.bookmarks(page, path, query)
+            if kind == "readings":
+                return 200, self.readings(page, path, query)
+            if kind == "gifts":
+                return 200, self.work_list(
+                    "gifts", self.settings["gifts"], page, path, query, "Gifts"
+                )
+            return 200, self.work_list(
+                "works",
+                self.settings["works_per_user"],
+                page,
+                path,
+                query,
+                f"Works by {username}",
+            )
+
+        return 404, html_page("Error 404", "<p>The page you were looking for.</p>")
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    fake_ao3 = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="text/html; charset=utf-8"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", "60")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/__stats":
+            with self.fake_ao3.lock:
+                stats = dict(self.fake_ao3.stats)
+            self._send(200, json.dumps(stats), "application/json")
+            return
+
+        request_number = self.fake_ao3.count("requests")
+        time.sleep(self.fake_ao3.settings["latency"])
+
+        error = self.fake_ao3.injected_error(request_number)
+        if error == 429:
+            self._send(429, "Retry later")
+            return
+        if error == 525:
+            self._send(525, html_page("525", "<p>SSL handshake failed</p>"))
+            return
+
+        cookies = SimpleCookie(self.headers.get("Cookie", ""))
+        cookie = cookies[SESSION_COOKIE].value if SESSION_COOKIE in cookies else None
+        status, body = self.fake_ao3.respond(url.path, parse_qs(url.query), cookie)
+        if status == 302:
+            self.send_response(302)
+            self.send_header("Location", body)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self._send(status, body)
+
+
+def start_server(settings=None, host="127.0.0.1", port=0):
+    """Start the fake AO3 in a background thread. Port 0 picks a free port.
+
+    Returns the server and its base url.
+    """
+    handler = type(
+        "FakeAO3RequestHandler",
+        (RequestHandler,),
+        {"fake_ao3": FakeAO3(settings or {})},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    arg_parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8000)
+    for setting, default in DEFAULT_SETTINGS.items():
+        arg_parser.add_argument(
+            f"--{setting.replace('_', '-')}", type=type(default), default=default
+        )
+    args = vars(arg_parser.parse_args())
+    host = args.pop("host")
+    port = args.pop("port")
+
+    server, url = start_server(args, host, port)
+    print(f"Fake AO3 running at {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+# encoding: utf-8
+"""Fake versions of the calibredb, calibre-debug and fanficfare command line tools,
+so that whole download runs can be benchmarked offline.
+
+They accept the arguments this project calls them with and behave just enough like
+the real tools for a run to succeed: the fake Calibre library is a json file inside
+the library directory, and the fake epubs are json files with the work's url and
+chapter count, padded to a realistic size.
+
+How slow the fakes are is set in the json file named by the environment variable
+BENCHMARK_FAKES_CONFIG (see DEFAULT_CONFIG). It's also where the fakes keep the
+counts of their calls.
+"""
+import fcntl
+import json
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+
+LIBRARY_FILENAME = "fake_library.json"
+CONFIG_ENV_VARIABLE = "BENCHMARK_FAKES_CONFIG"
+DEFAULT_CONFIG = {
+    # Seconds it takes each tool to start, before it does anything.
+    "calibredb_startup_seconds": 0.5,
+    "calibre_debug_startup_seconds": 1.0,
+    "fanficfare_startup_seconds": 0.5,
+    # Seconds calibredb takes per 10000 books in the library, to load it.
+    "calibredb_seconds_per_10000_books": 0.1,
+    # Seconds fanficfare takes to fetch each chapter.
+    "chapter_seconds": 0.1,
+    # Every nth call to fanficfare fails with a 429. 0 means never.
+    "rate_limit_every": 0,
+}
+WORDS_PER_CHAPTER = 3000
+# Roughly how many bytes of epub there are per word.
+EPUB_BYTES_PER_WORD = 2
+
+work_url = re.compile(r"https?://[^/\s\"']+/works/(\d+)")
+TAG_TYPES = [
+    "ao3categories",
+    "characters",
+    "fandoms",
+    "freeformtags",
+    "rating",
+    "ships",
+    "status",
+    "warnings",
+]
+
+
+def get_config():
+    config = dict(DEFAULT_CONFIG)
+    path = os.environ.get(CONFIG_ENV_VARIABLE)
+    if path:
+        with open(path, "r") as f:
+            config.update(json.loads(f.read()))
+    return config
+
+
+@contextmanager
+def locked(path):
+    """Hold an exclusive lock while reading and writing the file at path, since
+    several fakes may run at the same time."""
+    with open(path + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def count_call(tool):
+    """Count a call to the tool, and return how many calls there have been."""
+    path = os.environ.get(CONFIG_ENV_VARIABLE)
+    if not path:
+        return 0
+
+    counts_path = os.path.join(os.path.dirname(path), "fake_call_counts.json")
+    with locked(counts_path):
+        counts = {}
+        if os.path.isfile(counts_path):
+            with open(counts_path, "r") as f:
+                counts = json.loads(f.read())
+        counts[tool] = counts.get(tool, 0) + 1
+        with open(counts_path, "w") as f:
+            f.write(json.dumps(counts))
+
+    return counts[tool]
+
+
+def source_chapters(work_id):
+    """The number of chapters the work with this id has "on AO3"."""
+    return 1 + int(work_id) % 40
+
+
+def make_book(book_id, work_id, chapters):
+    return {
+        "id": book_id,
+        "url": f"https://archiveofourown.org/works/{work_id}",
+        "title": f"Work {work_id}",
+        "chapters": chapters,
+        "words": chapters * WORDS_PER_CHAPTER,
+        "status": "Completed" if chapters == source_chapters(work_id) else "",
+        "fields": {},
+    }
+
+
+def write_epub(path, url, chapters):
+    with open(path, "w") as f:
+        f.write(json.dumps({"url": url, "chapters": chapters}))
+        f.write("\n" + " " * (chapters * WORDS_PER_CHAPTER * EPUB_BYTES_PER_WORD))
+
+
+def read_epub(path):
+    with open(path, "r") as f:
+        return json.loads(f.readline())
+
+
+def create_library(library_path, books, columns):
+    os.makedirs(library_path, exist_ok=True)
+    library = {
+        "books": books,
+        "next_id": max([b["id"] for b in books], default=0) + 1,
+        "columns": columns,
+    }
+    with open(os.path.join(library_path, LIBRARY_FILENAME), "w") as f:
+        f.write(json.dumps(library))
+
+
+def _get_option(args, name):
+    for i, arg in enumerate(args):
+        if arg.startswith(f"{name}="):
+            return arg.split("=", 1)[1]
+        if arg == name and i + 1 < len(args):
+            return args[i + 1]
+    return None
+
+
+def _positional(args):
+    positional = []
+    skip_next = False
+    for arg in args:
+        if skip_next:
+            skip_next = False
+        elif arg in ["--to-dir", "--search", "--fields", "--with-library"]:
+            skip_next = True
+        elif not arg.startswith("-"):
+            positional.append(arg)
+    return positional
+
+
+def _matching_books(library, query):
+    urls = {f"https://archiveofourown.org/works/{i}" for i in work_url.findall(query)}
+    return [b for b in library["books"] if b["url"] in urls]
+
+
+def _no_matches(query):
+    print(f"No books matching the search expression: {query}", file=sys.stderr)
+    return 1
+
+
+def calibredb(args):
+    config = get_config()
+    count_call("calibredb")
+    time.sleep(config["calibredb_startup_seconds"])
+    if not args:
+        print("Usage: calibredb command [options] [arguments]")
+        return 0
+
+    library_path = _get_option(args, "--with-library")
+    path = os.path.join(library_path, LIBRARY_FILENAME)
+    with locked(path):
+        with open(path, "r") as f:
+            library = json.loads(f.read())
+        time.sleep(
+            config["calibredb_seconds_per_10000_books"] * len(library["books"]) / 10000
+        )
+
+        command, args = args[0], args[1:]
+        result, changed = _run_calibredb_command(library, command, args)
+        if changed:
+            with open(path + ".tmp", "w") as f:
+                f.write(json.dumps(library))
+            os.replace(path + ".tmp", path)
+
+    return result
+
+
+def _run_calibredb_command(library, command, args):  # noqa: C901
+    """Returns the exit code, and whether the library was changed."""
+    positional = _positional(args)
+    if command == "custom_columns":
+        for i, column in enumerate(library["columns"], 1):
+            print(f"{column} ({i})")
+    elif command == "add_custom_column":
+        library["columns"].append(positional[0])
+        return 0, True
+    elif command == "search":
+        query = " ".join(positional)
+        books = _matching_books(library, query)
+        if not books:
+            return _no_matches(query), False
+        print(",".join(str(b["id"]) for b in books))
+    elif command == "list":
+        query = _get_option(args, "--search")
+        books = _matching_books(library, query)
+        if not books:
+            return _no_matches(query), False
+        print(
+            json.dumps(
+                [
+                    {
+                        "id": b["id"],
+                        "title": b["title"],
+                        "*identifier": f"url:{b['url']}",
+                        "*words": b["words"],
+                        "*status": [b["status"]] if b["status"] else [],
+                    }
+                    for b in books
+                ]
+            )
+        )
+    elif command == "export":
+        directory = _get_option(args, "--to-dir")
+        ids = {int(i) for i in ",".join(positional).split(",")}
+        for book in library["books"]:
+            if book["id"] in ids:
+                write_epub(
+                    os.path.join(directory, f"{book['id']}.epub"),
+                    book["url"],
+                    book["chapters"],
+                )
+    elif command == "add":
+        epub = read_epub(positional[0])
+        book = make_book(
+            library["next_id"], work_url.search(epub["url"]).group(1), epub["chapters"]
+        )
+        library["books"].append(book)
+        library["next_id"] += 1
+        print(f"Added book ids: {book['id']}")
+        return 0, True
+    elif command == "remove":
+        ids = {int(i) for i in positional[0].split(",")}
+        library["books"] = [b for b in library["books"] if b["id"] not in ids]
+        return 0, True
+    elif command == "set_metadata":
+        book_id = int(positional[0])
+        fields = [a.split("=", 1)[1] for a in args if a.startswith("--field=")]
+        for book in library["books"]:
+            if book["id"] == book_id:
+                for field in fields:
+                    name, value = field.split(":", 1)
+                    book["fields"][name] = value
+        return 0, True
+    else:
+        print(f"Fake calibredb doesn't support the command {command}", file=sys.stderr)
+        return 1, False
+
+    return 0, False
+
+
+def calibre_debug(args):
+    config = get_config()
+    count_call("calibre-debug")
+    time.sleep(config["calibre_debug_startup_seconds"])
+    return 0
+
+
+def fanficfare(args):
+    config = get_config()
+    calls = count_call("fanficfare")
+    time.sleep(config["fanficfare_startup_seconds"])
+
+    target = args[-1]
+    if config["rate_limit_every"] and calls % config["rate_limit_every"] == 0:
+        print(f"Failed to download {target}: HTTP Error 429: Too Many Requests")
+        return 1
+
+    epub = None
+    if target.endswith(".epub"):
+        epub = read_epub(target)
+        target = epub["url"]
+    work_id = work_url.search(target).group(1)
+    chapters = source_chapters(work_id)
+
+    if "--meta-only" in args:
+        print(json.dumps(_get_metadata(work_id, chapters, None)))
+        return 0
+
+    chapters_to_fetch = chapters
+    if epub and "--force" not in args:
+        if epub["chapters"] >= chapters and "--update-epub-always" not in args:
+            print(f"{args[-1]} already contains {epub['chapters']} chapters.")
+            return 0
+        chapters_to_fetch = chapters - epub["chapters"]
+
+    time.sleep(config["chapter_seconds"] * chapters_to_fetch)
+    # Like FanFicFare, an epub that's being updated is written over in place.
+    output_filename = args[-1] if epub else f"Work_{work_id}-ao3_{work_id}.epub"
+    write_epub(output_filename, target, chapters)
+    print(json.dumps(_get_metadata(work_id, chapters, output_filename)))
+    return 0
+
+
+def _get_metadata(work_id, chapters, output_filename):
+    metadata = {
+        "title": f"Work {work_id}",
+        "author": "Benchmark Author",
+        "storyId": work_id,
+        "numWords": f"{chapters * WORDS_PER_CHAPTER:,}",
+        "numChapters": str(chapters),
+        "dateUpdated": "2025-01-01",
+        "series": "",
+        "zchapters": [
+            [
+                i,
+                {
+                    "url": f"https://archiveofourown.org/works/{work_id}/chapters/{i}",
+                    "date": "2025-01-01",
+                },
+            ]
+            for i in range(1, chapters + 1)
+        ],
+    }
+    for key in ["series00", "series01", "series02", "series03"]:
+        metadata[key] = ""
+    for tag_type in TAG_TYPES:
+        metadata[tag_type] = ""
+    metadata["fandoms"] = "Benchmark Fandom"
+    metadata["status"] = "Completed"
+    if output_filename:
+        metadata["output_filename"] = output_filename
+    return metadata
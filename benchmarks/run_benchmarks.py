@@ -0,0 +1,278 @@
+# encoding: utf-8
+"""Run download benchmarks offline, against fake calibredb, calibre-debug and
+fanficfare executables (see fake_tools.py).
+
+Usage:
+    python benchmarks/run_benchmarks.py [SCENARIO ...] [--workers N] [--output FILE]
+
+Each download scenario creates a fake Calibre library and a file of urls, runs the
+download command on them and reports throughput, wall time and the number of
+subprocesses run, from the run report the download command writes.
+
+Each url collection scenario starts a fake AO3 (see fake_ao3_server.py) and runs the
+download command with --dry-run against it, reporting wall time, the time spent on
+each source and the number of requests made.
+"""
+import json
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import monotonic
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from fake_ao3_server import start_server  # noqa: E402
+from fake_tools import (  # noqa: E402
+    CONFIG_ENV_VARIABLE,
+    DEFAULT_CONFIG,
+    create_library,
+    make_book,
+    source_chapters,
+)
+
+from src.utils import TAG_TYPES  # noqa: E402
+
+FANFICMANAGEMENT = os.path.join(os.path.dirname(BENCHMARKS_DIR), "fanficmanagement.py")
+FAKES_BIN_DIR = os.path.join(BENCHMARKS_DIR, "bin")
+LIBRARY_COLUMNS = ["words", "series00", "series01", "series02", "series03"] + TAG_TYPES
+
+# urls: how many urls to download.
+# updates: the fraction of those urls that are already in the library, with fewer
+# chapters than the work has now. The rest are new to the library.
+# library_size: how many books are in the library.
+# fakes: overrides of fake_tools.DEFAULT_CONFIG.
+# For url collection scenarios, ao3 has overrides of fake_ao3_server.DEFAULT_SETTINGS,
+# and sources are the sources to collect urls from.
+SCENARIOS = {
+    "smoke": {
+        "urls": 20,
+        "updates": 0.2,
+        "library_size": 500,
+        "fakes": {
+            "calibredb_startup_seconds": 0.05,
+            "calibre_debug_startup_seconds": 0.1,
+            "fanficfare_startup_seconds": 0.05,
+            "chapter_seconds": 0.005,
+        },
+    },
+    "1k-urls-20pc-updates-30k-library": {
+        "urls": 1000,
+        "updates": 0.2,
+        "library_size": 30000,
+        "fakes": {},
+    },
+    "rate-limited": {
+        "urls": 100,
+        "updates": 0.2,
+        "library_size": 5000,
+        "fakes": {"rate_limit_every": 10},
+    },
+    "updates-only": {
+        "urls": 200,
+        "updates": 1.0,
+        "library_size": 30000,
+        "fakes": {},
+    },
+    "collect-20k-bookmarks": {
+        "sources": ["bookmarks", "later"],
+        "ao3": {"bookmarks": 20000, "later": 2000},
+    },
+    "collect-subscriptions": {
+        "sources": ["all_subscriptions"],
+        "ao3": {"work_subscriptions": 1000, "series_subscriptions": 200},
+    },
+    "collect-rate-limited": {
+        "sources": ["bookmarks"],
+        "ao3": {"bookmarks": 2000, "rate_limit_every": 25},
+    },
+}
+
+
+def set_up_scenario(directory, scenario):
+    """Create the fake library, the input file and the fakes' config, and return
+    the path of the input file."""
+    update_count = int(scenario["urls"] * scenario["updates"])
+    # Work ids of books in the library start at 1, new works come after them.
+    books = []
+    for book_id in range(1, scenario["library_size"] + 1):
+        chapters = source_chapters(book_id)
+        if book_id <= update_count and chapters > 1:
+            chapters -= 1
+        books.append(make_book(book_id, book_id, chapters))
+    create_library(os.path.join(directory, "library"), books, LIBRARY_COLUMNS)
+
+    first_new_work = scenario["library_size"] + 1
+    work_ids = list(range(1, update_count + 1)) + list(
+        range(first_new_work, first_new_work + scenario["urls"] - update_count)
+    )
+    input_path = os.path.join(directory, "urls.txt")
+    with open(input_path, "w") as f:
+        for work_id in work_ids:
+            f.write(f"https://archiveofourown.org/works/{work_id}\n")
+
+    with open(os.path.join(directory, "fakes.json"), "w") as f:
+        f.write(json.dumps(dict(DEFAULT_CONFIG, **scenario["fakes"])))
+
+    return input_path
+
+
+def run_collection_scenario(name, scenario, keep):
+    server, url = start_server(scenario["ao3"])
+    directory = mkdtemp(prefix=f"benchmark-{name}-")
+    try:
+        report_path = os.path.join(directory, "report.json")
+        command = [
+            sys.executable,
+            FANFICMANAGEMENT,
+            "download",
+            f"--sources={','.join(scenario['sources'])}",
+            f"--mirror={url}",
+            "--user=benchmark",
+            f"--cookie={server.RequestHandlerClass.fake_ao3.settings['cookie']}",
+            "--dry-run",
+            f"--input={os.path.join(directory, 'urls.txt')}",
+            f"--last-update-file={os.path.join(directory, 'last_update.json')}",
+            f"--report={report_path}",
+        ]
+
+        start = monotonic()
+        subprocess.run(
+            command,
+            cwd=directory,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.STDOUT,
+            check=True,
+        )
+        wall_seconds = monotonic() - start
+
+        with open(report_path, "r") as f:
+            run_report = json.loads(f.read())
+
+        return {
+            "scenario": name,
+            "wall_seconds": round(wall_seconds, 2),
+            "http_requests": run_report["counters"]["http_requests"],
+            "server": dict(server.RequestHandlerClass.fake_ao3.stats),
+            "phases": {
+                phase: stats["total_seconds"]
+                for phase, stats in run_report["phases"].items()
+            },
+        }
+    finally:
+        server.shutdown()
+        if keep:
+            print(f"Kept the files for {name} in {directory}")
+        else:
+            rmtree(directory, ignore_errors=True)
+
+
+def run_scenario(name, scenario, workers, keep):
+    directory = mkdtemp(prefix=f"benchmark-{name}-")
+    try:
+        input_path = set_up_scenario(directory, scenario)
+        report_path = os.path.join(directory, "report.json")
+        command = [
+            sys.executable,
+            FANFICMANAGEMENT,
+            "download",
+            "--sources=file",
+            f"--input={input_path}",
+            f"--library={os.path.join(directory, 'library')}",
+            "--user=benchmark",
+            "--cookie=benchmark",
+            f"--cache-dir={os.path.join(directory, 'cache')}",
+            f"--last-update-file={os.path.join(directory, 'last_update.json')}",
+            f"--report={report_path}",
+            f"--workers={workers}",
+        ]
+        env = dict(
+            os.environ,
+            PATH=FAKES_BIN_DIR + os.pathsep + os.environ["PATH"],
+            **{CONFIG_ENV_VARIABLE: os.path.join(directory, "fakes.json")},
+        )
+
+        start = monotonic()
+        subprocess.run(
+            command,
+            cwd=directory,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.STDOUT,
+            check=True,
+        )
+        wall_seconds = monotonic() - start
+
+        with open(report_path, "r") as f:
+            run_report = json.loads(f.read())
+        with open(input_path, "r") as f:
+            failed = len([line for line in f if line.strip()])
+
+        return {
+            "scenario": name,
+            "workers": workers,
+            "urls": scenario["urls"],
+            "failed": failed,
+            "wall_seconds": round(wall_seconds, 2),
+            "works_per_minute": round(
+                (scenario["urls"] - failed) / wall_seconds * 60, 1
+            ),
+            "subprocess_spawns": run_report["counters"]["subprocess_spawns_by_command"],
+            "phases": {
+                phase: stats["total_seconds"]
+                for phase, stats in run_report["phases"].items()
+            },
+        }
+    finally:
+        if keep:
+            print(f"Kept the files for {name} in {directory}")
+        else:
+            rmtree(directory, ignore_errors=True)
+
+
+def main():
+    arg_parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    arg_parser.add_argument(
+        "scenarios",
+        nargs="*",
+        default=["smoke"],
+        help=f"Scenarios to run, from: {', '.join(SCENARIOS)}. Default: smoke.",
+    )
+    arg_parser.add_argument("--workers", type=int, default=1)
+    arg_parser.add_argument("--output", help="Also write the results to this file.")
+    arg_parser.add_argument(
+        "--keep", action="store_true", help="Don't delete the files of each run."
+    )
+    args = arg_parser.parse_args()
+
+    results = []
+    for name in args.scenarios:
+        scenario = SCENARIOS[name]
+        if "ao3" in scenario:
+            result = run_collection_scenario(name, scenario, args.keep)
+            results.append(result)
+            print(
+                f"{name}: {result['wall_seconds']}s wall time, "
+                f"{result['http_requests']} requests, server: {result['server']}"
+            )
+            continue
+
+        result = run_scenario(name, scenario, args.workers, args.keep)
+        results.append(result)
+        print(
+            f"{name}: {result['works_per_minute']} works/minute, "
+            f"{result['wall_seconds']}s wall time, {result['failed']} failed, "
+            f"subprocesses: {result['subprocess_spawns']}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
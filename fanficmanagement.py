@@ -1,24 +1,42 @@
 #! /usr/bin/env python
 # encoding: utf-8
-import locale
 import sys
 from argparse import ArgumentTypeError
+from importlib import import_module
 
-from src.analyse import analyse
-from src.download import download
+from src.exceptions import InvalidConfig
 from src.options import set_up_options
+from src.profiling import start_profiling, stop_profiling
 from src.utils import get_options_for_display
 
+# Each command is only imported when it's run, so that e.g. --help doesn't have to
+# wait for all of them and their dependencies to be imported.
+COMMAND_MODULES = {
+    "download": "src.download",
+    "analyse": "src.analyse",
+    "watch": "src.watch",
+    "retag": "src.retag",
+    "tags": "src.tags",
+    "backfill": "src.backfill",
+}
+
 if __name__ == "__main__":
-    # The locale for AO3, for converting formatted numbers.
-    locale.setlocale(locale.LC_ALL, "en_US.UTF-8")
     try:
         command, options = set_up_options()
     except ArgumentTypeError as e:
         sys.exit(str(e))
+    except InvalidConfig as e:
+        sys.exit(e.message)
 
     print(f"\nNow running the command {options.command} with the following options:")
     print(get_options_for_display(options))
 
-    permitted_commands = {"download": download, "analyse": analyse}
-    eval(command + "(options)", permitted_commands, {"options": options})
+    if options.profile:
+        start_profiling(options.profile)
+    try:
+        run_command = getattr(import_module(COMMAND_MODULES[command]), command)
+        run_command(options)
+    finally:
+        if options.profile:
+            stop_profiling()
+            print(f"\nWrote profile to {options.profile}")
@@ -1,147 +1,64 @@
-import json
-import re
-from os import listdir
-from os.path import isfile, join
-from subprocess import PIPE, STDOUT, check_output
+# encoding: utf-8
+import os.path
+import sys
 from sys import argv
-from tempfile import mkdtemp
 
-from ebooklib import epub
+# Run from anywhere, e.g. python scripts/add_stories_to_multiple_series.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
-# The AO3 metadata that we get from FanficFare includes these series keys as well as
-# "series". Since "series" is a default Calibre field, we can ignore it here.
-AO3_SERIES_KEYS = ["series00", "series01", "series02", "series03"]
-PATH = '"/home/rae/Calibre Fanfic Library"'
-ADD_GROUPED_SEARCH_SCRIPT = """from calibre.library import db
+from src.calibre import CalibreHelper  # noqa: E402
+from src.epub_scan import scan_epubs  # noqa: E402
 
-db = db(%s).new_api
-db.set_pref("grouped_search_terms", {"allseries": ["series", "series00", "series01", "series02", "series03"]})
-print(db.pref("grouped_search_terms"))
-"""
-series_link_pattern = re.compile(
-    r'<a class="serieslink" href="https://archiveofourown\.org/series/([\d]+)">(.+) \[[\d]*]</a>'
-)
+PATH = "/home/rae/Calibre Fanfic Library"
 
 
-def check_or_create_extra_series_columns(path):
-    res = check_output(
-        f"calibredb custom_columns --with-library {path}",
-        shell=True,
-        stderr=STDOUT,
-        stdin=PIPE,
-    )
-    # Get rid of the number after each column name, e.g. "columnname (1)"
-    columns = [c.split(" ")[0] for c in res.decode("utf-8").split("\n")]
-    if set(columns).intersection(AO3_SERIES_KEYS) == set(AO3_SERIES_KEYS):
-        print("Custom AO3 series columns are in Calibre Library")
-    else:
-        print("Adding custom AO3 series columns to Calibre library")
-        for c in AO3_SERIES_KEYS:
-            check_output(
-                f"calibredb add_custom_column --with-library {path} {c} {c} series",
-                shell=True,
-                stderr=STDOUT,
-                stdin=PIPE,
-            )
-
-    print("Adding grouped search term 'allseries' to Calibre Library")
-    _add_grouped_search_terms(path)
-
-
-def _add_grouped_search_terms(path):
-    # Add a new grouped search term "allseries" so that Calibre can search across all
-    # the series columns.
-    script = ADD_GROUPED_SEARCH_SCRIPT % path
-    res = check_output(
-        f"calibre-debug -c '{script}'",
-        shell=True,
-        stderr=STDOUT,
-        stdin=PIPE,
-    )
-    print(res)
-
-
-def find_books_in_series(path):
-    res = check_output(
-        f"calibredb list --with-library {path} --search series:true "
-        f"--fields id,series,series_index --for-machine",
-        shell=True,
-        stderr=STDOUT,
-        stdin=PIPE,
-    )
-    book_data = json.loads(res.decode("utf-8"))
-    print(f"Found data about {len(book_data)} books that belong to series")
-    return book_data
-
-
-def filter_books_in_multiple_series(path, book_data):
-    n = 0
+def filter_books_in_multiple_series(calibre, paths):
+    """Find the series on the epub title pages that aren't the series saved for the
+    books in Calibre, and return their ids."""
     series_ids_to_import = []
-    for book in book_data:
-        if n % 10 == 0:
-            print(f"Processed {str(n)} books")
-
-        series_1 = book["series"]
-        loc = mkdtemp()
-        check_output(
-            f"calibredb export --dont-save-cover --dont-write-opf --single-dir"
-            f" --to-dir \"{loc}\" --with-library {path} {book['id']}",
-            shell=True,
-            stdin=PIPE,
-            stderr=STDOUT,
-        )
-        story_file = _get_files(loc, ".epub", True)[0]
-        book = epub.read_epub(story_file)
-        title_page = book.get_item_with_id("title_page")
-        html = str(title_page.get_body_content())
-
-        m2 = series_link_pattern.search(html)
-        if m2:
-            series_2 = m2.group(2).replace("\\'", "'")
-            series_2_id = m2.group(1)
-            if series_1 != series_2:
-                series_ids_to_import.append(series_2_id)
-                print(
-                    f"{series_1} (series saved in Calibre) does not match {series_2} "
-                    f"({series_2_id}) (series in epub title page)"
-                )
-        else:
-            print("No series title found!")
-
+    n = 0
+    for book_id, fields in scan_epubs(paths):
         n += 1
+        if n % 1000 == 0:
+            print(f"Processed {n} books")
+
+        _, saved_series = calibre.get_metadata_values(book_id, ["series"])["series"]
+        if not saved_series:
+            continue
+        if "series" not in fields:
+            print(f"No series title found for book {book_id}!")
+            continue
+
+        series_1 = saved_series[0]
+        series_2_id, series_2 = fields["series"][0]
+        if series_1 != series_2 and series_2_id not in series_ids_to_import:
+            series_ids_to_import.append(series_2_id)
+            print(
+                f"{series_1} (series saved in Calibre) does not match {series_2} "
+                f"({series_2_id}) (series in epub title page)"
+            )
 
     return series_ids_to_import
 
 
-def _get_files(mypath, filetype=None, fullpath=False):
-    if filetype:
-        ans = [
-            f
-            for f in listdir(mypath)
-            if isfile(join(mypath, f)) and f.endswith(filetype)
-        ]
-    else:
-        ans = [f for f in listdir(mypath) if isfile(join(mypath, f))]
-    if fullpath:
-        return [join(mypath, f) for f in ans]
-    else:
-        return ans
-
-
 if __name__ == "__main__":
     path = PATH
     if len(argv) > 1:
         path = argv[1]
 
-    check_or_create_extra_series_columns(path)
+    # Adds the custom series columns and the grouped search term 'allseries', if
+    # they're missing.
+    calibre = CalibreHelper(library_path=path)
+    calibre.check_library()
 
-    # Next: export all fics from calibre that are in a series.
     # It looks like, if a fic is in more than one series, we save it into a different
     # series than is added to the epub front page by fanficfare.
     # So, look for all fics that have more than one series according to that measure.
-
-    books_in_series = find_books_in_series(path)
-    series_to_reimport = filter_books_in_multiple_series(path, books_in_series)
+    # The title pages are read straight from the library's epubs, in parallel.
+    paths = calibre.get_all_format_paths()
+    if paths is None:
+        sys.exit("The epubs can only be read in a local Calibre library.")
+    series_to_reimport = filter_books_in_multiple_series(calibre, paths)
 
     # Then output series ids so they can be manually reimported.
     print(
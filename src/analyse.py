@@ -1,5 +1,4 @@
 # encoding: utf-8
-import locale
 from csv import DictWriter
 from datetime import datetime
 from os import mkdir
@@ -25,7 +24,7 @@ from .options import (
     SOURCE_USER_SUBSCRIPTIONS,
     SOURCE_WORK_SUBSCRIPTIONS,
 )
-from .utils import AO3_DEFAULT_URL, Bcolors, log, setup_login
+from .utils import AO3_DEFAULT_URL, Bcolors, log, parse_ao3_number, setup_login
 
 
 def _compare_user_subscriptions(
@@ -100,7 +99,7 @@ def _compare_series_subscriptions(
         writer = DictWriter(f, ["id", "title", "works on AO3", "works in Calibre"])
         writer.writeheader()
         for series_id, stats in ao3_series_work_stats.items():
-            ao3_count = locale.atoi(stats["Works"])
+            ao3_count = parse_ao3_number(stats["Works"])
             if ao3_count > calibre_series_work_counts[stats["Title"]]:
                 series_missing_works[series_id] = stats["Title"]
 
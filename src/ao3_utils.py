@@ -1,11 +1,53 @@
 # encoding: utf-8
-from ao3 import AO3
-
+from . import report, tracing
 from .utils import AO3_DEFAULT_URL
 
 AO3_SERIES_KEYS = ["series00", "series01", "series02", "series03"]
 
+# Logged-in AO3 clients by (user, cookie, ao3_url), if they are being kept between
+# calls. Otherwise, we log in again every time.
+_api_cache = None
+
+
+def keep_sessions():
+    """Log in to AO3 only once per user and reuse the session from then on, e.g.
+    when watching for new urls for a long time."""
+    global _api_cache
+    if _api_cache is None:
+        _api_cache = {}
+
+
+def _count_http_request(response, *args, **kwargs):
+    report.count("http_requests")
+    tracing.add_span_ending_now(
+        f"{response.request.method} {response.url}",
+        response.elapsed.total_seconds(),
+        category="http",
+        args={"status": response.status_code},
+    )
+
+
+def _get_api(user, cookie, ao3_url):
+    if _api_cache is not None and (user, cookie, ao3_url) in _api_cache:
+        return _api_cache[(user, cookie, ao3_url)]
+
+    # Imported here because the AO3 client and its dependencies are slow to import.
+    from ao3 import AO3
+
+    api = AO3(ao3_url=ao3_url)
+    api.login(user, cookie)
+    # Count and trace the requests made to AO3.
+    session = getattr(api, "session", None)
+    if session is not None and hasattr(session, "hooks"):
+        session.hooks.setdefault("response", []).append(_count_http_request)
+
+    if _api_cache is not None:
+        _api_cache[(user, cookie, ao3_url)] = api
+
+    return api
+
 
+@report.timed("collect:bookmarks")
 def get_ao3_bookmark_urls(
     user,
     cookie,
@@ -18,8 +60,7 @@ def get_ao3_bookmark_urls(
     if max_count == 0:
         return set([])
 
-    api = AO3(ao3_url=ao3_url)
-    api.login(user, cookie)
+    api = _get_api(user, cookie, ao3_url)
     urls = [
         _work_url_from_id(work_id)
         for work_id in api.user.bookmarks_ids(
@@ -29,6 +70,7 @@ def get_ao3_bookmark_urls(
     return set(urls)
 
 
+@report.timed("collect:user_works")
 def get_ao3_users_work_urls(
     user, cookie, username, max_count, oldest_date, ao3_url=AO3_DEFAULT_URL
 ):
@@ -36,8 +78,7 @@ def get_ao3_users_work_urls(
     if max_count == 0:
         return set([])
 
-    api = AO3(ao3_url=ao3_url)
-    api.login(user, cookie)
+    api = _get_api(user, cookie, ao3_url)
     urls = [
         _work_url_from_id(work_id)
         for work_id in api.author(username).work_ids(max_count, oldest_date)
@@ -45,12 +86,12 @@ def get_ao3_users_work_urls(
     return set(urls)
 
 
+@report.timed("collect:gifts")
 def get_ao3_gift_urls(user, cookie, max_count, oldest_date, ao3_url=AO3_DEFAULT_URL):
     if max_count == 0:
         return set([])
 
-    api = AO3(ao3_url=ao3_url)
-    api.login(user, cookie)
+    api = _get_api(user, cookie, ao3_url)
     urls = [
         _work_url_from_id(work_id)
         for work_id in api.user.gift_ids(max_count, oldest_date)
@@ -58,14 +99,14 @@ def get_ao3_gift_urls(user, cookie, max_count, oldest_date, ao3_url=AO3_DEFAULT_
     return set(urls)
 
 
+@report.timed("collect:later")
 def get_ao3_marked_for_later_urls(
     user, cookie, max_count, oldest_date, ao3_url=AO3_DEFAULT_URL
 ):
     if max_count == 0:
         return set([])
 
-    api = AO3(ao3_url=ao3_url)
-    api.login(user, cookie)
+    api = _get_api(user, cookie, ao3_url)
     urls = [
         _work_url_from_id(work_id)
         for work_id in api.user.marked_for_later_ids(max_count, oldest_date)
@@ -73,6 +114,7 @@ def get_ao3_marked_for_later_urls(
     return set(urls)
 
 
+@report.timed("collect:work_subscriptions")
 def get_ao3_work_subscription_urls(
     user, cookie, max_count, oldest_date=None, ao3_url=AO3_DEFAULT_URL
 ):
@@ -85,8 +127,7 @@ def get_ao3_work_subscription_urls(
     if max_count == 0:
         return set([])
 
-    api = AO3(ao3_url=ao3_url)
-    api.login(user, cookie)
+    api = _get_api(user, cookie, ao3_url)
 
     if oldest_date:
         urls = []
@@ -113,14 +154,14 @@ def _work_url_from_id(work_id):
     return f"{AO3_DEFAULT_URL}/works/{work_id}"
 
 
+@report.timed("collect:series_subscriptions")
 def get_ao3_series_subscription_urls(
     user, cookie, max_count, oldest_date=None, ao3_url=AO3_DEFAULT_URL
 ):
     if max_count == 0:
         return set([])
 
-    api = AO3(ao3_url=ao3_url)
-    api.login(user, cookie)
+    api = _get_api(user, cookie, ao3_url)
     series_ids = api.user.series_subscription_ids(max_count)
 
     urls = []
@@ -133,14 +174,14 @@ def get_ao3_series_subscription_urls(
     return set(urls)
 
 
+@report.timed("collect:user_subscriptions")
 def get_ao3_user_subscription_urls(
     user, cookie, max_count, oldest_date=None, ao3_url=AO3_DEFAULT_URL
 ):
     if max_count == 0:
         return set([])
 
-    api = AO3(ao3_url=ao3_url)
-    api.login(user, cookie)
+    api = _get_api(user, cookie, ao3_url)
     user_ids = api.user.user_subscription_ids(max_count)
 
     urls = []
@@ -154,14 +195,14 @@ def get_ao3_user_subscription_urls(
     return set(urls)
 
 
+@report.timed("collect:series")
 def get_ao3_series_work_urls(
     user, cookie, max_count, series_id, oldest_date=None, ao3_url=AO3_DEFAULT_URL
 ):
     if max_count == 0:
         return set([])
 
-    api = AO3(ao3_url=ao3_url)
-    api.login(user, cookie)
+    api = _get_api(user, cookie, ao3_url)
 
     urls = [
         _work_url_from_id(work_id)
@@ -171,14 +212,14 @@ def get_ao3_series_work_urls(
     return set(urls)
 
 
+@report.timed("collect:collections")
 def get_ao3_collection_work_urls(
     user, cookie, max_count, collection_id, oldest_date=None, ao3_url=AO3_DEFAULT_URL
 ):
     if max_count == 0:
         return set([])
 
-    api = AO3(ao3_url=ao3_url)
-    api.login(user, cookie)
+    api = _get_api(user, cookie, ao3_url)
 
     urls = [
         _work_url_from_id(work_id)
@@ -189,8 +230,7 @@ def get_ao3_collection_work_urls(
 
 
 def get_ao3_subscribed_users_work_counts(user, cookie, ao3_url=AO3_DEFAULT_URL):
-    api = AO3(ao3_url=ao3_url)
-    api.login(user, cookie)
+    api = _get_api(user, cookie, ao3_url)
     user_ids = api.user.user_subscription_ids()
 
     counts = {}
@@ -201,8 +241,7 @@ def get_ao3_subscribed_users_work_counts(user, cookie, ao3_url=AO3_DEFAULT_URL):
 
 
 def get_ao3_subscribed_series_work_stats(user, cookie, ao3_url=AO3_DEFAULT_URL):
-    api = AO3(ao3_url=ao3_url)
-    api.login(user, cookie)
+    api = _get_api(user, cookie, ao3_url)
     series_ids = api.user.series_subscription_ids()
 
     stats = {}
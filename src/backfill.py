@@ -0,0 +1,91 @@
+# encoding: utf-8
+from .calibre import CalibreException, CalibreHelper
+from .epub_scan import scan_epubs
+from .utils import Bcolors, log, normalise_tag
+
+# How many books' metadata is written at a time, while the rest are still being read.
+BACKFILL_CHUNK_SIZE = 5000
+
+
+def get_backfill_options(fields):
+    """Get the options for set_metadata from the fields of a book's title page."""
+    options = {}
+    if "words" in fields:
+        options["#words"] = fields["words"]
+    if "rating" in fields:
+        options["#rating"] = normalise_tag(fields["rating"])
+    return options
+
+
+def _log_progress(scanned, total):
+    log(f"PROGRESS: {scanned}/{total}, {scanned * 100 / total:.0f}%")
+
+
+def backfill(options):
+    if not options.library:
+        log(
+            """To backfill a Calibre library, a path to the library is required.
+
+Example: \"/home/myuser/Calibre Library\"""",
+            Bcolors.FAIL,
+        )
+        return
+
+    calibre = CalibreHelper(
+        library_path=options.library,
+        user=options.calibre_user,
+        password=options.calibre_password,
+    )
+
+    try:
+        calibre.check_library()
+    except CalibreException as e:
+        log(str(e), Bcolors.FAIL)
+        return
+
+    paths = calibre.get_all_format_paths()
+    if paths is None:
+        log(
+            "Only the epub files of a local Calibre library can be read, not those "
+            "on a Calibre server.",
+            Bcolors.FAIL,
+        )
+        return
+
+    log(
+        f"Reading the word count and rating of {len(paths)} books from their epubs",
+        Bcolors.HEADER,
+    )
+    field_counts = {}
+    updates = {}
+    scanned = 0
+    try:
+        for book_id, fields in scan_epubs(paths):
+            scanned += 1
+            # Only the values that are missing or different are written.
+            book_options = calibre.get_changed_metadata(
+                book_id, get_backfill_options(fields)
+            )
+            for field in book_options:
+                field_counts[field] = field_counts.get(field, 0) + 1
+            if book_options and not options.dry_run:
+                updates[book_id] = book_options
+
+            if len(updates) >= BACKFILL_CHUNK_SIZE:
+                calibre.set_metadata_many(updates)
+                updates = {}
+                _log_progress(scanned, len(paths))
+
+        if updates:
+            calibre.set_metadata_many(updates)
+    except CalibreException as e:
+        log(f"Error backfilling books: {e.message}", Bcolors.FAIL)
+        return
+
+    log(f"Read the title pages of {scanned} books.", Bcolors.OKGREEN)
+    if options.dry_run:
+        log("Dry run: not changing the library. Books to backfill for each column:")
+    else:
+        log("Books backfilled for each column:")
+    for field in sorted(field_counts):
+        log(f"\t{field}: {field_counts[field]}", Bcolors.OKBLUE)
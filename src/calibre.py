@@ -1,13 +1,21 @@
 # encoding: utf-8
 import json
 import os.path
-from errno import ENOENT
-from os import devnull
-from subprocess import CalledProcessError, call
+import re
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from shutil import which
+from subprocess import CalledProcessError
+from threading import Lock
+from time import monotonic
+from urllib.parse import quote as quote_url
 from urllib.parse import urlparse
 
+from . import report
 from .ao3_utils import AO3_SERIES_KEYS
-from .utils import TAG_TYPES, Bcolors, check_subprocess_output, log
+from .utils import TAG_TYPES, Bcolors, check_subprocess_output, clone_file, log
 
 ADD_GROUPED_SEARCH_SCRIPT = """from calibre.library import db
 
@@ -16,6 +24,80 @@ db.set_pref("grouped_search_terms", {"allseries": ["series", "#series00", "#seri
 print(db.pref("grouped_search_terms"))
 """
 
+# calibredb commands are killed after this long. Searching a large library over the
+# network can take minutes.
+CALIBRE_TIMEOUT_SECONDS = 10 * 60
+READ_RETRIES = 1
+# Searches for more urls than this are split up, so that the command stays well within
+# the limits on the length of a command line, and calibre's search parser stays fast.
+MAX_URLS_PER_SEARCH = 200
+MAX_SEARCH_LENGTH = 20000
+# How many searches to run at once against a Calibre server. Local libraries are
+# searched one at a time.
+SERVER_SEARCH_WORKERS = 4
+# SQLite's limit on the number of parameters in one query is 999 in older versions.
+MAX_SQL_PARAMETERS = 900
+
+series_with_index = re.compile(r"^(.*?)(?:\s*\[(\d+(?:\.\d+)?)\])?$")
+
+# Increase SCHEMA_VERSION whenever SCHEMA_COLUMNS or MIGRATE_SCHEMA_SCRIPT change, so
+# that libraries that were already migrated get migrated again.
+SCHEMA_VERSION = 1
+SCHEMA_VERSION_PREF = "fanficmanagement_schema_version"
+# (label, name, datatype, is_multiple) of each of our custom columns.
+SCHEMA_COLUMNS = (
+    [("words", "Words", "int", False)]
+    + [(c, c, "series", False) for c in AO3_SERIES_KEYS]
+    + [(tag, tag, "text", True) for tag in TAG_TYPES]
+)
+# Adds all the missing custom columns and the grouped search term 'allseries', then
+# records the schema version, in a single calibre process.
+MIGRATE_SCHEMA_SCRIPT = """from calibre.library import db
+
+db = db(%(path)r).new_api
+existing = {c[1:] for c in db.field_metadata.custom_field_keys()}
+for label, name, datatype, is_multiple in %(columns)r:
+    if label not in existing:
+        db.create_custom_column(label, name, datatype, is_multiple)
+        print("Added custom column " + label)
+terms = db.pref("grouped_search_terms", {})
+terms["allseries"] = ["series"] + ["#" + c for c in %(series_columns)r]
+db.set_pref("grouped_search_terms", terms)
+db.set_pref(%(version_pref)r, %(version)d)
+"""
+
+# Sets the fields of many books in a single calibre process. The updates are read from
+# a json file of batches of {field: {book_id: value}}; each field of a batch is set for
+# all its books at once, in one transaction.
+SET_METADATA_SCRIPT = """import json
+from calibre.library import db
+
+db = db(%(path)r).new_api
+with open(%(data_path)r) as f:
+    batches = json.load(f)
+for batch in batches:
+    for field, values in batch.items():
+        db.set_field(field, {int(book_id): value for book_id, value in values.items()})
+"""
+# Renames items of tag-like fields, by item id, in a single calibre process. The renames
+# are read from a json file of steps of {field: {item_id: new name}}, applied in order.
+# Renaming an item to the name of another item of the field merges them.
+RENAME_ITEMS_SCRIPT = """import json
+from calibre.library import db
+
+db = db(%(path)r).new_api
+with open(%(data_path)r) as f:
+    steps = json.load(f)
+for step in steps:
+    for field, names in step.items():
+        db.rename_items(field, {int(i): name for i, name in names.items()})
+"""
+# How many books set_metadata_many sets the fields of in each transaction, and in each
+# calibre process, which is killed if it runs for longer than CALIBRE_TIMEOUT_SECONDS.
+METADATA_BATCH_SIZE = 1000
+METADATA_BOOKS_PER_PROCESS = 10000
+SERIES_FIELDS = ["series"] + [f"#{key}" for key in AO3_SERIES_KEYS]
+
 
 class CalibreException(Exception):
     def __init__(self, message):
@@ -27,11 +109,35 @@ def clean_output(process_output):
     return process_output.replace("Initialized urlfixer\n", "")
 
 
-def check_and_clean_output(command):
+def check_and_clean_output(command, retries=0):
     """Runs a command as a subprocess, raising CalledProcessError if necessary,
     and removes the cruft calibredb adds to the output.
+
+    Commands that only read the library can be retried if they time out; commands
+    that change it must not be, in case they did before they were killed.
     """
-    return clean_output(check_subprocess_output(command))
+    return clean_output(
+        check_subprocess_output(
+            command, timeout=CALIBRE_TIMEOUT_SECONDS, retries=retries
+        )
+    )
+
+
+def escape_search_value(value):
+    """Escape a value for a quoted value in calibre's search syntax, where quotes and
+    backslashes are escaped with a backslash."""
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _any_of(location, values, prefix=""):
+    """Get a search term that matches any of the values in the location, e.g.
+    (formats:"=EPUB" OR formats:"=PDF")."""
+    all_values = "".join(values)
+    # Almost no values need escaping, and these searches can have many values.
+    if '"' in all_values or "\\" in all_values:
+        values = [escape_search_value(v) for v in values]
+    joined = f'" OR {location}:"{prefix}'.join(values)
+    return f'({location}:"{prefix}{joined}")'
 
 
 def collate_search_terms(
@@ -42,32 +148,211 @@ def collate_search_terms(
     All search terms of the same kind are joined with OR; each set of search terms
     is joined with AND. This is because this matches the current use cases I have
     for this method, and may well come back to bite me.
+
+    The query is passed to calibredb as a single argument, so it's only quoted for
+    calibre's own search syntax.
     """
     search_term_sets = []
     if authors:
-        # author:"=author or \(author\)"
         # This catches both exact use of the author name and use of a pseud,
         # e.g. "MyPseud (MyUsername)"
         search_term_sets.append(
-            " OR ".join([f'author:"={author} or \\({author}\\)"' for author in authors])
+            _any_of("author", [f"={a}" for a in authors] + [f"({a})" for a in authors])
         )
     if urls:
-        search_term_sets.append(f'Identifiers:url:"={" OR ".join(urls)}"')
+        search_term_sets.append(_any_of("identifiers", urls, prefix="url:="))
     if series:
         # Calibre seems to escape only the character & in series titles
         search_term_sets.append(
-            f'allseries:"=\\"{" OR ".join([s.replace("&", "&amp;") for s in series])}\\""'
+            _any_of("allseries", [s.replace("&", "&amp;") for s in series], prefix="=")
         )
     if book_formats:
         search_term_sets.append(
-            f'Format:"={" OR ".join([book_format.upper() for book_format in book_formats])}"'
+            _any_of("formats", [f.upper() for f in book_formats], prefix="=")
         )
     if incomplete:
-        search_term_sets.append("#status:=In-Progress")
+        search_term_sets.append("(#status:=In-Progress)")
 
     return " AND ".join(search_term_sets)
 
 
+def normalise_search_filters(
+    authors=None, book_formats=None, series=None, urls=None, incomplete=False
+):
+    """Sort and deduplicate search terms, so that the same search always gives the
+    same query."""
+    return {
+        "authors": sorted(set(authors or [])),
+        "book_formats": sorted(set(f.upper() for f in book_formats or [])),
+        "series": sorted(set(series or [])),
+        "urls": sorted(set(urls or [])),
+        "incomplete": incomplete,
+    }
+
+
+def get_search_filters_for_fields(fields):
+    """Get the search filters whose results can change when these metadata fields are
+    set."""
+    filters = set()
+    for field in fields:
+        if field == "authors":
+            filters.add("authors")
+        elif field == "identifiers":
+            filters.add("urls")
+        elif field == "series" or field.startswith("#series"):
+            filters.add("series")
+        elif field == "#status":
+            filters.add("incomplete")
+    return filters
+
+
+def chunk_urls(urls, max_count=None, max_length=None):
+    """Split urls into lists of at most max_count urls, and at most max_length
+    characters in total."""
+    max_count = max_count or MAX_URLS_PER_SEARCH
+    max_length = max_length or MAX_SEARCH_LENGTH
+    chunks = []
+    chunk = []
+    length = 0
+    for url in urls:
+        if chunk and (len(chunk) == max_count or length + len(url) > max_length):
+            chunks.append(chunk)
+            chunk = []
+            length = 0
+        chunk.append(url)
+        length += len(url) + len(" OR ")
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def parse_series(value):
+    """Split a series value like "My Series [2]" into its name and index. Calibre
+    gives a series without an index the index 1."""
+    match = series_with_index.match(value.strip())
+    return match.group(1), float(match.group(2) or 1)
+
+
+def is_unchanged(value, current):
+    """Whether setting a field to value would leave it as it is.
+
+    :param value:   The value as it would be passed to set_metadata
+    :param current: The field's (kind, value), as read by get_metadata_values
+    """
+    kind, current_value = current
+    if kind == "multiple":
+        return {v.strip() for v in str(value).split(",") if v.strip()} == current_value
+    if kind == "series":
+        return (parse_series(str(value)) if value else None) == current_value
+    if value == "" or value is None:
+        return current_value is None
+    return str(value) == str(current_value)
+
+
+def get_bulk_fields(updates):
+    """Turn updates of {book_id: {field: value}} into {field: {book_id: value}}, the
+    way calibre's set_field takes them.
+
+    Calibre keeps the index of a series in its own field, so series values like
+    "My Series [2]" are split into the series name and index fields.
+    """
+    fields = {}
+    for book_id, options in updates.items():
+        for field, value in options.items():
+            if field in SERIES_FIELDS and value:
+                name, index = parse_series(str(value))
+                fields.setdefault(field, {})[book_id] = name
+                fields.setdefault(f"{field}_index", {})[book_id] = index
+            else:
+                fields.setdefault(field, {})[book_id] = value
+    return fields
+
+
+def _read_tag_items(db, fields):
+    columns = {
+        label: column_id
+        for label, column_id in db.execute("SELECT label, id FROM custom_columns")
+    }
+
+    items = {}
+    for field in fields:
+        if field == "tags":
+            table, name_column = "tags", "name"
+            link, link_column = "books_tags_link", "tag"
+        elif field.startswith("#") and field[1:] in columns:
+            table, name_column = f"custom_column_{columns[field[1:]]}", "value"
+            link, link_column = f"books_{table}_link", "value"
+        else:
+            continue
+
+        rows = db.execute(
+            f"SELECT {table}.id, {table}.{name_column}, COUNT({link}.book) "
+            f"FROM {table} "
+            f"LEFT JOIN {link} ON {link}.{link_column} = {table}.id "
+            f"GROUP BY {table}.id"
+        ).fetchall()
+        items[field] = {item_id: (name, count) for item_id, name, count in rows}
+
+    return items
+
+
+def _read_metadata_values(db, book_id, fields):
+    columns = {
+        label: (column_id, datatype, is_multiple, normalized)
+        for label, column_id, datatype, is_multiple, normalized in db.execute(
+            "SELECT label, id, datatype, is_multiple, normalized FROM custom_columns"
+        )
+    }
+
+    values = {}
+    for field in fields:
+        if field == "tags":
+            rows = db.execute(
+                "SELECT tags.name FROM books_tags_link "
+                "JOIN tags ON tags.id = books_tags_link.tag "
+                "WHERE books_tags_link.book = ?",
+                (book_id,),
+            ).fetchall()
+            values[field] = ("multiple", {row[0] for row in rows})
+        elif field == "series":
+            row = db.execute(
+                "SELECT series.name, books.series_index FROM books "
+                "JOIN books_series_link ON books_series_link.book = books.id "
+                "JOIN series ON series.id = books_series_link.series "
+                "WHERE books.id = ?",
+                (book_id,),
+            ).fetchone()
+            values[field] = ("series", (row[0], row[1]) if row else None)
+        elif field.startswith("#") and field[1:] in columns:
+            column_id, datatype, is_multiple, normalized = columns[field[1:]]
+            table = f"custom_column_{column_id}"
+            if not normalized:
+                # Numbers, dates etc. are stored next to the book, without a link.
+                row = db.execute(
+                    f"SELECT value FROM {table} WHERE book = ?", (book_id,)
+                ).fetchone()
+                values[field] = ("single", row[0] if row else None)
+                continue
+
+            link = f"books_{table}_link"
+            # The link tables of series columns keep the series index in extra.
+            extra = f"{link}.extra" if datatype == "series" else "NULL"
+            rows = db.execute(
+                f"SELECT {table}.value, {extra} FROM {link} "
+                f"JOIN {table} ON {table}.id = {link}.value "
+                f"WHERE {link}.book = ?",
+                (book_id,),
+            ).fetchall()
+            if datatype == "series":
+                values[field] = ("series", tuple(rows[0]) if rows else None)
+            elif is_multiple:
+                values[field] = ("multiple", {row[0] for row in rows})
+            else:
+                values[field] = ("single", rows[0][0] if rows else None)
+
+    return values
+
+
 class CalibreHelper(object):
     """Calls calibredb CLI commands."""
 
@@ -75,27 +360,29 @@ class CalibreHelper(object):
         self.path = library_path
         self.user = user
         self.password = password
+        # Held while adding/updating/removing books, when downloading in parallel.
+        self.write_lock = Lock()
+        # The results of searches and lists during this run, by query. Our own
+        # changes to the library invalidate the results they could change.
+        self.query_cache = {}
+        self.query_cache_lock = Lock()
 
-        self.library_access_string = f'--with-library="{self.path}" '
+        self.library_args = [f"--with-library={self.path}"]
         if user:
-            self.library_access_string += f'--user="{self.user}" '
+            self.library_args.append(f"--user={self.user}")
         if password:
-            self.library_access_string += f'--password="{self.password}" '
+            self.library_args.append(f"--password={self.password}")
 
+    @report.timed("check_library")
     def check_library(self):
         # First, check if we have calibredb locally
-        try:
-            with open(devnull, "w") as nullout:
-                call(["calibredb"], stdout=nullout, stderr=nullout)
-        except OSError as e:
-            if e.errno == ENOENT:
-                raise CalibreException(
-                    "Calibredb is not installed on this system. Cannot search the "
-                    "Calibre library or update it.",
-                )
+        if which("calibredb") is None:
+            raise CalibreException(
+                "Calibredb is not installed on this system. Cannot search the "
+                "Calibre library or update it.",
+            )
 
-        parsed_path = urlparse(self.path)
-        path_is_url = parsed_path.scheme and parsed_path.netloc
+        path_is_url = self.is_server_library()
         path_is_dir = os.path.isdir(self.path)
 
         if not (path_is_url or path_is_dir):
@@ -105,10 +392,19 @@ class CalibreHelper(object):
                 Bcolors.WARNING,
             )
 
+        if self.get_schema_version() >= SCHEMA_VERSION:
+            log("Custom columns in Calibre library are up to date")
+            return
+
         try:
-            # Check that our custom columns are set up, and set them up if not.
-            self.check_or_create_words_column()
-            self.check_or_create_extra_columns()
+            if path_is_url:
+                # calibre-debug can't open a library on a Calibre server, so check
+                # and add the columns one at a time with calibredb.
+                columns = self.get_custom_columns()
+                self.check_or_create_words_column(columns)
+                self.check_or_create_extra_columns(columns)
+            else:
+                self.migrate_schema()
         except CalledProcessError as e:
             output = clean_output(e.output)
 
@@ -130,41 +426,110 @@ class CalibreHelper(object):
                 f"{message}",
             )
 
-    def check_or_create_words_column(self):
-        res = check_and_clean_output(
-            f"calibredb custom_columns {self.library_access_string}"
+    def is_server_library(self):
+        parsed_path = urlparse(self.path)
+        return bool(parsed_path.scheme and parsed_path.netloc)
+
+    def _read_metadata_db(self, read):
+        """Call read with a read-only connection to a local library's metadata.db,
+        which is much faster than starting calibre.
+
+        Returns None if the library isn't local, or reading fails.
+        """
+        metadata_db = os.path.join(self.path, "metadata.db")
+        if not os.path.isfile(metadata_db):
+            return None
+
+        try:
+            uri = f"file:{quote_url(os.path.abspath(metadata_db))}?mode=ro"
+            with closing(sqlite3.connect(uri, uri=True)) as db:
+                return read(db)
+        except sqlite3.Error:
+            return None
+
+    def _query_metadata_db(self, query, parameters=()):
+        """Run a read-only query directly on a local library's metadata.db.
+
+        Returns None if the library isn't local, or the query fails.
+        """
+        return self._read_metadata_db(
+            lambda db: db.execute(query, parameters).fetchall()
         )
-        columns = res.split("\n")
-        for c in columns:
-            if c.startswith("words ("):
-                return
 
-        log("Adding custom column 'words' to Calibre library")
-        check_and_clean_output(
-            f"calibredb add_custom_column {self.library_access_string} words Words int"
+    def get_schema_version(self):
+        """Get the schema version recorded in a local library's preferences.
+
+        Returns 0 if the library isn't local or has never been migrated.
+        """
+        rows = self._query_metadata_db(
+            "SELECT val FROM preferences WHERE key = ?", (SCHEMA_VERSION_PREF,)
         )
+        return json.loads(rows[0][0]) if rows else 0
+
+    def migrate_schema(self):
+        """Add all our missing custom columns to a local library in one go, and record
+        the schema version."""
+        log("Updating the custom columns in Calibre library")
+        script = MIGRATE_SCHEMA_SCRIPT % {
+            "path": self.path,
+            "columns": SCHEMA_COLUMNS,
+            "series_columns": AO3_SERIES_KEYS,
+            "version_pref": SCHEMA_VERSION_PREF,
+            "version": SCHEMA_VERSION,
+        }
+        output = check_and_clean_output(["calibre-debug", "-c", script])
+        for line in output.split("\n"):
+            if line:
+                log(f"\t{line}", Bcolors.OKBLUE)
 
-    def check_or_create_extra_columns(self):
+    def get_custom_columns(self):
+        """Get the names of the custom columns in the library."""
         res = check_and_clean_output(
-            f"calibredb custom_columns {self.library_access_string}"
+            ["calibredb", "custom_columns", *self.library_args], retries=READ_RETRIES
         )
         # Get rid of the number after each column name, e.g. "columnname (1)"
-        columns = [c.split(" ")[0] for c in res.split("\n")]
+        return [c.split(" ")[0] for c in res.split("\n") if c]
+
+    def check_or_create_words_column(self, columns=None):
+        if columns is None:
+            columns = self.get_custom_columns()
+        if "words" in columns:
+            return
+
+        log("Adding custom column 'words' to Calibre library")
+        check_and_clean_output(
+            [
+                "calibredb",
+                "add_custom_column",
+                *self.library_args,
+                "words",
+                "Words",
+                "int",
+            ]
+        )
+
+    def check_or_create_extra_columns(self, columns=None):
+        if columns is None:
+            columns = self.get_custom_columns()
         if set(columns).intersection(AO3_SERIES_KEYS) == set(AO3_SERIES_KEYS):
             log("Custom AO3 series columns are in Calibre Library")
         else:
             log("Adding custom AO3 series columns to Calibre library")
             for c in AO3_SERIES_KEYS:
                 check_and_clean_output(
-                    f"calibredb add_custom_column {self.library_access_string} "
-                    f"{c} {c} series"
+                    [
+                        "calibredb",
+                        "add_custom_column",
+                        *self.library_args,
+                        c,
+                        c,
+                        "series",
+                    ]
                 )
 
             log("Adding grouped search term 'allseries' to Calibre Library")
             script = ADD_GROUPED_SEARCH_SCRIPT % self.path
-            check_and_clean_output(
-                f"calibre-debug -c '{script}'",
-            )
+            check_and_clean_output(["calibre-debug", "-c", script])
 
         if set(columns).intersection(TAG_TYPES) == set(TAG_TYPES):
             log("Custom AO3 tag-type columns are in Calibre Library")
@@ -172,10 +537,55 @@ class CalibreHelper(object):
             log("Adding AO3 tag types as columns in Calibre library")
             for tag in TAG_TYPES:
                 check_and_clean_output(
-                    f"calibredb add_custom_column {self.library_access_string} "
-                    f"{tag} {tag} text --is-multiple"
+                    [
+                        "calibredb",
+                        "add_custom_column",
+                        *self.library_args,
+                        tag,
+                        tag,
+                        "text",
+                        "--is-multiple",
+                    ]
                 )
 
+    def _map_url_chunks(self, func, urls):
+        """Call func with each chunk of urls, in parallel for a Calibre server, and
+        return the results in order."""
+        chunks = chunk_urls(sorted(set(urls)))
+        if len(chunks) <= 1 or not self.is_server_library():
+            return [func(chunk) for chunk in chunks]
+
+        with ThreadPoolExecutor(SERVER_SEARCH_WORKERS) as executor:
+            return list(executor.map(func, chunks))
+
+    def _get_cached_query(self, key):
+        with self.query_cache_lock:
+            entry = self.query_cache.get(key)
+        report.count(
+            "calibre_query_cache_hits" if entry else "calibre_query_cache_misses"
+        )
+        return list(entry["result"]) if entry else None
+
+    def _cache_query(self, key, filters, result, book_ids):
+        with self.query_cache_lock:
+            self.query_cache[key] = {
+                "result": result,
+                "filters": filters,
+                "book_ids": set(book_ids),
+            }
+
+    def _invalidate_queries(self, should_invalidate):
+        with self.query_cache_lock:
+            for key in [k for k, e in self.query_cache.items() if should_invalidate(e)]:
+                del self.query_cache[key]
+
+    def clear_query_cache(self):
+        """Forget all cached query results, e.g. when the library might have been
+        changed by something else."""
+        with self.query_cache_lock:
+            self.query_cache.clear()
+
+    @report.timed("search")
     def search(
         self, authors=None, urls=None, series=None, book_formats=None, incomplete=False
     ):
@@ -187,127 +597,540 @@ class CalibreHelper(object):
 
         Returns a list of book ids that match the search.
         """
-        search_terms = collate_search_terms(
+        filters = normalise_search_filters(
             authors, book_formats, series, urls, incomplete
         )
+        search_terms = collate_search_terms(**filters)
+        cached = self._get_cached_query(("search", search_terms))
+        if cached is not None:
+            return cached
 
-        command = f"calibredb search {search_terms} {self.library_access_string}"
+        command = [
+            "calibredb",
+            "search",
+            search_terms,
+            *self.library_args,
+        ]
 
         try:
-            result = check_and_clean_output(command)
-
-            return result.split(",")
+            output = check_and_clean_output(command, retries=READ_RETRIES)
+            result = output.strip().split(",")
         except CalledProcessError as e:
             if "No books matching the search expression" in e.output:
-                return []
+                result = []
             else:
                 raise CalibreException(e.output)
 
+        self._cache_query(("search", search_terms), filters, result, result)
+        return list(result)
+
     def get_author_works_count(self, author):
         log(f"Getting work count for {author} in calibre")
-        result = self.search(authors=[author])
+        # Listing costs the same as searching, and the works are often listed later.
+        result = self.list_titles_and_urls(authors=[author])
 
         return len(result)
 
     def get_series_works_count(self, series_title):
         log(f"Getting work count for {series_title} in calibre")
-        result = self.search(series=[series_title])
+        result = self.list_titles_and_urls(series=[series_title])
 
         return len(result)
 
+    @report.timed("export")
     def export(self, book_id, location):
-        command = (
-            f'calibredb export {book_id} --to-dir "{location}" --template={{id}} '
-            f"--dont-save-cover --dont-write-opf --single-dir "
-            f"{self.library_access_string}"
+        self._export_many([book_id], location)
+
+        # Return the filepath to the new epub file
+        return os.path.join(location, f"{book_id}.epub")
+
+    @report.timed("export_many")
+    def export_many(self, book_ids, location):
+        """Export the epubs of several books.
+
+        The epubs in a local library are cloned straight from the library's files,
+        and the rest are exported with a single calibredb call.
+
+        Returns a dictionary of book id: filepath, of the books that were exported.
+        """
+        return self._export_many(book_ids, location)
+
+    def _export_many(self, book_ids, location):
+        book_ids = [str(book_id) for book_id in book_ids]
+        filepaths = {
+            book_id: os.path.join(location, f"{book_id}.epub") for book_id in book_ids
+        }
+
+        library_paths = self.get_format_paths(book_ids)
+        not_cloned = [i for i in book_ids if i not in library_paths]
+        for book_id, library_path in library_paths.items():
+            try:
+                clone_file(library_path, filepaths[book_id])
+            except OSError as e:
+                # Only this book is exported with calibredb instead.
+                log(f"\tCouldn't copy {library_path}: {e}", Bcolors.WARNING)
+                if os.path.isfile(filepaths[book_id]):
+                    os.remove(filepaths[book_id])
+                not_cloned.append(book_id)
+
+        if not_cloned:
+            self._export(not_cloned, location)
+
+        return {i: path for i, path in filepaths.items() if os.path.isfile(path)}
+
+    def get_format_paths(self, book_ids, book_format="EPUB"):
+        """Find the files of the books in a local library, from metadata.db.
+
+        Returns a dictionary of book id: filepath, of the books that have a file in
+        the format.
+        """
+        paths = {}
+        for i in range(0, len(book_ids), MAX_SQL_PARAMETERS):
+            chunk = [int(book_id) for book_id in book_ids[i : i + MAX_SQL_PARAMETERS]]
+            rows = self._query_metadata_db(
+                f"SELECT books.id, books.path, data.name FROM books "
+                f"JOIN data ON data.book = books.id WHERE data.format = ? "
+                f"AND books.id IN ({', '.join('?' * len(chunk))})",
+                [book_format.upper()] + chunk,
+            )
+            paths.update(self._get_existing_paths(rows or [], book_format))
+        return paths
+
+    def get_all_format_paths(self, book_format="EPUB"):
+        """Find the files of all the books in a local library, from metadata.db.
+
+        Returns a dictionary of book id: filepath, of the books that have a file in
+        the format, or None if the library isn't local.
+        """
+        rows = self._query_metadata_db(
+            "SELECT books.id, books.path, data.name FROM books "
+            "JOIN data ON data.book = books.id WHERE data.format = ? ORDER BY books.id",
+            (book_format.upper(),),
         )
+        if rows is None:
+            return None
+        return self._get_existing_paths(rows, book_format)
+
+    def _get_existing_paths(self, rows, book_format):
+        paths = {}
+        for book_id, book_path, name in rows:
+            path = os.path.join(self.path, book_path, f"{name}.{book_format.lower()}")
+            if os.path.isfile(path):
+                paths[str(book_id)] = path
+        return paths
+
+    def _export(self, book_ids, location):
+        command = [
+            "calibredb",
+            "export",
+            ",".join(str(book_id) for book_id in book_ids),
+            f"--to-dir={location}",
+            "--template={id}",
+            "--dont-save-cover",
+            "--dont-write-opf",
+            "--single-dir",
+            *self.library_args,
+        ]
 
         try:
-            check_and_clean_output(command)
+            check_and_clean_output(command, retries=READ_RETRIES)
         except CalledProcessError as e:
             raise CalibreException(e.output)
 
-        # Return the filepath to the new epub file
-        return os.path.join(location, f"{book_id}.epub")
-
     def list_titles_and_urls(
         self, authors=None, urls=None, series=None, book_formats=None, incomplete=False
     ):
-        search_terms = collate_search_terms(
-            authors, book_formats, series, urls, incomplete
+        """Get the title and url of every book that matches the search, which is built
+        like the one in search()."""
+        if urls and len(chunk_urls(urls)) > 1:
+            results = self._map_url_chunks(
+                lambda chunk: self._list_titles_and_urls(
+                    authors, chunk, series, book_formats, incomplete
+                ),
+                urls,
+            )
+            return [work for result in results for work in result]
+
+        return self._list_titles_and_urls(
+            authors, urls, series, book_formats, incomplete
         )
 
-        command = (
-            f"calibredb list --search {search_terms} {self.library_access_string} "
-            f"--fields title,*identifier --for-machine"
+    @report.timed("list")
+    def _list_titles_and_urls(
+        self, authors=None, urls=None, series=None, book_formats=None, incomplete=False
+    ):
+        filters = normalise_search_filters(
+            authors, book_formats, series, urls, incomplete
         )
+        search_terms = collate_search_terms(**filters)
+        cached = self._get_cached_query(("list", search_terms))
+        if cached is not None:
+            return cached
+
+        command = [
+            "calibredb",
+            "list",
+            f"--search={search_terms}",
+            *self.library_args,
+            "--fields=title,*identifier",
+            "--for-machine",
+        ]
 
         try:
-            result = check_and_clean_output(command)
+            result = check_and_clean_output(command, retries=READ_RETRIES)
 
             result_json = json.loads(result)
         except CalledProcessError as e:
             if "No books matching the search expression" in e.output:
-                return []
+                result_json = []
             else:
                 raise CalibreException(e.output)
 
-        return [
-            {"title": r["title"], "url": r["*identifier"].replace("url:", "")}
+        works = [
+            {"title": r["title"], "url": r.get("*identifier", "").replace("url:", "")}
             for r in result_json
         ]
+        self._cache_query(
+            ("list", search_terms), filters, works, [str(r["id"]) for r in result_json]
+        )
+        return list(works)
+
+    @report.timed("get_all_tags")
+    def get_all_tags(self):
+        """Get the tags of every book in the library that has any, as a dictionary of
+        book id: list of tags.
+
+        A local library's tags are read from metadata.db in one query; otherwise, one
+        calibredb command lists the tags of all the books.
+        """
+        rows = self._query_metadata_db(
+            "SELECT books_tags_link.book, tags.name FROM books_tags_link "
+            "JOIN tags ON tags.id = books_tags_link.tag ORDER BY books_tags_link.id"
+        )
+        if rows is not None:
+            all_tags = {}
+            for book_id, tag in rows:
+                all_tags.setdefault(str(book_id), []).append(tag)
+            return all_tags
+
+        command = [
+            "calibredb",
+            "list",
+            "--search=tags:true",
+            *self.library_args,
+            "--fields=tags",
+            "--for-machine",
+        ]
+        try:
+            result_json = json.loads(
+                check_and_clean_output(command, retries=READ_RETRIES)
+            )
+        except CalledProcessError as e:
+            if "No books matching the search expression" in e.output:
+                return {}
+            raise CalibreException(e.output)
+
+        return {str(r["id"]): r.get("tags", []) for r in result_json}
+
+    def lookup_urls(self, urls):
+        """Find which of the urls are in the library.
+
+        Local libraries are looked up in the identifiers index of metadata.db, and
+        other libraries are searched with calibredb in chunks of urls.
+
+        Returns a dictionary of url: book id, of the newest book with each url.
+        """
+        urls = sorted(set(urls))
+        ids = self._lookup_urls_in_index(urls)
+        if ids is not None:
+            report.count("calibre_index_lookups")
+            return ids
+
+        ids = {}
+        for result in self._map_url_chunks(self._search_urls, urls):
+            ids.update(result)
+        return ids
+
+    def _lookup_urls_in_index(self, urls):
+        ids = {}
+        for i in range(0, len(urls), MAX_SQL_PARAMETERS):
+            chunk = urls[i : i + MAX_SQL_PARAMETERS]
+            rows = self._query_metadata_db(
+                f"SELECT val, MAX(book) FROM identifiers WHERE type = 'url' "
+                f"AND val IN ({', '.join('?' * len(chunk))}) GROUP BY val",
+                chunk,
+            )
+            if rows is None:
+                return None
+            ids.update({url: str(book_id) for url, book_id in rows})
+        return ids
+
+    @report.timed("lookup_urls")
+    def _search_urls(self, urls):
+        search_terms = collate_search_terms(urls=urls)
+        command = [
+            "calibredb",
+            "list",
+            f"--search={search_terms}",
+            *self.library_args,
+            "--fields=*identifier",
+            "--for-machine",
+        ]
+
+        try:
+            result_json = json.loads(
+                check_and_clean_output(command, retries=READ_RETRIES)
+            )
+        except CalledProcessError as e:
+            if "No books matching the search expression" in e.output:
+                return {}
+            else:
+                raise CalibreException(e.output)
+
+        ids = {}
+        for r in sorted(result_json, key=lambda r: r["id"]):
+            ids[r["*identifier"].replace("url:", "")] = str(r["id"])
+        return ids
+
+    def get_works_info(self, urls):
+        """Get the id, word count and status of every book in the library that has
+        one of the given urls.
+
+        Returns a dictionary of url: {"id": ..., "words": ..., "status": ...}.
+        """
+        works_info = {}
+        for result in self._map_url_chunks(self._get_works_info, urls):
+            works_info.update(result)
+        return works_info
+
+    @report.timed("get_works_info")
+    def _get_works_info(self, urls):
+        search_terms = collate_search_terms(urls=urls)
+
+        command = [
+            "calibredb",
+            "list",
+            f"--search={search_terms}",
+            *self.library_args,
+            "--fields=*identifier,*words,*status",
+            "--for-machine",
+        ]
+
+        try:
+            result_json = json.loads(
+                check_and_clean_output(command, retries=READ_RETRIES)
+            )
+        except CalledProcessError as e:
+            if "No books matching the search expression" in e.output:
+                return {}
+            else:
+                raise CalibreException(e.output)
+
+        return {
+            r["*identifier"].replace("url:", ""): {
+                "id": r["id"],
+                "words": r.get("*words"),
+                "status": r.get("*status") or [],
+            }
+            for r in result_json
+        }
 
-    def add(self, book_filepath, options=None):
+    @report.timed("add")
+    def add(self, book_filepath, options=None, url=None):
         """Add a book to the Calibre library.
 
         options is a dictionary of option_name: option_value, which will be converted to
         CLI options.
+        If the url of the book is given, cached searches for other urls are kept.
         """
         if options is None:
             options = {}
-        options_strings = [f'--{k}="{v}"' for k, v in options.items()]
+        options_strings = [f"--{k}={v}" for k, v in options.items()]
 
-        command = (
-            f'calibredb add -d "{book_filepath}" {" ".join(options_strings)} '
-            f"{self.library_access_string}"
-        )
+        command = [
+            "calibredb",
+            "add",
+            "-d",
+            book_filepath,
+            *options_strings,
+            *self.library_args,
+        ]
 
         try:
             check_and_clean_output(command)
         except CalledProcessError as e:
             raise CalibreException(e.output)
+        finally:
+            # The new book can only be missing from searches that are limited to
+            # other urls.
+            self._invalidate_queries(
+                lambda e: url is None
+                or not e["filters"]["urls"]
+                or url in e["filters"]["urls"]
+            )
 
+    @report.timed("remove")
     def remove(self, book_id):
-        command = f"calibredb remove {book_id} {self.library_access_string}"
+        command = ["calibredb", "remove", str(book_id), *self.library_args]
 
         try:
             check_and_clean_output(command)
         except CalledProcessError as e:
             raise CalibreException(e.output)
+        finally:
+            self._invalidate_queries(lambda e: str(book_id) in e["book_ids"])
+
+    def get_tag_items(self, fields):
+        """Get the items of tag-like fields in a local library, with how many books
+        each one is linked to.
+
+        Returns a dictionary of field: {item_id: (name, book count)}, leaving out fields
+        the library doesn't have, or None if the library isn't local.
+        """
+        return self._read_metadata_db(lambda db: _read_tag_items(db, fields))
+
+    def rename_tags(self, steps):
+        """Rename items of tag-like fields in a local library, so that each tag is
+        renamed once, in all the books it's linked to.
+
+        steps is a list of dictionaries of field: {item_id: new name}, which are
+        applied in order. Renaming a tag to the name of an existing tag of the field
+        merges them.
+        """
+        log("Renaming tags in Calibre library")
+        try:
+            self._run_script_with_data(RENAME_ITEMS_SCRIPT, steps)
+        finally:
+            self.clear_query_cache()
+
+    def get_metadata_values(self, book_id, fields):
+        """Read the current values of a book's fields from a local library's
+        metadata.db.
+
+        Returns a dictionary of field: (kind, value), where kind is "multiple" for
+        fields holding a set of values, "series" for fields holding a (name, index)
+        tuple, or "single". Fields the library doesn't have are left out. Returns None
+        if the library isn't local.
+        """
+        return self._read_metadata_db(
+            lambda db: _read_metadata_values(db, book_id, fields)
+        )
+
+    def get_changed_metadata(self, book_id, options):
+        """Get the options for set_metadata that would change the book, leaving out
+        the fields that already have these values.
+
+        All the options are returned if the book's current values can't be read.
+        """
+        current = self.get_metadata_values(book_id, options.keys())
+        if current is None:
+            return dict(options)
+
+        return {
+            field: value
+            for field, value in options.items()
+            if field not in current or not is_unchanged(value, current[field])
+        }
+
+    def set_metadata_many(self, updates):
+        """Set metadata fields on many existing books in the Calibre library.
+
+        updates is a dictionary of book_id: options, where options are as for
+        set_metadata. The fields of a local library are set in bulk by one calibre
+        process per METADATA_BOOKS_PER_PROCESS books. calibre-debug can't open a
+        library on a Calibre server, so its books are set one at a time.
+        """
+        start = monotonic()
+        book_ids = list(updates.keys())
+        try:
+            if self.is_server_library():
+                for book_id in book_ids:
+                    self.set_metadata(book_id, updates[book_id])
+            else:
+                for i in range(0, len(book_ids), METADATA_BOOKS_PER_PROCESS):
+                    self._set_metadata_many(
+                        {
+                            book_id: updates[book_id]
+                            for book_id in book_ids[i : i + METADATA_BOOKS_PER_PROCESS]
+                        }
+                    )
+        finally:
+            self.clear_query_cache()
+
+        seconds = monotonic() - start
+        report.count("metadata_books_written", len(book_ids))
+        log(
+            f"Set metadata on {len(book_ids)} books in {seconds:.1f}s "
+            f"({len(book_ids) / max(seconds, 0.001):.0f} books/second)",
+            Bcolors.OKBLUE,
+        )
+
+    @report.timed("set_metadata_many")
+    def _set_metadata_many(self, updates):
+        book_ids = list(updates.keys())
+        batches = [
+            get_bulk_fields(
+                {
+                    book_id: updates[book_id]
+                    for book_id in book_ids[i : i + METADATA_BATCH_SIZE]
+                }
+            )
+            for i in range(0, len(book_ids), METADATA_BATCH_SIZE)
+        ]
+
+        self._run_script_with_data(SET_METADATA_SCRIPT, batches)
+
+    def _run_script_with_data(self, script, data):
+        """Run a script on a local library with calibre-debug, passing it data in a
+        json file, since the data can be too big for the command line.
+
+        The script is formatted with the library's path and the json file's path as
+        "path" and "data_path".
+        """
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            f.write(json.dumps(data))
+        try:
+            script = script % {"path": self.path, "data_path": f.name}
+            return check_and_clean_output(["calibre-debug", "-c", script])
+        except CalledProcessError as e:
+            raise CalibreException(e.output)
+        finally:
+            os.remove(f.name)
 
+    @report.timed("set_metadata")
     def set_metadata(self, book_id, options):
         """Set metadata fields on an existing book in the Calibre library.
 
         options is a dictionary of field: value, which will be converted to CLI options.
         NB: custom fields must be prefaced with a '#' character for Calibre to
         recognise them.
-        NB: values with spaces in them must include quotation marks in the string.
 
         Example: {
-            "series": '"My Series"',
-            "#series00": '"My Other Series"',
+            "series": "My Series",
+            "#series00": "My Other Series",
             "tags": "tag1,tag2",
-            "#characters": '"Jane Grey","Captain Scarlet"'
+            "#characters": "Jane Grey,Captain Scarlet"
         }
         """
-        options_strings = [f'--field={k}:"{v}"' for k, v in options.items()]
+        options_strings = [f"--field={k}:{v}" for k, v in options.items()]
 
-        command = (
-            f"calibredb set_metadata {book_id} {' '.join(options_strings)} "
-            f"{self.library_access_string}"
-        )
+        command = [
+            "calibredb",
+            "set_metadata",
+            str(book_id),
+            *options_strings,
+            *self.library_args,
+        ]
 
         try:
             check_and_clean_output(command)
         except CalledProcessError as e:
             raise CalibreException(e.output)
+        finally:
+            # The book may now match searches it didn't match before, on the fields
+            # that were set.
+            filters = get_search_filters_for_fields(options.keys())
+            self._invalidate_queries(
+                lambda e: str(book_id) in e["book_ids"]
+                or any(e["filters"][f] for f in filters)
+            )
@@ -0,0 +1,98 @@
+# encoding: utf-8
+import json
+import os.path
+import re
+from json import JSONDecodeError
+
+chapter_url = re.compile(r"/works/(\d+)/chapters/(\d+)")
+work_url = re.compile(r"/works/(\d+)")
+
+
+def get_url_work_id(url):
+    m = work_url.search(url)
+    if m:
+        return m.group(1)
+    return None
+
+
+def get_url_chapter_id(url):
+    m = chapter_url.search(url)
+    if m:
+        return m.group(2)
+    return None
+
+
+def get_work_id(metadata):
+    if metadata.get("storyId"):
+        return str(metadata["storyId"])
+    return get_url_work_id(metadata.get("storyUrl", ""))
+
+
+def get_chapter_listing(metadata):
+    """Get {chapter id: date} from the chapter list in FanFicFare's json metadata.
+
+    AO3 lists a date for every chapter of a multi-chapter work, and the date of a
+    chapter changes when it is reposted or its date is edited. One-shots have no
+    chapter dates, so they fall back to the work's last update date.
+    """
+    listing = {}
+    for _, chapter in metadata.get("zchapters", []):
+        chapter_id = get_url_chapter_id(chapter.get("url", ""))
+        if chapter_id is None:
+            continue
+        listing[chapter_id] = chapter.get("date", metadata.get("dateUpdated", ""))
+
+    return listing
+
+
+class ChapterCache(object):
+    """Remembers the chapter listing of each work as it was when we last saved the
+    work's epub in the library.
+
+    The chapter bodies themselves are kept in the library epub: when FanFicFare
+    updates an existing epub, it reuses the chapters it already contains and only
+    fetches the missing ones. On a forced refresh, this cache tells us which of the
+    chapters in the epub have changed, so that FanFicFare can be made to refetch only
+    those.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, work_id):
+        return os.path.join(self.directory, f"{work_id}.json")
+
+    def get(self, work_id):
+        path = self._path(work_id)
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with open(path, "r") as f:
+                return json.loads(f.read())
+        except JSONDecodeError:
+            return None
+
+    def update(self, metadata):
+        work_id = get_work_id(metadata)
+        listing = get_chapter_listing(metadata)
+        if not work_id or not listing:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(work_id), "w") as f:
+            f.write(json.dumps(listing))
+
+    def changed_chapters(self, metadata):
+        """Return the ids of cached chapters whose date in the current listing is
+        different, or None if we have nothing cached for this work.
+
+        Chapters that are new since we cached the listing don't count: FanFicFare
+        fetches those anyway.
+        """
+        cached = self.get(get_work_id(metadata))
+        if cached is None:
+            return None
+
+        listing = get_chapter_listing(metadata)
+        return [c for c, date in listing.items() if c in cached and cached[c] != date]
@@ -6,19 +6,25 @@ from os import rename
 from pprint import pformat
 from shutil import rmtree
 from tempfile import mkdtemp
+from time import monotonic
 
+from . import profiling, report, tracing
 from .calibre import (
     CalibreException,
     CalibreHelper,
 )
+from .chapter_cache import ChapterCache, get_url_chapter_id, get_url_work_id
+from .epub_utils import get_content_hash, mark_chapters_for_refetch
 from .exceptions import (
     InvalidConfig,
     StoryUpToDateException,
     TempFileUpdatedMoreRecentlyException,
     UrlsCollectionException,
 )
+from .export_staging import ExportStager
 from .fanficfare_helper import FanFicFareHelper
-from .get_urls import get_urls, update_last_updated_file
+from .get_urls import get_imap_chapter_updates, get_urls, update_last_updated_file
+from .scheduler import PRIORITY_NAMES, TimeBudget, get_download_jobs, run_in_lanes
 from .utils import (
     Bcolors,
     get_all_metadata_options,
@@ -27,7 +33,16 @@ from .utils import (
 )
 
 
-def do_download(location, url, fff_helper, calibre, force):
+def do_download(
+    location,
+    url,
+    fff_helper,
+    calibre,
+    force,
+    chapter_update=None,
+    chapter_cache=None,
+    export_stager=None,
+):
     if not calibre:
         # We have no Calibre library, so just download the story.
         filepath, metadata = fff_helper.download(url, location, update_epub=False)
@@ -45,6 +60,7 @@ def do_download(location, url, fff_helper, calibre, force):
     # download the fic, and update the existing epub with the new contents.
     story_to_download = url
     story_id = None
+    exported_hash = None
     result = calibre.search(urls=[url], book_formats=["EPUB"])
     if len(result) > 0:
         story_id = result[0]
@@ -53,67 +69,198 @@ def do_download(location, url, fff_helper, calibre, force):
         # Story is in Calibre, so we can export an epub from Calibre and let FanFicFare
         # update it.
         log(f"\tStory is in Calibre with id {story_id}", Bcolors.OKBLUE)
-        log("\tExporting file", Bcolors.OKBLUE)
-        story_to_download = calibre.export(book_id=story_id, location=location)
+        staged_file = None
+        if export_stager:
+            staged_file = export_stager.take(story_id, location)
+        if staged_file:
+            story_to_download = staged_file
+        else:
+            log("\tExporting file", Bcolors.OKBLUE)
+            story_to_download = calibre.export(book_id=story_id, location=location)
+        # FanFicFare updates the exported epub in place, so hash it before it does.
+        exported_hash = get_content_hash(story_to_download)
 
         log(
             f'\tDownloading with fanficfare, updating file "{story_to_download}"',
             Bcolors.OKBLUE,
         )
 
-    try:
-        # Throws an exception if we couldn't/shouldn't update the epub
-        filepath, metadata = fff_helper.download(story_to_download, location)
-    except Exception as e:
-        if isinstance(e, TempFileUpdatedMoreRecentlyException) or (
-            force and isinstance(e, StoryUpToDateException)
-        ):
-            log("\tForcing download update. FanFicFare error message:", Bcolors.WARNING)
-            log(f"\t\t{str(e.message)}", Bcolors.WARNING)
+    if chapter_update and story_id is not None:
+        # A subscription email told us exactly which chapters are new. FanFicFare
+        # keeps the chapters that are already in the exported epub and only fetches
+        # the new ones, so we never need to fall back to a forced full download here.
+        chapter_ids = ", ".join(chapter_update)
+        log(
+            f"\tSubscription email announced new chapter(s) {chapter_ids}",
+            Bcolors.OKBLUE,
+        )
+        filepath, metadata = fff_helper.download(
+            story_to_download, location, update_cover=False, always_overwrite=True
+        )
+    else:
+        filepath, metadata = _download_with_fanficfare(
+            url, story_to_download, location, fff_helper, force, chapter_cache
+        )
 
-            filepath, metadata = fff_helper.download(
-                story_to_download, location, force=True
-            )
-        else:
-            raise e
+    if chapter_cache:
+        chapter_cache.update(metadata)
 
     log(
         f'\tDownloaded story "{metadata["title"]}" by {metadata["author"]} '
         f"to file {filepath}",
         Bcolors.OKGREEN,
     )
+
+    if exported_hash is not None and get_content_hash(filepath) == exported_hash:
+        # Adding the new epub would only change its dates and cover, and make
+        # calibre regenerate the cover and thumbnail.
+        log(
+            "\tThe chapters haven't changed, so only updating the metadata in Calibre",
+            Bcolors.OKBLUE,
+        )
+        report.count("unchanged_works")
+        with calibre.write_lock:
+            _set_metadata(calibre, story_id, metadata)
+        return
+
+    # Only one thread at a time may write to the library. Among other things, we
+    # rely on the book we just added being the newest one with its url.
+    with calibre.write_lock:
+        _add_to_library(calibre, url, filepath, metadata, story_id)
+
+
+def _add_to_library(calibre, url, filepath, metadata, story_id):
     log(f"\tAdding {filepath} to library", Bcolors.OKBLUE)
-    calibre.add(book_filepath=filepath)
+    calibre.add(book_filepath=filepath, url=url)
 
-    # The search returns a list of story ids in numerical order. The story we just
-    # added has the highest id number and is at the end of the list.
-    result = calibre.search(urls=[url])
-    new_story_id = result[-1]
+    # The story we just added has the highest id number of the books with its url.
+    new_story_id = calibre.lookup_urls([url])[url]
     log(f"\tAdded {filepath} to library with id {new_story_id}", Bcolors.OKGREEN)
 
-    options = get_all_metadata_options(metadata)
+    _set_metadata(calibre, new_story_id, metadata)
+
+    if story_id:
+        log(f"\tRemoving {story_id} from library", Bcolors.OKBLUE)
+        calibre.remove(story_id)
+
+
+def _set_metadata(calibre, story_id, metadata):
+    all_options = get_all_metadata_options(metadata)
+    options = calibre.get_changed_metadata(story_id, all_options)
+    report.count("unchanged_metadata_fields", len(all_options) - len(options))
+    if not options:
+        log(f"\tMetadata of story {story_id} is up to date", Bcolors.OKBLUE)
+        return
+
     log(
-        f"\tSetting custom fields on story {new_story_id}:\n{pformat(options)}",
+        f"\tSetting custom fields on story {story_id}:\n{pformat(options)}",
         Bcolors.OKBLUE,
     )
 
     try:
-        calibre.set_metadata(book_id=new_story_id, options=options)
+        calibre.set_metadata(book_id=story_id, options=options)
     except CalibreException as e:
         log("\tError setting custom data.", Bcolors.WARNING)
         log(f"\t{e.message}", Bcolors.WARNING)
 
-    if story_id:
-        log(f"\tRemoving {story_id} from library", Bcolors.OKBLUE)
-        calibre.remove(story_id)
+
+def _refresh_from_chapter_cache(
+    url, story_to_download, location, fff_helper, chapter_cache
+):
+    """Update the exported epub, refetching only the chapters whose date in the
+    work's chapter listing changed since we last saved it, and reusing the rest.
+
+    Returns None if we have to fall back to a forced download.
+    """
+    cached = chapter_cache.get(get_url_work_id(url))
+    if cached is None:
+        log("\tNo cached chapter list for this work", Bcolors.WARNING)
+        return None
+    if len(cached) < 2:
+        # Fetching the chapter listing costs about as much as refetching a one-shot.
+        return None
+
+    metadata = fff_helper.get_metadata_only(url, location)
+    changed_chapters = chapter_cache.changed_chapters(metadata)
+    if changed_chapters is None:
+        return None
+
+    if changed_chapters:
+        log(
+            f"\tRefetching {len(changed_chapters)} chapter(s) changed since the last "
+            f"download, reusing the epub's other chapters",
+            Bcolors.OKBLUE,
+        )
+        marked = mark_chapters_for_refetch(
+            story_to_download, lambda u: get_url_chapter_id(u) in changed_chapters
+        )
+        if marked is None:
+            log("\tCouldn't mark the changed chapters in the epub", Bcolors.WARNING)
+            return None
+    else:
+        log(
+            "\tNo chapters changed since the last download, reusing the epub's "
+            "chapters",
+            Bcolors.OKBLUE,
+        )
+
+    return fff_helper.download(
+        story_to_download, location, update_always=True, always_overwrite=True
+    )
 
 
-def downloader(url, inout_file, fff_helper, calibre, force):
+def _download_with_fanficfare(
+    url, story_to_download, location, fff_helper, force, chapter_cache=None
+):
+    try:
+        # Throws an exception if we couldn't/shouldn't update the epub
+        return fff_helper.download(story_to_download, location)
+    except Exception as e:
+        if isinstance(e, TempFileUpdatedMoreRecentlyException) or (
+            force and isinstance(e, StoryUpToDateException)
+        ):
+            log("\tForcing download update. FanFicFare error message:", Bcolors.WARNING)
+            log(f"\t\t{str(e.message)}", Bcolors.WARNING)
+
+            if chapter_cache and story_to_download != url:
+                result = _refresh_from_chapter_cache(
+                    url, story_to_download, location, fff_helper, chapter_cache
+                )
+                if result:
+                    return result
+
+            return fff_helper.download(story_to_download, location, force=True)
+        else:
+            raise e
+
+
+def downloader(
+    url,
+    inout_file,
+    fff_helper,
+    calibre,
+    force,
+    chapter_update=None,
+    chapter_cache=None,
+    export_stager=None,
+):
     log(f"Working with url {url}", Bcolors.HEADER)
     loc = mkdtemp()
+    report.set_current_url(url)
+    start = monotonic()
 
     try:
-        do_download(loc, url, fff_helper, calibre, force)
+        with tracing.span("downloader", url=url):
+            do_download(
+                loc,
+                url,
+                fff_helper,
+                calibre,
+                force,
+                chapter_update,
+                chapter_cache,
+                export_stager,
+            )
     except Exception as e:
         if isinstance(e, StoryUpToDateException):
             log(f"\tNot updating fic: {e}", Bcolors.WARNING)
@@ -124,24 +271,148 @@ def downloader(url, inout_file, fff_helper, calibre, force):
                 fp.write(f"{url}\n")
     finally:
         rmtree(loc, ignore_errors=True)
+        current_report = report.get_report()
+        if current_report:
+            current_report.record_work(url, monotonic() - start)
+        report.set_current_url(None)
+
+
+def _requeue(jobs, inout_file):
+    log(
+        f"Time budget used up: saving {len(jobs)} urls in {inout_file} for the "
+        f"next run",
+        Bcolors.WARNING,
+    )
+    with open(inout_file, "a") as fp:
+        for job in jobs:
+            fp.write(f"{job['url']}\n")
 
 
 def download(options):
-    calibre = None
-    if options.library:
-        calibre = CalibreHelper(
-            library_path=options.library,
-            user=options.calibre_user,
-            password=options.calibre_password,
-        )
+    run_report = report.start_report() if options.report else None
+    tracer = tracing.start_tracing() if options.trace else None
+    try:
+        _download(options)
+    finally:
+        if run_report:
+            report.stop_report()
+            run_report.write(options.report)
+            log(f"Wrote run report to {options.report}", Bcolors.OKBLUE)
+        if tracer:
+            tracing.stop_tracing()
+            tracer.write(options.trace)
+            log(f"Wrote trace to {options.trace}", Bcolors.OKBLUE)
+
+
+def get_calibre_helper(options):
+    """Set up and check the Calibre library, if there is one.
+
+    Raises CalibreException if the library can't be used.
+    """
+    if not options.library:
+        return None
+
+    calibre = CalibreHelper(
+        library_path=options.library,
+        user=options.calibre_user,
+        password=options.calibre_password,
+    )
+    calibre.check_library()
+
+    return calibre
+
+
+def get_fanficfare_helper(options):
+    image_cache_size = None
+    if options.image_cache_size:
+        image_cache_size = options.image_cache_size * 1024 * 1024
+    return FanFicFareHelper(
+        config_path=options.fanficfare_config,
+        image_cache_dir=os.path.join(options.cache_dir, "images"),
+        image_cache_size=image_cache_size,
+    )
+
+
+def get_chapter_cache(options, calibre):
+    if not calibre:
+        return None
+    return ChapterCache(os.path.join(options.cache_dir, "chapters"))
+
+
+def download_urls(options, urls, calibre, fff_helper, chapter_cache, chapter_updates):
+    """Download the urls in priority order, in lanes of worker threads, and add
+    them to the Calibre library if there is one."""
+    works_info = {}
+    if calibre:
         try:
-            calibre.check_library()
+            works_info = calibre.get_works_info(urls)
         except CalibreException as e:
-            log(str(e), Bcolors.FAIL)
-            return
+            log(f"Couldn't get info about works in Calibre: {e}", Bcolors.WARNING)
+        profiling.snapshot("library_indexed")
+
+    jobs = get_download_jobs(urls, works_info, chapter_updates)
+    time_budget = TimeBudget(
+        options.time_budget * 60 if options.time_budget is not None else None
+    )
+
+    log(
+        "Download queue: "
+        + ", ".join(
+            f"{len([j for j in jobs if j['priority'] == p])} {name}"
+            for p, name in PRIORITY_NAMES.items()
+        ),
+        Bcolors.HEADER,
+    )
+
+    # The epubs of the works to update are exported from Calibre in bulk, ahead of
+    # their downloads.
+    export_stager = None
+    if calibre:
+        export_stager = ExportStager(
+            calibre,
+            [works_info[j["url"]]["id"] for j in jobs if j["url"] in works_info],
+        )
+
+    def run_job(job):
+        downloader(
+            job["url"],
+            options.input,
+            fff_helper,
+            calibre,
+            options.force,
+            chapter_updates.get(job["url"]),
+            chapter_cache,
+            export_stager,
+        )
+
+    try:
+        lane_stats, skipped_jobs = run_in_lanes(
+            jobs, options.workers, run_job, time_budget
+        )
+    finally:
+        if export_stager:
+            export_stager.close()
+    profiling.snapshot("downloads_finished")
+    if skipped_jobs:
+        _requeue(skipped_jobs, options.input)
+    lane_summary = lane_stats.summary()
+    if report.get_report():
+        report.get_report().extra["lanes"] = lane_summary
+    if options.workers > 1:
+        for lane, summary in lane_summary.items():
+            log(f"Lane {lane}: {summary}", Bcolors.OKBLUE)
+
+
+def _download(options):
+    try:
+        calibre = get_calibre_helper(options)
+    except CalibreException as e:
+        log(str(e), Bcolors.FAIL)
+        return
 
     try:
         setup_login(options)
+        chapter_updates = get_imap_chapter_updates(options)
         urls = get_urls(options)
     except InvalidConfig as e:
         log(e.message, Bcolors.FAIL)
@@ -152,6 +423,8 @@ def download(options):
 
         return
 
+    profiling.snapshot("urls_collected")
+
     if not urls:
         log("No new urls to fetch. Finished!", Bcolors.OKGREEN)
         return
@@ -167,15 +440,13 @@ def download(options):
         )
         return
 
-    fff_helper = FanFicFareHelper(config_path=options.fanficfare_config)
-
-    for url in urls:
-        downloader(
-            url,
-            options.input,
-            fff_helper,
-            calibre,
-            options.force,
-        )
+    download_urls(
+        options,
+        urls,
+        calibre,
+        get_fanficfare_helper(options),
+        get_chapter_cache(options, calibre),
+        chapter_updates,
+    )
 
     update_last_updated_file(options)
@@ -0,0 +1,60 @@
+# encoding: utf-8
+import re
+from concurrent.futures import ProcessPoolExecutor
+from html import unescape
+
+from .epub_utils import read_title_page
+
+# How many epubs each process of the pool is given at a time.
+SCAN_CHUNKSIZE = 64
+
+word_count = re.compile(r"<b>Words:</b>\s*([\d,]+)")
+rating = re.compile(r"<b>Rating:</b>\s*([^<]+?)\s*<")
+series_link = re.compile(
+    r'<a class="serieslink" href="[^"]*/series/(\d+)">(.+?)(?: \[[\d.]*\])?</a>'
+)
+
+
+def get_title_page_fields(html):
+    """Get the word count, rating and series links from a FanFicFare title page.
+
+    Returns a dictionary with the fields that were found: "words" (int), "rating" and
+    "series", a list of (series id, series name).
+    """
+    fields = {}
+    words_match = word_count.search(html)
+    if words_match and words_match.group(1).replace(",", ""):
+        fields["words"] = int(words_match.group(1).replace(",", ""))
+    rating_match = rating.search(html)
+    if rating_match:
+        fields["rating"] = unescape(rating_match.group(1))
+    series = [(i, unescape(name)) for i, name in series_link.findall(html)]
+    if series:
+        fields["series"] = series
+    return fields
+
+
+def scan_epub(epub_path):
+    """Get the fields of an epub's title page, or None if it doesn't have one."""
+    html = read_title_page(epub_path)
+    if html is None:
+        return None
+    return get_title_page_fields(html)
+
+
+def scan_epubs(paths, workers=None):
+    """Read the title pages of many epubs in a pool of processes, one per CPU by
+    default.
+
+    :param paths: A dictionary of book id: epub path
+    :return: A generator of (book id, fields) in the order of paths, as the epubs are
+             read. Books whose epub has no title page are left out.
+    """
+    book_ids = list(paths)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            scan_epub, [paths[b] for b in book_ids], chunksize=SCAN_CHUNKSIZE
+        )
+        for book_id, fields in zip(book_ids, results):
+            if fields is not None:
+                yield book_id, fields
@@ -0,0 +1,124 @@
+# encoding: utf-8
+import os
+import posixpath
+import re
+import zlib
+from hashlib import sha256
+from urllib.parse import unquote
+from xml.etree import ElementTree
+from zipfile import BadZipFile, ZipFile
+
+CONTAINER_PATH = "META-INF/container.xml"
+NAMESPACES = {
+    "container": "urn:oasis:names:tc:opendocument:xmlns:container",
+    "opf": "http://www.idpf.org/2007/opf",
+}
+# Pages FanFicFare generates from the work's metadata and the time of the download,
+# rather than from the work's text.
+generated_page = re.compile(r"(^|/)(title_page|toc_page|log_page|cover)\.x?html$")
+title_page = re.compile(r"(^|/)title_page\.x?html$")
+chapter_url_meta = re.compile(r'(<meta name="chapterurl" content=")([^"]*)(")')
+# FanFicFare's mark for a chapter that failed to download. When it updates an epub, it
+# refetches the chapters with this mark instead of reusing them.
+REFETCH_CHAPTER_MARK = "chapter url removed due to failure"
+
+
+def get_content_hash(epub_path):
+    """Hash the chapters of an epub, in reading order.
+
+    The OPF, the cover and the pages FanFicFare generates (title page, table of
+    contents and update log) are left out, because they change with every download
+    even when the chapters don't.
+
+    Returns None if the file can't be read as an epub.
+    """
+    try:
+        with ZipFile(epub_path) as epub:
+            container = ElementTree.fromstring(epub.read(CONTAINER_PATH))
+            opf_path = container.find(
+                "container:rootfiles/container:rootfile", NAMESPACES
+            ).get("full-path")
+            opf = ElementTree.fromstring(epub.read(opf_path))
+            manifest = {
+                item.get("id"): item.get("href")
+                for item in opf.findall("opf:manifest/opf:item", NAMESPACES)
+            }
+
+            content_hash = sha256()
+            for itemref in opf.findall("opf:spine/opf:itemref", NAMESPACES):
+                href = manifest.get(itemref.get("idref"))
+                if href is None or generated_page.search(href):
+                    continue
+                path = posixpath.normpath(
+                    posixpath.join(posixpath.dirname(opf_path), unquote(href))
+                )
+                content_hash.update(href.encode("utf-8") + b"\0")
+                content_hash.update(epub.read(path))
+            return content_hash.hexdigest()
+    except (AttributeError, BadZipFile, ElementTree.ParseError, KeyError, OSError):
+        return None
+
+
+def read_title_page(epub_path):
+    """Read the title page FanFicFare generates, with the work's metadata, without
+    reading the rest of the epub.
+
+    Returns None if the epub can't be read or doesn't have a title page.
+    """
+    try:
+        with ZipFile(epub_path) as epub:
+            for name in epub.namelist():
+                if title_page.search(name):
+                    return epub.read(name).decode("utf-8", errors="replace")
+    except (BadZipFile, EOFError, KeyError, OSError, RuntimeError, zlib.error):
+        # RuntimeError includes NotImplementedError, for unsupported compression.
+        return None
+    return None
+
+
+def mark_chapters_for_refetch(epub_path, should_refetch):
+    """Make FanFicFare refetch some of the chapters of an epub the next time it
+    updates it, and reuse the rest.
+
+    FanFicFare finds the chapters it can reuse by the chapter url saved in each
+    chapter file, so the url of each chapter that should_refetch(url) is true for is
+    replaced with the mark FanFicFare gives chapters that failed to download.
+
+    Returns the number of chapters marked, or None if the epub can't be rewritten.
+    """
+    marked = 0
+
+    def mark(match):
+        nonlocal marked
+        if not should_refetch(match.group(2)):
+            return match.group(0)
+        marked += 1
+        return match.group(1) + REFETCH_CHAPTER_MARK + match.group(3)
+
+    try:
+        with ZipFile(epub_path) as epub, ZipFile(
+            epub_path + ".tmp", "w"
+        ) as marked_epub:
+            for info in epub.infolist():
+                data = epub.read(info)
+                if info.filename.endswith("html"):
+                    html = data.decode("utf-8")
+                    data = chapter_url_meta.sub(mark, html).encode("utf-8")
+                # The ZipInfo keeps the compression of each file, so the mimetype
+                # file stays uncompressed.
+                marked_epub.writestr(info, data)
+        os.replace(epub_path + ".tmp", epub_path)
+    except (
+        BadZipFile,
+        EOFError,
+        KeyError,
+        OSError,
+        RuntimeError,
+        UnicodeDecodeError,
+        zlib.error,
+    ):
+        if os.path.exists(epub_path + ".tmp"):
+            os.remove(epub_path + ".tmp")
+        return None
+
+    return marked
@@ -0,0 +1,79 @@
+# encoding: utf-8
+import os.path
+from concurrent.futures import ThreadPoolExecutor
+from shutil import move, rmtree
+from tempfile import mkdtemp
+from threading import Lock
+
+from .calibre import CalibreException
+from .utils import Bcolors, log
+
+# How many books to export from Calibre with each calibredb call.
+EXPORT_WINDOW = 50
+
+
+class ExportStager(object):
+    """Exports the epubs of the books we're about to update from Calibre ahead of
+    time, a window of books per calibredb call, into a staging directory.
+
+    A window is exported when the first book in the window before it is taken, so
+    while one window is downloading, the next one is already being exported in the
+    background.
+    """
+
+    def __init__(self, calibre, book_ids, window=EXPORT_WINDOW):
+        """book_ids are in the order the books will be downloaded in."""
+        self.calibre = calibre
+        self.windows = [
+            [str(i) for i in book_ids[start : start + window]]
+            for start in range(0, len(book_ids), window)
+        ]
+        self.window_index = {
+            book_id: index
+            for index, book_ids in enumerate(self.windows)
+            for book_id in book_ids
+        }
+        self.staging_dir = mkdtemp()
+        self.exports = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.lock = Lock()
+
+    def _export(self, index):
+        """Start exporting a window, if it hasn't been already."""
+        with self.lock:
+            if index >= len(self.windows) or index in self.exports:
+                return
+            self.exports[index] = self.executor.submit(
+                self.calibre.export_many, self.windows[index], self.staging_dir
+            )
+
+    def take(self, book_id, location):
+        """Move the exported epub of a book into location.
+
+        Returns the filepath of the epub, or None if it wasn't exported.
+        """
+        index = self.window_index.get(str(book_id))
+        if index is None:
+            return None
+
+        self._export(index)
+        self._export(index + 1)
+        try:
+            filepaths = self.exports[index].result()
+        except (CalibreException, OSError) as e:
+            # The book is exported on its own when it's downloaded instead.
+            log(f"\tCouldn't export books from Calibre in bulk: {e}", Bcolors.WARNING)
+            return None
+
+        filepath = filepaths.get(str(book_id))
+        if filepath is None or not os.path.isfile(filepath):
+            return None
+        try:
+            return move(filepath, os.path.join(location, os.path.basename(filepath)))
+        except OSError as e:
+            log(f"\tCouldn't move the exported epub {filepath}: {e}", Bcolors.WARNING)
+            return None
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+        rmtree(self.staging_dir, ignore_errors=True)
@@ -1,8 +1,11 @@
 import json
 import os.path
 import re
+import shlex
+import sys
 from subprocess import CalledProcessError
 
+from src import report
 from src.exceptions import (
     BadDataException,
     CloudflareWebsiteException,
@@ -14,6 +17,14 @@ from src.exceptions import (
 )
 from src.utils import check_subprocess_output
 
+IMAGE_CACHE_SCRIPT = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "image_cache.py"
+)
+# fanficfare is killed and run again if it runs for longer than this. Long works on a
+# rate-limited site can take a while, but not this long.
+FANFICFARE_TIMEOUT_SECONDS = 30 * 60
+FANFICFARE_RETRIES = 1
+
 # Compiled regular expressions
 metadata_dict = re.compile(r"\{.*}", flags=re.DOTALL)
 
@@ -45,6 +56,12 @@ updated_more_recently = re.compile(
 )
 
 
+def is_fatal_output(line):
+    """Whether a line of fanficfare's output means the download has already failed,
+    so there's no point in waiting for fanficfare to finish."""
+    return bool(too_many_requests.search(line) or cloudflare_error.search(line))
+
+
 def check_fff_output(output, command=""):
     if len(output) == 0:
         raise EmptyFanFicFareResponseException(command)
@@ -94,9 +111,26 @@ def get_metadata(output):
 class FanFicFareHelper(object):
     """Calls fanficfare CLI commands."""
 
-    def __init__(self, config_path):
+    def __init__(self, config_path, image_cache_dir=None, image_cache_size=None):
+        """If image_cache_dir and image_cache_size (in bytes) are given, fanficfare
+        is run through the image cache wrapper, so that images are shared between
+        all downloads instead of being fetched again for each one.
+        """
         self.config_path = config_path
-
+        self.image_cache_dir = image_cache_dir
+        self.image_cache_size = image_cache_size
+
+    def _fanficfare_command(self):
+        if self.image_cache_dir and self.image_cache_size:
+            return [
+                sys.executable,
+                IMAGE_CACHE_SCRIPT,
+                os.path.abspath(self.image_cache_dir),
+                str(self.image_cache_size),
+            ]
+        return ["fanficfare"]
+
+    @report.timed("fanficfare")
     def download(
         self,
         fic_to_download,
@@ -104,6 +138,8 @@ class FanFicFareHelper(object):
         update_epub=True,
         update_cover=True,
         force=False,
+        always_overwrite=False,
+        update_always=False,
     ):
         """Call fanficfare as a subprocess to download a fic and save it as an epub.
 
@@ -115,32 +151,66 @@ class FanFicFareHelper(object):
         :param force:           Whether to download the fic and update the fic epub
                                 despite the fic epub already containing as many chapters
                                 as the version of the fic online
+        :param always_overwrite: Whether to write the updated epub even if the
+                                existing file is newer than the fic's last update.
+                                Unlike force, this keeps the chapters already in the
+                                epub and only fetches new ones
+        :param update_always:   Whether to update the existing epub even if it
+                                already has as many chapters as the fic online. The
+                                chapters in the epub are reused, not refetched
         :return:
         """
         options = ["--json-meta"]
         if self.config_path:
-            options.append(f'--config="{self.config_path}"')
+            options.append(f"--config={self.config_path}")
         if update_epub:
             options.append("--update-epub")
+        if update_always:
+            options.append("--update-epub-always")
         if update_cover:
             options.append("--update-cover")
         if force:
             options.append("--force")
+        if always_overwrite:
+            options.append("--option=always_overwrite=true")
 
-        command = (
-            f'cd "{location}" && fanficfare {" ".join(options)} "{fic_to_download}"'
-        )
+        result = self._run(options, fic_to_download, location)
+
+        # Return path to newly-downloaded epub file, metadata
+        metadata = get_metadata(result)
+        filepath = os.path.join(location, metadata["output_filename"])
+
+        return filepath, metadata
+
+    @report.timed("fanficfare_metadata")
+    def get_metadata_only(self, fic_url, location):
+        """Call fanficfare to get a fic's metadata, including its chapter list,
+        without downloading any chapters or writing an epub.
+        """
+        options = ["--json-meta", "--meta-only", "--no-output"]
+        if self.config_path:
+            options.append(f"--config={self.config_path}")
+
+        return get_metadata(self._run(options, fic_url, location))
+
+    def _run(self, options, fic_to_download, location):
+        command = self._fanficfare_command() + options + [fic_to_download]
+        # An epub that's being updated may have been partly rewritten by the time
+        # fanficfare is killed, so only downloads from a url are retried.
+        retries = 0 if os.path.isfile(fic_to_download) else FANFICFARE_RETRIES
 
         try:
-            result = check_subprocess_output(command)
+            result = check_subprocess_output(
+                command,
+                timeout=FANFICFARE_TIMEOUT_SECONDS,
+                retries=retries,
+                cwd=location,
+                abort_on=is_fatal_output,
+            )
         except CalledProcessError as e:
             result = e.output
 
         # Throws exceptions if needed
-        check_fff_output(result, command)
+        check_fff_output(result, shlex.join(command))
 
-        # Return path to newly-downloaded epub file, metadata
-        metadata = get_metadata(result)
-        filepath = os.path.join(location, metadata["output_filename"])
-
-        return filepath, metadata
+        return result
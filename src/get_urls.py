@@ -5,8 +5,7 @@ import sys
 from datetime import datetime
 from json import JSONDecodeError
 
-from fanficfare.geturls import get_urls_from_imap
-
+from src import report
 from src.ao3_utils import (
     get_ao3_bookmark_urls,
     get_ao3_collection_work_urls,
@@ -35,6 +34,7 @@ from src.options import (
     SOURCE_WORKS,
     SOURCES,
 )
+from src.subscription_emails import get_chapter_updates_from_imap
 from src.utils import AO3_DEFAULT_URL, DATE_FORMAT, Bcolors, log
 
 LAST_UPDATE_KEYS = [SOURCES, SOURCE_USERNAMES, SOURCE_COLLECTIONS, SOURCE_SERIES]
@@ -141,6 +141,39 @@ def normalise_urls(urls, base_url=None):
     return {normalise(url) for url in urls}
 
 
+def get_imap_chapter_updates(options):
+    """Collect the chapter updates announced by AO3 subscription emails in the imap
+    folder, so that they can be downloaded without refetching the whole work.
+
+    This has to run before get_urls, which marks the emails as read. If anything
+    goes wrong, we just don't use the fast path for these works.
+    """
+    if SOURCE_IMAP not in options.sources:
+        return {}
+
+    try:
+        chapter_updates = get_chapter_updates_from_imap(
+            srv=options.email_server,
+            user=options.email_user,
+            passwd=options.email_password,
+            folder=options.email_folder,
+        )
+    except Exception as e:
+        log(
+            f"Couldn't read chapter updates from subscription emails: {e}",
+            Bcolors.WARNING,
+        )
+        return {}
+
+    log(
+        f"{len(chapter_updates)} works with new chapters from subscription emails",
+        Bcolors.OKGREEN,
+    )
+
+    return chapter_updates
+
+
+@report.timed("get_urls")
 def get_urls(options):
     oldest_dates_per_source = get_oldest_date(options)
 
@@ -343,6 +376,9 @@ def get_urls(options):
             url_count = len(urls)
 
         if SOURCE_IMAP in options.sources:
+            # Imported here because importing FanFicFare is slow.
+            from fanficfare.geturls import get_urls_from_imap
+
             mark_read = not options.email_leave_unread
             imap_urls = get_urls_from_imap(
                 srv=options.email_server,
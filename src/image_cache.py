@@ -0,0 +1,245 @@
+# encoding: utf-8
+"""A shared on-disk cache for the images FanFicFare embeds in epubs.
+
+FanFicFare runs as a separate process, so this module can also be run as a script
+that wraps the fanficfare CLI:
+
+    python image_cache.py CACHE_DIR MAX_SIZE_BYTES [fanficfare arguments...]
+
+It then installs a fetcher decorator that answers image requests from the cache
+and saves every newly fetched image into it. Only responses whose Content-Type is an
+image are cached. Images are stored once per content hash, so the same banner linked
+from many urls is only stored once, and the least recently used images are evicted
+when the cache grows over its size cap.
+
+Several fanficfare processes can share the cache: the index is locked while it's
+saved, and merged with the entries the other processes have saved in the meantime.
+
+This file must not import anything from the rest of the package.
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from json import JSONDecodeError
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows.
+    fcntl = None
+
+INDEX_FILENAME = "index.json"
+
+
+def is_image_content_type(content_type):
+    """Whether a response's Content-Type header says it's an image."""
+    if not content_type:
+        return False
+    return content_type.split(";")[0].strip().lower().startswith("image/")
+
+
+class ImageCache(object):
+    """Images keyed by source url, stored by content hash, evicted in LRU order.
+
+    The index is a json file: {url: {"hash": ..., "size": ..., "last_used": ...}}.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.index_path = os.path.join(directory, INDEX_FILENAME)
+        self.index = self._load_index()
+        # The urls this process has forgotten, with the hash they had, so that
+        # saving doesn't bring them back from the index on disk.
+        self.removed = {}
+
+    @contextmanager
+    def _locked_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.index_path + ".lock", "w") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        if not os.path.isfile(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, "r") as f:
+                return json.loads(f.read())
+        except JSONDecodeError:
+            return {}
+
+    def _blob_path(self, content_hash):
+        return os.path.join(self.directory, content_hash[:2], content_hash)
+
+    def get(self, url):
+        entry = self.index.get(url)
+        if entry is None:
+            return None
+
+        try:
+            with open(self._blob_path(entry["hash"]), "rb") as f:
+                data = f.read()
+        except OSError:
+            self._forget(url)
+            return None
+
+        entry["last_used"] = time.time()
+        return data
+
+    def put(self, url, data):
+        content_hash = hashlib.sha256(data).hexdigest()
+        blob_path = self._blob_path(content_hash)
+        if not os.path.isfile(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            with open(blob_path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(blob_path + ".tmp", blob_path)
+
+        self.index[url] = {
+            "hash": content_hash,
+            "size": len(data),
+            "last_used": time.time(),
+        }
+        self.removed.pop(url, None)
+
+    def _forget(self, url):
+        entry = self.index.pop(url)
+        self.removed[url] = entry["hash"]
+        return entry
+
+    def total_size(self):
+        # Images shared by several urls are only stored, and counted, once.
+        return sum({e["hash"]: e["size"] for e in self.index.values()}.values())
+
+    def evict(self):
+        """Forget the least recently used urls until the stored images fit in
+        max_size, and delete images that no url refers to anymore.
+        """
+        if self.total_size() <= self.max_size:
+            return
+
+        urls_by_age = sorted(self.index, key=lambda u: self.index[u]["last_used"])
+        for url in urls_by_age:
+            if self.total_size() <= self.max_size:
+                break
+            entry = self._forget(url)
+            if entry["hash"] not in {e["hash"] for e in self.index.values()}:
+                try:
+                    os.remove(self._blob_path(entry["hash"]))
+                except OSError:
+                    pass
+
+    def _merge_saved_index(self):
+        """Add the entries other processes have saved since this one loaded the
+        index, keeping the most recently used entry of each url."""
+        saved = self._load_index()
+        for url, content_hash in self.removed.items():
+            if url in saved and saved[url]["hash"] == content_hash:
+                del saved[url]
+        for url, entry in self.index.items():
+            if url not in saved or entry["last_used"] >= saved[url]["last_used"]:
+                saved[url] = entry
+        self.index = saved
+
+    def save(self):
+        """Merge the index with the one on disk, evict images if the merged index
+        is over the size cap, and write it."""
+        with self._locked_index():
+            self._merge_saved_index()
+            self.evict()
+            with open(self.index_path + ".tmp", "w") as f:
+                f.write(json.dumps(self.index))
+            os.replace(self.index_path + ".tmp", self.index_path)
+        self.removed = {}
+
+
+def install_fanficfare_decorator(cache):
+    """Make every fetcher that FanFicFare creates look up images in the cache."""
+    from fanficfare import configurable
+    from fanficfare.fetchers.base_fetcher import FetcherResponse
+    from fanficfare.fetchers.decorators import FetcherDecorator
+
+    class ImageCacheDecorator(FetcherDecorator):
+        def fetcher_do_request(
+            self,
+            fetcher,
+            chainfn,
+            method,
+            url,
+            parameters=None,
+            referer=None,
+            usecache=True,
+        ):
+            if method == "GET" and not parameters:
+                data = cache.get(url)
+                if data is not None:
+                    return FetcherResponse(data, redirecturl=url, fromcache=True)
+
+            fetchresp = chainfn(
+                method, url, parameters=parameters, referer=referer, usecache=usecache
+            )
+            content_type = content_types.pop(fetchresp.redirecturl or url, None)
+            if (
+                method == "GET"
+                and not parameters
+                and is_image_content_type(content_type)
+            ):
+                cache.put(url, fetchresp.content)
+
+            return fetchresp
+
+    # FetcherResponse doesn't keep the response headers, so record the Content-Type
+    # of each response of the fetchers that use requests, by the response's url.
+    # Responses from other fetchers aren't cached.
+    content_types = {}
+
+    def record_content_type(response, *args, **kwargs):
+        content_types[response.url] = response.headers.get("Content-Type")
+
+    def add_content_type_hook(fetcher):
+        get_requests_session = fetcher.get_requests_session
+
+        def get_requests_session_with_hook():
+            session = get_requests_session()
+            if record_content_type not in session.hooks["response"]:
+                session.hooks["response"].append(record_content_type)
+            return session
+
+        fetcher.get_requests_session = get_requests_session_with_hook
+
+    get_fetcher = configurable.Configuration.get_fetcher
+
+    def get_fetcher_with_image_cache(self, *args, **kwargs):
+        fetcher = get_fetcher(self, *args, **kwargs)
+        if not getattr(fetcher, "image_cache_decorated", False):
+            if hasattr(fetcher, "get_requests_session"):
+                add_content_type_hook(fetcher)
+            ImageCacheDecorator().decorate_fetcher(fetcher)
+            fetcher.image_cache_decorated = True
+        return fetcher
+
+    configurable.Configuration.get_fetcher = get_fetcher_with_image_cache
+
+
+def main(argv):
+    from fanficfare import cli
+
+    cache = ImageCache(argv[0], int(argv[1]))
+    install_fanficfare_decorator(cache)
+    try:
+        cli.main(argv[2:])
+    finally:
+        cache.save()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,12 +1,17 @@
 # encoding: utf-8
+import re
 import sys
 from argparse import ArgumentParser, ArgumentTypeError
 from configparser import ConfigParser
 from datetime import datetime
 
+from src.exceptions import InvalidConfig
+from src.profiling import PSTATS_FILENAME, SUMMARY_FILENAME
 from src.utils import AO3_DEFAULT_URL, DATE_FORMAT
 
-COMMANDS = ["download", "analyse"]
+COMMANDS = ["download", "analyse", "watch", "retag", "tags", "backfill"]
+# Commands that only work on the Calibre library, so they don't need an AO3 login.
+LIBRARY_COMMANDS = ["retag", "tags", "backfill"]
 
 SOURCES = "sources"
 SOURCE_FILE = "file"
@@ -25,6 +30,8 @@ SOURCE_SERIES = "series"
 SOURCE_COLLECTIONS = "collections"
 INCOMPLETE = "incomplete_works"
 DEFAULT_LAST_UPDATE_FILE = "last_update.json"
+DEFAULT_CACHE_DIR = "cache"
+DEFAULT_POLL_MINUTES = 30
 
 ANALYSIS_TYPES = [
     SOURCE_USER_SUBSCRIPTIONS,
@@ -126,10 +133,49 @@ def validate_analysis_type(options):
             )
 
 
+def validate_workers(options):
+    if options.workers < 1:
+        raise InvalidConfig(f"'workers' should be at least 1, not {options.workers}")
+
+
+def validate_time_budget(options):
+    if options.time_budget is not None and options.time_budget <= 0:
+        raise InvalidConfig(
+            f"'time_budget' should be a number of minutes above 0, not "
+            f"{options.time_budget}"
+        )
+
+
+def get_flag_options(arg_parser):
+    """Get the names (without the leading --) of the options that don't take a
+    value, i.e. the ones defined using "store_true"."""
+    return {
+        option.lstrip("-")
+        for action in arg_parser._actions
+        if action.nargs == 0
+        for option in action.option_strings
+        if option.startswith("--")
+    }
+
+
 def comma_separated_list(value):
     return value.split(",")
 
 
+def poll_intervals(value):
+    """Parse "source=minutes,source=minutes" into a dictionary."""
+    intervals = {}
+    for interval in value.split(","):
+        source, _, minutes = interval.partition("=")
+        if source not in VALID_INPUT_SOURCES or not minutes.isdigit():
+            raise ArgumentTypeError(
+                f"Poll intervals should look like 'bookmarks=30,later=60', "
+                f"with valid sources, not '{interval}'"
+            )
+        intervals[source] = int(minutes)
+    return intervals
+
+
 def set_up_options():
     usage = """usage: python %(prog)s [command] [flags]
 
@@ -137,6 +183,13 @@ Commands available:
 
 download    Download fics from AO3 and save to Calibre library
 analyse     Analyse contents of Calibre library and AO3 data
+watch       Keep running, downloading new fics from the sources as they appear, and
+            fics whose urls are submitted on a local socket
+retag       Move tags saved as "type.value" (e.g. "fandoms.Harry Potter") into the
+            tag-type columns of the Calibre library
+tags        Rename or merge tags in all the tag-like columns of the Calibre library
+backfill    Fill in the word count and rating of every book in the Calibre library,
+            from the title pages of their epubs
     """
 
     arg_parser = ArgumentParser(usage=usage)
@@ -273,6 +326,87 @@ any dates. This option overrides --since.""",
 number of chapters locally as online.""",
     )
 
+    arg_parser.add_argument(
+        "--time-budget",
+        action="store",
+        dest="time_budget",
+        type=int,
+        default=None,
+        help="""Maximum number of minutes to spend downloading. Works new to the Calibre
+library and works with new chapters announced in subscription emails are downloaded
+first, and long complete works last. When the next download wouldn't fit in the time
+that's left, the run stops and the remaining urls are saved in the input file, to be
+downloaded next time. Default: no limit.""",
+    )
+
+    arg_parser.add_argument(
+        "--workers",
+        action="store",
+        dest="workers",
+        type=int,
+        default=1,
+        help="""Number of works to download at the same time. With more than one
+worker, long works (by word count in the Calibre library) get their own lane with a
+quarter of the workers, so that they don't hold up all the short works. Adding books
+to the Calibre library still happens one at a time. Default: 1.""",
+    )
+
+    arg_parser.add_argument(
+        "--poll-intervals",
+        action="store",
+        dest="poll_intervals",
+        type=poll_intervals,
+        default={},
+        help=f"""For the watch command: how often to poll each source for new urls, in
+minutes, comma separated. Example: bookmarks=30,later=60,imap=5. Sources not listed
+here are polled every {DEFAULT_POLL_MINUTES} minutes.""",
+    )
+
+    arg_parser.add_argument(
+        "--socket",
+        action="store",
+        dest="socket",
+        default=None,
+        help="""For the watch command: the unix socket to listen on for urls to
+download, one per line. Example: printf 'https://archiveofourown.org/works/1\\n' |
+socat - UNIX-CONNECT:cache/watch.sock. Default: watch.sock in the cache directory.""",
+    )
+
+    arg_parser.add_argument(
+        "--report",
+        action="store",
+        dest="report",
+        default=None,
+        help="""Write a json report of the download run to this file: how long each
+phase (searching Calibre, exporting, FanFicFare, adding, setting metadata, ...) took in
+total and at the 50th/95th/99th percentile, how many subprocesses and HTTP requests
+were made, and which works were slowest. Default: no report.""",
+    )
+
+    arg_parser.add_argument(
+        "--trace",
+        action="store",
+        dest="trace",
+        default=None,
+        help="""Write a trace of the download run to this file, in the Chrome trace
+event format (open it in chrome://tracing, https://ui.perfetto.dev or speedscope). It
+has nested spans for url collection per source and per AO3 page, and for each download,
+its phases and every calibredb/fanficfare subprocess. Default: no trace.""",
+    )
+
+    arg_parser.add_argument(
+        "--profile",
+        action="store",
+        dest="profile",
+        default=None,
+        help=f"""Profile the run and write the results to this directory: cProfile stats
+for the whole run in {PSTATS_FILENAME} (open it with python -m pstats or snakeviz) and
+a summary of the slowest functions in {SUMMARY_FILENAME}, plus the top memory allocation
+sites after collecting urls, after looking up the works in the library, after the
+downloads and at the end. Profiling makes the run noticeably slower.
+Default: no profiling.""",
+    )
+
     arg_parser.add_argument(
         "-i",
         "--input",
@@ -316,7 +450,13 @@ running on a calibre-server and requires user/password to access it.""",
         action="store_true",
         dest="dry_run",
         help="""Dry run: only fetch bookmark links from AO3, don't download works or
-add them to Calibre""",
+add them to Calibre.
+For the retag command: only count the books whose tags would be moved into each
+column.
+For the tags command: only list the tags that would be renamed, with how many books
+each one is linked to.
+For the backfill command: only count the books whose value in each column is missing
+or different from the one in their epub.""",
     )
 
     arg_parser.add_argument(
@@ -405,6 +545,28 @@ Example file content: {{"later": "01.01.2021", "bookmarks": "02.01.2021"}}.
 Will be created if it doesn't exist. Default: '{DEFAULT_LAST_UPDATE_FILE}'.""",
     )
 
+    arg_parser.add_argument(
+        "--cache-dir",
+        action="store",
+        dest="cache_dir",
+        default=DEFAULT_CACHE_DIR,
+        help=f"""Directory for data that is kept between runs to avoid refetching it,
+e.g. the chapter list of each work saved in the Calibre library. Will be created if it
+doesn't exist. Default: '{DEFAULT_CACHE_DIR}'.""",
+    )
+
+    arg_parser.add_argument(
+        "--image-cache-size",
+        action="store",
+        dest="image_cache_size",
+        type=int,
+        default=None,
+        help="""Maximum size in MB of a cache of the images embedded in fics, shared
+between all works and all runs, so that each image is only downloaded once. The least
+recently used images are removed when the cache is full. Only useful if
+include_images is set to true in the FanFicFare config. Default: no image cache.""",
+    )
+
     arg_parser.add_argument(
         "-M",
         "--mirror",
@@ -454,6 +616,44 @@ Default: all.""",
         help="""If missing works are discovered during analysis, download them.""",
     )
 
+    arg_parser.add_argument(
+        "--strip-tag-prefix",
+        action="store",
+        dest="strip_tag_prefix",
+        default=None,
+        help="""For the tags command: remove this prefix from the tags that have it.
+Example: fanfic.""",
+    )
+
+    arg_parser.add_argument(
+        "--tag-pattern",
+        action="store",
+        dest="tag_pattern",
+        type=re.compile,
+        default=None,
+        help="""For the tags command: a regular expression to replace in tags, with
+--tag-replacement. Applied after --strip-tag-prefix.""",
+    )
+
+    arg_parser.add_argument(
+        "--tag-replacement",
+        action="store",
+        dest="tag_replacement",
+        default="",
+        help="""For the tags command: what to replace --tag-pattern with. Can refer to
+groups of the pattern, e.g. \\1. Default: an empty string.""",
+    )
+
+    arg_parser.add_argument(
+        "--tag-mapping",
+        action="store",
+        dest="tag_mapping",
+        default=None,
+        help="""For the tags command: a json file of {"old tag": "new tag"}, applied
+after --strip-tag-prefix and --tag-pattern. Renaming a tag to the name of an existing
+tag merges them.""",
+    )
+
     # First, parse the args from the CLI.
     cli_args = arg_parser.parse_args()
 
@@ -461,26 +661,30 @@ Default: all.""",
         # Add the cli arguments to the config-file arguments, at the end so they
         # override them. We don't want to add the argv[0] (the script filename) or the
         # command to the list.
-        total_args = get_config_file_arguments(cli_args) + [
-            a for a in sys.argv[1:] if a != cli_args.command
-        ]
+        total_args = get_config_file_arguments(
+            cli_args, get_flag_options(arg_parser)
+        ) + [a for a in sys.argv[1:] if a != cli_args.command]
         parsed_args = arg_parser.parse_args(total_args)
     else:
         parsed_args = cli_args
 
     # Validate options and set default values
-    validate_user(parsed_args)
-    validate_cookie(parsed_args)
+    if parsed_args.command not in LIBRARY_COMMANDS:
+        validate_user(parsed_args)
+        validate_cookie(parsed_args)
     validate_sources(parsed_args)
     validate_since(parsed_args)
     validate_analysis_type(parsed_args)
+    validate_workers(parsed_args)
+    validate_time_budget(parsed_args)
 
     return parsed_args.command, parsed_args
 
 
-def get_config_file_arguments(cli_args):
+def get_config_file_arguments(cli_args, flags):
     """If we have a config file, get the options from there, and then parse them
     using the arg_parser. This ensures values are converted into the right types.
+    flags are the names of the options that don't take a value (see get_flag_options).
     """
     config_parser = ConfigParser(allow_no_value=True)
     config_parser.read(cli_args.config)
@@ -492,18 +696,23 @@ def get_config_file_arguments(cli_args):
                 # Ignore config options that don't have values in config.ini.
                 continue
 
-            try:
+            if opt in flags:
                 # Boolean arguments are all defined using "store_true", so when we
                 # pass them into the arg_parser, they don't take a value
-                # afterwards. If a value can be got from config.ini as a
-                # bool and it's True, we only need to add the argument name to
+                # afterwards. If it's True, we only need to add the argument name to
                 # config_file_args. If it's False, we don't want to add it
                 # at all, because that's the default for our boolean arguments.
-                if config_parser.getboolean(sect, opt):
-                    config_file_args.append("--" + opt)
-            except ValueError:
-                # If we got an error trying to get the value as a bool, then we
-                # need to add both the argument and its value to config_file_args.
+                try:
+                    if config_parser.getboolean(sect, opt):
+                        config_file_args.append("--" + opt)
+                except ValueError:
+                    raise InvalidConfig(
+                        f"'{opt}' in {cli_args.config} should be True or False, "
+                        f"not {value}"
+                    )
+            else:
+                # Other options always take a value, even one that looks like a bool,
+                # e.g. workers=1.
                 config_file_args.append("--" + opt)
                 config_file_args.append(value)
 
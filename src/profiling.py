@@ -0,0 +1,121 @@
+# encoding: utf-8
+"""Profiling of a whole run with cProfile, and of its memory use with tracemalloc
+snapshots taken at the boundaries between phases.
+"""
+import cProfile
+import io
+import os
+import pstats
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+PSTATS_FILENAME = "profile.pstats"
+SUMMARY_FILENAME = "profile.txt"
+TOP_FUNCTIONS_COUNT = 50
+TOP_ALLOCATIONS_COUNT = 25
+TRACEMALLOC_FRAMES = 10
+
+# The profiler for the current run, if profiling was requested.
+_active_profiler = None
+
+
+class Profiler(object):
+    """cProfile only profiles the thread it was enabled in, so each worker thread
+    gets its own profile (see thread_profile), and they're all merged at the end.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.main_profile = cProfile.Profile()
+        self.thread_profiles = []
+        self.snapshot_count = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.main_profile.enable()
+
+    def stop(self):
+        self.main_profile.disable()
+        self.snapshot("end")
+        tracemalloc.stop()
+
+        stats = pstats.Stats(self.main_profile)
+        for profile in self.thread_profiles:
+            stats.add(profile)
+        stats.dump_stats(os.path.join(self.directory, PSTATS_FILENAME))
+
+        summary = io.StringIO()
+        stats.stream = summary
+        stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS_COUNT)
+        stats.sort_stats("tottime").print_stats(TOP_FUNCTIONS_COUNT)
+        with open(os.path.join(self.directory, SUMMARY_FILENAME), "w") as f:
+            f.write(summary.getvalue())
+
+    def add_thread_profile(self, profile):
+        with self.lock:
+            self.thread_profiles.append(profile)
+
+    def snapshot(self, phase):
+        """Write out the top allocation sites of the memory in use right now."""
+        with self.lock:
+            self.snapshot_count += 1
+            path = os.path.join(
+                self.directory, f"memory_{self.snapshot_count:02d}_{phase}.txt"
+            )
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ]
+        )
+        current, peak = tracemalloc.get_traced_memory()
+        top_stats = snapshot.statistics("traceback")
+        with open(path, "w") as f:
+            f.write(f"Phase: {phase}\n")
+            f.write(f"Current: {current / 1024:.1f} KiB, peak: {peak / 1024:.1f} KiB\n")
+            for index, stat in enumerate(top_stats[:TOP_ALLOCATIONS_COUNT], 1):
+                f.write(
+                    f"\n#{index}: {stat.size / 1024:.1f} KiB in {stat.count} blocks\n"
+                )
+                for line in stat.traceback.format():
+                    f.write(f"{line}\n")
+
+
+def start_profiling(directory):
+    global _active_profiler
+    _active_profiler = Profiler(directory)
+    _active_profiler.start()
+    return _active_profiler
+
+
+def stop_profiling():
+    global _active_profiler
+    if _active_profiler is not None:
+        _active_profiler.stop()
+    _active_profiler = None
+
+
+def snapshot(phase):
+    if _active_profiler is not None:
+        _active_profiler.snapshot(phase)
+
+
+@contextmanager
+def thread_profile():
+    """Profile the code run in a worker thread, if profiling is on."""
+    if _active_profiler is None:
+        yield
+        return
+
+    profiler = _active_profiler
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profiler.add_thread_profile(profile)
@@ -0,0 +1,144 @@
+# encoding: utf-8
+import json
+import os.path
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from time import monotonic
+
+from . import tracing
+from .utils import command_name, percentile, subprocess_listeners
+
+SLOWEST_WORKS_COUNT = 10
+
+# The report for the current run, if one was requested. When there is no report and
+# no tracing, timing a phase costs one function call and two checks for None.
+_active_report = None
+_current = threading.local()
+
+
+class RunReport(object):
+    """Collects timings for each phase of a run, per url, and counters for
+    subprocesses and HTTP requests, and writes them out as json.
+    """
+
+    def __init__(self):
+        self.started = datetime.now()
+        self.start = monotonic()
+        self.phase_seconds = {}
+        self.work_seconds = {}
+        self.work_phase_seconds = {}
+        self.counters = {"subprocess_spawns": 0, "http_requests": 0}
+        self.subprocess_spawns_by_command = {}
+        self.extra = {}
+        self.lock = threading.Lock()
+
+    def record_phase(self, phase, seconds, url=None):
+        with self.lock:
+            self.phase_seconds.setdefault(phase, []).append(seconds)
+            if url:
+                phases = self.work_phase_seconds.setdefault(url, {})
+                phases[phase] = phases.get(phase, 0) + seconds
+
+    def record_work(self, url, seconds):
+        with self.lock:
+            self.work_seconds[url] = seconds
+
+    def count(self, counter, n=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def record_subprocess(self, command, seconds):
+        executable = command_name(command)
+        self.count("subprocess_spawns")
+        self.record_phase(
+            f"subprocess:{executable}", seconds, getattr(_current, "url", None)
+        )
+        with self.lock:
+            self.subprocess_spawns_by_command[executable] = (
+                self.subprocess_spawns_by_command.get(executable, 0) + 1
+            )
+
+    def to_dict(self):
+        slowest = sorted(self.work_seconds.items(), key=lambda w: w[1], reverse=True)
+        return {
+            "started": self.started.isoformat(timespec="seconds"),
+            "wall_seconds": round(monotonic() - self.start, 3),
+            "phases": {
+                phase: {
+                    "count": len(seconds),
+                    "total_seconds": round(sum(seconds), 3),
+                    "p50": percentile(seconds, 50),
+                    "p95": percentile(seconds, 95),
+                    "p99": percentile(seconds, 99),
+                }
+                for phase, seconds in self.phase_seconds.items()
+            },
+            "counters": dict(
+                self.counters,
+                subprocess_spawns_by_command=self.subprocess_spawns_by_command,
+            ),
+            "slowest_works": [
+                {
+                    "url": url,
+                    "seconds": round(seconds, 3),
+                    "phases": self.work_phase_seconds.get(url, {}),
+                }
+                for url, seconds in slowest[:SLOWEST_WORKS_COUNT]
+            ],
+            **self.extra,
+        }
+
+    def write(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            f.write(json.dumps(self.to_dict(), indent=2))
+
+
+def start_report():
+    global _active_report
+    _active_report = RunReport()
+    subprocess_listeners.append(_active_report.record_subprocess)
+    return _active_report
+
+
+def stop_report():
+    global _active_report
+    if _active_report is not None:
+        subprocess_listeners.remove(_active_report.record_subprocess)
+    _active_report = None
+
+
+def get_report():
+    return _active_report
+
+
+def count(counter, n=1):
+    if _active_report is not None:
+        _active_report.count(counter, n)
+
+
+def set_current_url(url):
+    """Record the phases timed in this thread from now on against this url."""
+    _current.url = url
+
+
+@contextmanager
+def timed(phase):
+    """Time a phase for the run report, and trace it as a span if tracing is on."""
+    if _active_report is None and not tracing.is_tracing():
+        yield
+        return
+
+    run_report = _active_report
+    start = monotonic()
+    try:
+        with tracing.span(phase, category="phase"):
+            yield
+    finally:
+        if run_report is not None:
+            run_report.record_phase(
+                phase, monotonic() - start, getattr(_current, "url", None)
+            )
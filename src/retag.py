@@ -0,0 +1,142 @@
+# encoding: utf-8
+from .calibre import CalibreException, CalibreHelper
+from .utils import TAG_TYPES, Bcolors, log, normalise_tag
+
+# How many books are retagged in each bulk write. Each chunk is saved in the library
+# before the next one is started.
+RETAG_CHUNK_SIZE = 5000
+
+
+def split_tags(tags):
+    """Move the tags that FanFicFare saved as "type.value" (e.g. "fandoms.Harry
+    Potter") into the column for their tag type, and keep the rest as tags.
+
+    Returns the options for set_metadata, or None if none of the tags have a tag type.
+    """
+    columns = {}
+    other_tags = []
+    for tag in tags:
+        tag_type, _, value = tag.partition(".")
+        if tag_type in TAG_TYPES and value:
+            columns.setdefault(f"#{tag_type}", []).append(normalise_tag(value))
+        else:
+            other_tags.append(tag)
+
+    if not columns:
+        return None
+
+    options = {column: ",".join(values) for column, values in columns.items()}
+    options["tags"] = ",".join(other_tags)
+    return options
+
+
+def get_retag_updates(all_tags):
+    """Get the options for set_metadata of each book whose tags need to be moved into
+    the tag-type columns, by book id."""
+    updates = {}
+    for book_id, tags in all_tags.items():
+        options = split_tags(tags)
+        if options:
+            updates[book_id] = options
+    return updates
+
+
+def add_column_values(options, current):
+    """Keep the values that are already in the tag-type columns, e.g. from newer
+    downloads, by adding them to the values moved from the tags.
+
+    :param options: A book's options for set_metadata, as from split_tags
+    :param current: The book's current values, as from get_metadata_values
+    """
+    for column, value in options.items():
+        if column == "tags" or column not in current:
+            continue
+
+        _, current_values = current[column]
+        values = sorted(current_values or [])
+        # Calibre treats values that only differ in case as the same value.
+        known = {v.casefold() for v in values}
+        for new_value in value.split(","):
+            if new_value.casefold() not in known:
+                values.append(new_value)
+                known.add(new_value.casefold())
+        options[column] = ",".join(values)
+
+    return options
+
+
+def _log_dry_run(updates):
+    column_counts = {}
+    for options in updates.values():
+        for column in options:
+            if column != "tags":
+                column_counts[column] = column_counts.get(column, 0) + 1
+
+    log("Dry run: not changing the library. Books with tags for each column:")
+    for column in sorted(column_counts):
+        log(f"\t{column}: {column_counts[column]}", Bcolors.OKBLUE)
+
+
+def retag(options):
+    if not options.library:
+        log(
+            """To retag a Calibre library, a path to the library is required.
+
+Example: \"/home/myuser/Calibre Library\"""",
+            Bcolors.FAIL,
+        )
+        return
+
+    calibre = CalibreHelper(
+        library_path=options.library,
+        user=options.calibre_user,
+        password=options.calibre_password,
+    )
+
+    try:
+        calibre.check_library()
+        updates = get_retag_updates(calibre.get_all_tags())
+    except CalibreException as e:
+        log(str(e), Bcolors.FAIL)
+        return
+
+    if not updates:
+        log("No books have tags to move into the tag-type columns.", Bcolors.OKGREEN)
+        return
+
+    for book_id, book_options in updates.items():
+        current = calibre.get_metadata_values(book_id, book_options.keys())
+        if current is None:
+            log(
+                "The values already in the tag-type columns can only be read from a "
+                "local Calibre library, not from a Calibre server, so retagging "
+                "would overwrite them.",
+                Bcolors.FAIL,
+            )
+            return
+        add_column_values(book_options, current)
+
+    log(
+        f"Moving the tags of {len(updates)} books into the tag-type columns",
+        Bcolors.HEADER,
+    )
+    if options.dry_run:
+        _log_dry_run(updates)
+        return
+
+    # Books that have been retagged have no tags with a tag type left, so if the run
+    # is interrupted, running it again carries on from the last chunk that was saved.
+    book_ids = sorted(updates, key=int)
+    for i in range(0, len(book_ids), RETAG_CHUNK_SIZE):
+        chunk = book_ids[i : i + RETAG_CHUNK_SIZE]
+        try:
+            calibre.set_metadata_many({book_id: updates[book_id] for book_id in chunk})
+        except CalibreException as e:
+            log(f"Error retagging books: {e.message}", Bcolors.FAIL)
+            log("The books retagged so far are saved. Run retag again to carry on.")
+            return
+
+        done = i + len(chunk)
+        log(f"PROGRESS: {done}/{len(book_ids)}, {done * 100 / len(book_ids):.0f}%")
+
+    log(f"Retagged {len(book_ids)} books.", Bcolors.OKGREEN)
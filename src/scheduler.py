@@ -0,0 +1,218 @@
+# encoding: utf-8
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic
+
+from . import profiling
+from .utils import percentile
+
+# Lower numbers are downloaded first.
+PRIORITY_NEW = 0
+PRIORITY_SUBSCRIPTION_UPDATE = 1
+PRIORITY_UPDATE = 2
+PRIORITY_COMPLETE = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_NEW: "new to library",
+    PRIORITY_SUBSCRIPTION_UPDATE: "subscription update",
+    PRIORITY_UPDATE: "update",
+    PRIORITY_COMPLETE: "complete work",
+}
+
+# Rough cost model for a download, in seconds: a fixed overhead for the calibre and
+# fanficfare subprocesses, plus time proportional to the length of the work.
+BASE_SECONDS = 20
+SECONDS_PER_1000_WORDS = 0.5
+# Works that aren't in the library yet have no word count, so we guess.
+DEFAULT_WORDS = 20000
+
+# Works at least this long go into their own lane, so they can't hold up the
+# downloads of all the short works queued behind them.
+LONG_WORK_WORDS = 100000
+LANE_ALL = "all"
+LANE_SHORT = "short"
+LANE_LONG = "long"
+
+
+def estimate_seconds(words):
+    if not words:
+        words = DEFAULT_WORDS
+    return BASE_SECONDS + words / 1000 * SECONDS_PER_1000_WORDS
+
+
+def get_download_jobs(urls, works_info, chapter_updates=None):
+    """Put the urls to download in the order we want to download them.
+
+    Works that aren't in the library yet come first, then works with new chapters
+    announced in subscription emails, then other updates, and complete works last.
+    Within each of these groups, cheaper downloads come first.
+
+    Returns a list of jobs: {"url": ..., "priority": ..., "words": ..., "cost": ...}.
+    """
+    if chapter_updates is None:
+        chapter_updates = {}
+
+    jobs = []
+    for url in urls:
+        info = works_info.get(url)
+        if info is None:
+            priority = PRIORITY_NEW
+        elif url in chapter_updates:
+            priority = PRIORITY_SUBSCRIPTION_UPDATE
+        elif "Completed" in info["status"]:
+            priority = PRIORITY_COMPLETE
+        else:
+            priority = PRIORITY_UPDATE
+
+        words = info["words"] if info else None
+        jobs.append(
+            {
+                "url": url,
+                "priority": priority,
+                "words": words,
+                "cost": estimate_seconds(words),
+            }
+        )
+
+    return sorted(jobs, key=lambda j: (j["priority"], j["cost"], j["url"]))
+
+
+def split_into_lanes(jobs, workers):
+    """Split the jobs (already in priority order) into lanes, and decide how many
+    workers each lane gets.
+
+    With a single worker, everything runs in one lane in priority order. Otherwise,
+    long works get a quarter of the workers (at least one) and the rest are
+    reserved for shorter works.
+
+    Returns ({lane: [jobs]}, {lane: number of workers}).
+    """
+    if workers <= 1:
+        return {LANE_ALL: jobs}, {LANE_ALL: 1}
+
+    lanes = {LANE_SHORT: [], LANE_LONG: []}
+    for job in jobs:
+        if (job["words"] or DEFAULT_WORDS) >= LONG_WORK_WORDS:
+            lanes[LANE_LONG].append(job)
+        else:
+            lanes[LANE_SHORT].append(job)
+
+    long_workers = max(1, workers // 4)
+    return lanes, {LANE_SHORT: workers - long_workers, LANE_LONG: long_workers}
+
+
+class LaneStats(object):
+    """Collects how busy each lane was and how long its jobs waited and ran."""
+
+    def __init__(self, lane_workers):
+        self.lane_workers = lane_workers
+        self.start = monotonic()
+        self.end = None
+        self.busy_seconds = {lane: 0 for lane in lane_workers}
+        self.latencies = {lane: [] for lane in lane_workers}
+        self.lock = Lock()
+
+    def record(self, lane, started, finished):
+        with self.lock:
+            self.busy_seconds[lane] += finished - started
+            # Latency counts the time spent waiting in the queue, too.
+            self.latencies[lane].append(finished - self.start)
+
+    def finish(self):
+        self.end = monotonic()
+
+    def summary(self):
+        wall_seconds = (self.end or monotonic()) - self.start
+        summary = {}
+        for lane, workers in self.lane_workers.items():
+            latencies = self.latencies[lane]
+            utilisation = 0
+            if wall_seconds > 0:
+                utilisation = self.busy_seconds[lane] / (workers * wall_seconds)
+            summary[lane] = {
+                "workers": workers,
+                "jobs": len(latencies),
+                "utilisation": round(utilisation, 3),
+                "latency_p50": percentile(latencies, 50),
+                "latency_p95": percentile(latencies, 95),
+            }
+
+        return summary
+
+
+def run_in_lanes(jobs, workers, run_job, time_budget):
+    """Run the jobs in lanes, each lane in its own pool of worker threads.
+
+    Once a job in a lane doesn't fit in the time budget, the rest of that lane is
+    skipped.
+
+    Returns the LaneStats and a list of the jobs that were skipped.
+    """
+    lanes, lane_workers = split_into_lanes(jobs, workers)
+    stats = LaneStats(lane_workers)
+    skipped = []
+    lanes_stopped = set()
+    lock = Lock()
+
+    def run(lane, job):
+        with lock:
+            if lane in lanes_stopped or not time_budget.fits(job):
+                lanes_stopped.add(lane)
+                skipped.append(job)
+                return
+
+        started = monotonic()
+        try:
+            with profiling.thread_profile():
+                run_job(job)
+        finally:
+            finished = monotonic()
+            time_budget.record(job, finished - started)
+            stats.record(lane, started, finished)
+
+    executors = [ThreadPoolExecutor(max_workers=lane_workers[lane]) for lane in lanes]
+    try:
+        futures = []
+        for executor, (lane, lane_jobs) in zip(executors, lanes.items()):
+            futures += [executor.submit(run, lane, job) for job in lane_jobs]
+        for future in futures:
+            future.result()
+    finally:
+        for executor in executors:
+            executor.shutdown()
+        stats.finish()
+
+    return stats, skipped
+
+
+class TimeBudget(object):
+    """Decides whether there is still time to run a job within a time budget.
+
+    The cost model is only a guess, so it's scaled by how long the jobs we've run
+    so far actually took compared to their estimates.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.start = monotonic()
+        self.estimated = 0
+        self.actual = 0
+        self.lock = Lock()
+
+    def elapsed(self):
+        return monotonic() - self.start
+
+    def scale(self):
+        if self.estimated == 0:
+            return 1
+        return self.actual / self.estimated
+
+    def fits(self, job):
+        if self.seconds is None:
+            return True
+        return self.elapsed() + job["cost"] * self.scale() <= self.seconds
+
+    def record(self, job, seconds):
+        with self.lock:
+            self.estimated += job["cost"]
+            self.actual += seconds
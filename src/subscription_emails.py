@@ -0,0 +1,89 @@
+# encoding: utf-8
+import email
+import imaplib
+import re
+from email.header import decode_header, make_header
+
+from .utils import AO3_DEFAULT_URL
+
+# AO3 subscription notifications link straight to the new chapter, e.g.
+# https://archiveofourown.org/works/12345/chapters/67890
+chapter_link = re.compile(r"https?://[^/\s]+/works/(\d+)/chapters/(\d+)")
+
+
+def _decode_subject(message):
+    subject = message.get("Subject", "")
+    try:
+        return str(make_header(decode_header(subject)))
+    except (UnicodeDecodeError, LookupError):
+        return subject
+
+
+def _get_text_parts(message):
+    texts = []
+    for part in message.walk():
+        if part.get_content_type() not in ("text/plain", "text/html"):
+            continue
+        payload = part.get_payload(decode=True)
+        if payload is None:
+            continue
+        charset = part.get_content_charset() or "utf-8"
+        texts.append(payload.decode(charset, errors="replace"))
+
+    return texts
+
+
+def parse_subscription_email(message):
+    """Get the chapter updates announced in one AO3 subscription email.
+
+    Returns a dictionary of work url: list of the ids of the announced chapters.
+    """
+    subject = _decode_subject(message)
+    if "[AO3]" not in subject:
+        return {}
+
+    updates = {}
+    for text in _get_text_parts(message):
+        for work_id, chapter_id in chapter_link.findall(text):
+            chapter_ids = updates.setdefault(f"{AO3_DEFAULT_URL}/works/{work_id}", [])
+            if chapter_id not in chapter_ids:
+                chapter_ids.append(chapter_id)
+
+    return updates
+
+
+def merge_chapter_updates(all_updates, updates):
+    for work_url, chapter_ids in updates.items():
+        known_ids = all_updates.setdefault(work_url, [])
+        known_ids.extend([c for c in chapter_ids if c not in known_ids])
+
+    return all_updates
+
+
+def get_chapter_updates_from_imap(srv, user, passwd, folder):
+    """Read the unread emails in an IMAP folder and collect the chapter updates that
+    AO3 subscription notifications announce.
+
+    Emails are fetched with BODY.PEEK, so this never changes whether an email is
+    read or not: that is left to the url collection from the same folder.
+    """
+    mail = imaplib.IMAP4_SSL(srv)
+    try:
+        mail.login(user, passwd)
+        status, _ = mail.select('"%s"' % folder.replace('"', '\\"'), readonly=True)
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"Failed to select folder {folder}")
+
+        _, data = mail.uid("search", None, "UNSEEN")
+        all_updates = {}
+        for email_uid in data[0].split():
+            _, email_data = mail.uid("fetch", email_uid, "(BODY.PEEK[])")
+            message = email.message_from_bytes(email_data[0][1])
+            merge_chapter_updates(all_updates, parse_subscription_email(message))
+    finally:
+        try:
+            mail.logout()
+        except imaplib.IMAP4.error:
+            pass
+
+    return all_updates
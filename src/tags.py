@@ -0,0 +1,180 @@
+# encoding: utf-8
+import json
+
+from .calibre import CalibreException, CalibreHelper
+from .exceptions import InvalidConfig
+from .utils import TAG_TYPES, Bcolors, log
+
+TAG_FIELDS = ["tags"] + [f"#{tag_type}" for tag_type in TAG_TYPES]
+
+
+def get_new_tag_name(name, prefix=None, pattern=None, replacement="", mapping=None):
+    """Get the new name of a tag: strip the prefix, then replace the regular expression
+    pattern, then look the result up in the mapping of old name: new name."""
+    if prefix and name.startswith(prefix):
+        name = name[len(prefix) :]
+    if pattern:
+        name = pattern.sub(replacement, name)
+    if mapping:
+        name = mapping.get(name, name)
+    return name.strip()
+
+
+def get_tag_renames(items, new_name):
+    """Work out which tags to rename.
+
+    :param items:    The tags of each field, as from CalibreHelper.get_tag_items
+    :param new_name: A function that gets the new name of a tag
+    :return: A list of (field, item_id, name, new name, book count, merged), where
+             merged is whether the tag is merged with another one of the field
+    """
+    renames = []
+    for field, field_items in items.items():
+        new_names = {}
+        for item_id, (name, _) in field_items.items():
+            renamed = new_name(name)
+            # Calibre doesn't allow empty tags.
+            new_names[item_id] = renamed or name
+
+        # Calibre treats tags that only differ in case as the same tag.
+        name_counts = {}
+        for name in new_names.values():
+            name_counts[name.casefold()] = name_counts.get(name.casefold(), 0) + 1
+
+        for item_id, (name, count) in sorted(field_items.items()):
+            renamed = new_names[item_id]
+            if renamed != name:
+                merged = name_counts[renamed.casefold()] > 1
+                renames.append((field, item_id, name, renamed, count, merged))
+
+    return renames
+
+
+def get_rename_steps(renames):
+    """Put the renames in an order that's safe to apply them in.
+
+    Calibre merges a tag renamed to the name of another tag into it. With A -> B and
+    B -> C, B has to be renamed first: otherwise A is merged into B, and then the
+    merged tag is renamed to C, books tagged A included.
+
+    :param renames: A list of renames, as from get_tag_renames
+    :return: A list of steps, each a dictionary of field: {item_id: new name}, where
+             no tag is renamed to a tag that's renamed in the same or a later step
+    :raises InvalidConfig: if the renames go round in a circle, e.g. A -> B, B -> A
+    """
+    steps = []
+    fields = {}
+    for field, item_id, name, new_name, _, _ in renames:
+        fields.setdefault(field, []).append((item_id, name, new_name))
+
+    for field, field_renames in fields.items():
+        new_names = {item_id: new_name for item_id, _, new_name in field_renames}
+        names = {item_id: name for item_id, name, _ in field_renames}
+        # The renamed tags, by their current name. Calibre ignores case in tags.
+        renamed_tags = {name.casefold(): item_id for item_id, name in names.items()}
+        step_indexes = {}
+
+        def get_step_index(item_id, chain):
+            if item_id in step_indexes:
+                return step_indexes[item_id]
+            if item_id in chain:
+                circle = " -> ".join(names[i] for i in chain + [item_id])
+                raise InvalidConfig(
+                    f"The renames of {field} go round in a circle: {circle}"
+                )
+
+            index = 0
+            holder = renamed_tags.get(new_names[item_id].casefold())
+            if holder is not None and holder != item_id:
+                index = get_step_index(holder, chain + [item_id]) + 1
+            step_indexes[item_id] = index
+            return index
+
+        for item_id in new_names:
+            index = get_step_index(item_id, [])
+            while len(steps) <= index:
+                steps.append({})
+            steps[index].setdefault(field, {})[item_id] = new_names[item_id]
+
+    return steps
+
+
+def _get_new_tag_name_function(options):
+    mapping = None
+    if options.tag_mapping:
+        with open(options.tag_mapping, "r") as f:
+            mapping = json.loads(f.read())
+
+    return lambda name: get_new_tag_name(
+        name,
+        prefix=options.strip_tag_prefix,
+        pattern=options.tag_pattern,
+        replacement=options.tag_replacement,
+        mapping=mapping,
+    )
+
+
+def tags(options):
+    if not options.library:
+        log(
+            """To rename tags in a Calibre library, a path to the library is required.
+
+Example: \"/home/myuser/Calibre Library\"""",
+            Bcolors.FAIL,
+        )
+        return
+    if not (options.strip_tag_prefix or options.tag_pattern or options.tag_mapping):
+        log(
+            "Give --strip-tag-prefix, --tag-pattern or --tag-mapping to say how to "
+            "rename the tags.",
+            Bcolors.FAIL,
+        )
+        return
+
+    calibre = CalibreHelper(
+        library_path=options.library,
+        user=options.calibre_user,
+        password=options.calibre_password,
+    )
+
+    try:
+        calibre.check_library()
+        items = calibre.get_tag_items(TAG_FIELDS)
+    except CalibreException as e:
+        log(str(e), Bcolors.FAIL)
+        return
+
+    if items is None:
+        log(
+            "Tags can only be renamed in a local Calibre library, not on a Calibre "
+            "server.",
+            Bcolors.FAIL,
+        )
+        return
+
+    renames = get_tag_renames(items, _get_new_tag_name_function(options))
+    if not renames:
+        log("No tags to rename.", Bcolors.OKGREEN)
+        return
+    try:
+        steps = get_rename_steps(renames)
+    except InvalidConfig as e:
+        log(e.message, Bcolors.FAIL)
+        return
+
+    log(f"Renaming {len(renames)} tags", Bcolors.HEADER)
+    for field, _, name, new_name, count, merged in renames:
+        merge_note = ", merged with another tag" if merged else ""
+        log(f"\t{field}: {name} -> {new_name} ({count} books{merge_note})")
+
+    if options.dry_run:
+        log("Dry run: not changing the library.")
+        return
+
+    try:
+        calibre.rename_tags(steps)
+    except CalibreException as e:
+        log(f"Error renaming tags: {e.message}", Bcolors.FAIL)
+        return
+
+    log(f"Renamed {len(renames)} tags.", Bcolors.OKGREEN)
@@ -0,0 +1,125 @@
+# encoding: utf-8
+"""Nested timing spans for a run, written out in the Chrome trace event format, so
+that a run can be loaded into chrome://tracing, Perfetto or speedscope.
+"""
+import json
+import os
+import re
+import shlex
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from .utils import command_name, subprocess_listeners
+
+# The tracer for the current run, if tracing was requested. When there is none, a
+# span costs one function call and a check for None.
+_active_tracer = None
+
+sensitive_option = re.compile(r"^(--password=).*")
+
+
+class Tracer(object):
+    def __init__(self):
+        self.start = perf_counter()
+        self.pid = os.getpid()
+        self.events = []
+        self.thread_names = {}
+        self.lock = threading.Lock()
+
+    def _microseconds(self, seconds):
+        return round((seconds - self.start) * 1000000)
+
+    def add_span(self, name, start, end, category="run", args=None):
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": self._microseconds(start),
+            "dur": round((end - start) * 1000000),
+            "pid": self.pid,
+            "tid": thread.ident,
+        }
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.events.append(event)
+            self.thread_names[thread.ident] = thread.name
+
+    def record_subprocess(self, command, seconds):
+        end = perf_counter()
+        self.add_span(
+            command_name(command),
+            end - seconds,
+            end,
+            category="subprocess",
+            args={
+                "command": shlex.join(
+                    sensitive_option.sub(r"\1****", arg) for arg in command
+                )
+            },
+        )
+
+    def write(self, path):
+        metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": self.pid,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in self.thread_names.items()
+        ]
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            f.write(
+                json.dumps(
+                    {"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}
+                )
+            )
+
+
+def start_tracing():
+    global _active_tracer
+    _active_tracer = Tracer()
+    subprocess_listeners.append(_active_tracer.record_subprocess)
+    return _active_tracer
+
+
+def stop_tracing():
+    global _active_tracer
+    if _active_tracer is not None:
+        subprocess_listeners.remove(_active_tracer.record_subprocess)
+    _active_tracer = None
+
+
+def is_tracing():
+    return _active_tracer is not None
+
+
+def add_span_ending_now(name, seconds, category="run", args=None):
+    """Add a span for something that has just finished and took this long, e.g. an
+    HTTP request timed by requests.
+    """
+    if _active_tracer is None:
+        return
+    end = perf_counter()
+    _active_tracer.add_span(name, end - seconds, end, category, args)
+
+
+@contextmanager
+def span(name, category="run", **args):
+    if _active_tracer is None:
+        yield
+        return
+
+    tracer = _active_tracer
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        tracer.add_span(name, start, perf_counter(), category, args or None)
@@ -1,16 +1,23 @@
 # encoding: utf-8
 import copy
-import locale
 import logging
+import os.path
+import shutil
+import signal
+import threading
 from pprint import pformat
-from subprocess import PIPE, STDOUT, check_output
-from time import localtime, strftime
+from subprocess import DEVNULL, PIPE, STDOUT, CalledProcessError, Popen
+from time import localtime, monotonic, strftime
 from urllib.parse import urlparse
 
-import browser_cookie3
-
 from src.exceptions import InvalidConfig
 
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows.
+    fcntl = None
+
 AO3_DEFAULT_URL = "https://archiveofourown.org"
 DATE_FORMAT = "%d.%m.%Y"
 TAG_TYPES = [
@@ -24,6 +31,14 @@ TAG_TYPES = [
     "warnings",
 ]
 
+# The ioctl that makes a file share the blocks of another, on Linux filesystems that
+# support it, e.g. btrfs and XFS.
+FICLONE = 0x40049409
+
+# Functions that are called with (command, seconds) after every subprocess we run,
+# e.g. to collect timings for the run report.
+subprocess_listeners = []
+
 # Set threshold levels for fanficfare's loggers, so we don't get spammed with logs
 logging.getLogger("fanficfare").setLevel(logging.ERROR)
 logging.getLogger("fanficfare.configurable").setLevel(logging.ERROR)
@@ -62,6 +77,9 @@ def setup_login(options):
     # We have already validated in setup_options that we have at least one of
     # options.cookie and options.use_browser_cookie.
     if options.use_browser_cookie:
+        # Imported here because it's slow to import, and usually not needed.
+        import browser_cookie3
+
         found_cookie = False
         ao3_domain = urlparse(options.mirror).netloc
         cookie_jar = browser_cookie3.firefox(domain_name=ao3_domain)
@@ -91,8 +109,153 @@ def setup_login(options):
     log("Using the cookie value you passed in")
 
 
-def check_subprocess_output(command):
-    return check_output(command, shell=True, stderr=STDOUT, stdin=PIPE, text=True)
+class SubprocessTimeoutError(CalledProcessError):
+    """A subprocess was killed because it ran for longer than its timeout."""
+
+    def __init__(self, command, timeout, output):
+        super().__init__(
+            -9,
+            command,
+            f"{output}\n{command_name(command)} was killed after running for "
+            f"{timeout} seconds",
+        )
+
+
+def _kill(process):
+    """Kill a process, and any processes it started, e.g. a shell's children, which
+    would otherwise keep its output open."""
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+            return
+        except ProcessLookupError:
+            pass
+    process.kill()
+
+
+def _run_subprocess(command, timeout, cwd, abort_on):
+    """Run a command once, reading its output line by line.
+
+    Returns the output, the return code, and whether the command timed out.
+    """
+    try:
+        process = Popen(
+            command,
+            stdout=PIPE,
+            stderr=STDOUT,
+            stdin=DEVNULL,
+            text=True,
+            cwd=cwd,
+            start_new_session=hasattr(os, "killpg"),
+        )
+    except OSError as e:
+        # The same return code as a shell gives for a command that doesn't exist.
+        return str(e), 127, False
+
+    timed_out = threading.Event()
+
+    def kill_after_timeout():
+        timed_out.set()
+        _kill(process)
+
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, kill_after_timeout)
+        timer.daemon = True
+        timer.start()
+
+    lines = []
+    try:
+        with process:
+            for line in process.stdout:
+                lines.append(line)
+                if abort_on and abort_on(line):
+                    # There's no point in waiting for the rest of the output.
+                    _kill(process)
+                    break
+        return "".join(lines), process.returncode, timed_out.is_set()
+    except BaseException:
+        # The process is in its own session, so it doesn't get e.g. the Ctrl-C
+        # that interrupted us.
+        _kill(process)
+        raise
+    finally:
+        if timer:
+            timer.cancel()
+
+
+def check_subprocess_output(command, timeout=None, retries=0, cwd=None, abort_on=None):
+    """Run a command, given as a list of arguments, without a shell, and return its
+    output, with stderr included.
+
+    If the command runs for longer than timeout seconds, it's killed and run again,
+    up to retries times, and then SubprocessTimeoutError is raised. If abort_on is
+    given, it's called with each line of output as it's written, and the command is
+    killed as soon as it returns True.
+
+    Raises CalledProcessError if the command fails or is aborted.
+    """
+    for attempt in range(retries + 1):
+        start = monotonic()
+        try:
+            output, returncode, timed_out = _run_subprocess(
+                command, timeout, cwd, abort_on
+            )
+        finally:
+            for listener in subprocess_listeners:
+                listener(command, monotonic() - start)
+
+        if not timed_out:
+            break
+        log(
+            f"{command_name(command)} was killed after running for {timeout} seconds"
+            + (", trying again" if attempt < retries else ""),
+            Bcolors.WARNING,
+        )
+    else:
+        raise SubprocessTimeoutError(command, timeout, output)
+
+    if returncode:
+        raise CalledProcessError(returncode, command, output)
+    return output
+
+
+def command_name(command):
+    """Get the name of the program a command runs, e.g. "calibredb"."""
+    for part in command:
+        name = os.path.basename(part)
+        # Skip the interpreter of wrapper scripts.
+        if not name.startswith("python"):
+            return name
+    return ""
+
+
+def clone_file(source, destination):
+    """Copy a file without copying its contents where the filesystem allows it:
+    a reflink shares the blocks of the original until either file is changed, and
+    copy_file_range lets e.g. an NFS server copy the file itself. Otherwise, the
+    file is copied normally.
+    """
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        if fcntl:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return
+            except OSError:
+                pass
+
+        if hasattr(os, "copy_file_range"):
+            try:
+                while os.copy_file_range(src.fileno(), dst.fileno(), 1024 * 1024):
+                    pass
+                return
+            except OSError:
+                # Start again from the beginning with a normal copy.
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+
+        shutil.copyfileobj(src, dst)
 
 
 def get_options_for_display(options):
@@ -109,6 +272,17 @@ def get_options_for_display(options):
     )
 
 
+def percentile(values, p):
+    """Return the p-th percentile of a list of numbers (nearest-rank method), or None
+    if the list is empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
 def get_series_options(metadata):
     if len(metadata["series"]) == 0:
         return {}
@@ -127,26 +301,34 @@ def get_extra_series_options(metadata):
     return opts
 
 
+def normalise_tag(tag):
+    """Replace characters that give Calibre trouble in tags."""
+    return (
+        tag.replace('"', "'")
+        .replace("...", "…")
+        .replace(".", "．")
+        .replace("&amp;", "&")
+    )
+
+
 def get_tags_options(metadata):
     # FFF will save all fic tags to the tags column, but we want to separate them out,
     # so remove them from there.
     opts = {"tags": ""}
     for tag_type in TAG_TYPES:
         if len(metadata[tag_type]) > 0:
-            tags = metadata[tag_type].split(", ")
-            # Replace characters that give Calibre trouble in tags.
-            tags = [
-                tag.replace('"', "'")
-                .replace("...", "…")
-                .replace(".", "．")
-                .replace("&amp;", "&")
-                for tag in tags
-            ]
+            tags = [normalise_tag(tag) for tag in metadata[tag_type].split(", ")]
             opts[f"#{tag_type}"] = f"{','.join(tags)}"
 
     return opts
 
 
+def parse_ao3_number(number):
+    """Convert a number as AO3 formats it, e.g. "12,345", to an int. AO3 uses commas
+    as the thousands separator whatever the locale."""
+    return int(str(number).replace(",", ""))
+
+
 def get_word_count(metadata):
     if metadata.get("numWords", 0) == "":
         # A strange bug that seems to happen occasionally on AO3's side.
@@ -155,7 +337,7 @@ def get_word_count(metadata):
         # so it can be distinguised from works that actually have 0 words (e.g. art).
         return ""
 
-    return locale.atoi(metadata.get("numWords", 0))
+    return parse_ao3_number(metadata.get("numWords", 0))
 
 
 def get_all_metadata_options(metadata):
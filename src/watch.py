@@ -0,0 +1,258 @@
+# encoding: utf-8
+import copy
+import os
+import socket
+import threading
+from queue import Empty, Queue
+from time import monotonic
+
+from .ao3_utils import keep_sessions
+from .calibre import CalibreException
+from .download import (
+    download_urls,
+    get_calibre_helper,
+    get_chapter_cache,
+    get_fanficfare_helper,
+)
+from .exceptions import InvalidConfig, UrlsCollectionException
+from .get_urls import (
+    get_imap_chapter_updates,
+    get_urls,
+    normalise_urls,
+    update_last_updated_file,
+)
+from .options import DEFAULT_POLL_MINUTES, SOURCE_STDIN
+from .utils import Bcolors, log, setup_login
+
+SOCKET_FILENAME = "watch.sock"
+# After a url is submitted, wait this long for more before downloading, so that a
+# burst of submissions is downloaded as one batch.
+SUBMISSION_BATCH_SECONDS = 2
+# How long a client of the socket may take to send each line.
+SUBMISSION_TIMEOUT_SECONDS = 30
+
+
+def get_poll_schedule(options):
+    """Get how often to poll each source, in seconds."""
+    return {
+        s: options.poll_intervals.get(s, DEFAULT_POLL_MINUTES) * 60
+        for s in options.sources
+        if s != SOURCE_STDIN
+    }
+
+
+class UrlSubmissionServer(object):
+    """Accepts work urls on a unix socket, one per line, ending with an empty line
+    or the end of the input, and puts each set of valid urls in a queue.
+    """
+
+    def __init__(self, path, queue, mirror=None):
+        self.path = path
+        self.queue = queue
+        self.mirror = mirror
+        self.socket = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            if self._is_in_use():
+                raise InvalidConfig(
+                    f"Another process is already listening on the socket {self.path}"
+                )
+            # Left over from a process that didn't shut down cleanly.
+            os.remove(self.path)
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(self.path)
+        self.socket.listen()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def stop(self):
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _is_in_use(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            try:
+                client.connect(self.path)
+                return True
+            except OSError:
+                return False
+
+    def _accept(self):
+        while self.socket:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                # The socket was closed.
+                return
+            # Each client is handled in its own thread, so that a slow one doesn't
+            # hold up the others.
+            connection.settimeout(SUBMISSION_TIMEOUT_SECONDS)
+            threading.Thread(
+                target=self._handle_connection, args=(connection,), daemon=True
+            ).start()
+
+    def _handle_connection(self, connection):
+        with connection:
+            self._handle(connection)
+
+    def _handle(self, connection):
+        urls = set()
+        errors = []
+        try:
+            with connection.makefile("r") as lines:
+                for line in lines:
+                    line = line.strip()
+                    if not line:
+                        break
+                    try:
+                        urls |= normalise_urls([line], self.mirror)
+                    except RuntimeError as e:
+                        errors.append(str(e))
+        except OSError as e:
+            # E.g. the client didn't send anything for too long: keep the urls it
+            # sent before that.
+            errors.append(f"Stopped reading urls: {e}")
+
+        if urls:
+            self.queue.put(urls)
+        response = "".join(f"{e}\n" for e in errors) + f"Queued {len(urls)} urls\n"
+        try:
+            connection.sendall(response.encode("utf-8"))
+        except OSError:
+            # The client has gone.
+            pass
+
+
+def wait_for_submitted_urls(queue, timeout):
+    """Wait up to timeout seconds for submitted urls, then keep collecting them
+    until there's a short pause in submissions."""
+    try:
+        urls = set(queue.get(timeout=timeout))
+    except Empty:
+        return set()
+
+    while True:
+        try:
+            urls |= queue.get(timeout=SUBMISSION_BATCH_SECONDS)
+        except Empty:
+            return urls
+
+
+class Watcher(object):
+    """Keeps the Calibre library, the AO3 sessions and the helpers set up between
+    polls of the sources, so that each poll only costs what it needs to fetch."""
+
+    def __init__(self, options, calibre):
+        self.options = options
+        self.calibre = calibre
+        self.fff_helper = get_fanficfare_helper(options)
+        self.chapter_cache = get_chapter_cache(options, calibre)
+
+    def poll(self, sources):
+        options = copy.copy(self.options)
+        options.sources = sources
+        log(f"Polling {', '.join(sources)}", Bcolors.HEADER)
+        # Errors end the poll, not the watcher: the sources are polled again at their
+        # next interval, since their last update dates weren't updated.
+        try:
+            chapter_updates = get_imap_chapter_updates(options)
+            urls = get_urls(options)
+            self.download(options, urls, chapter_updates)
+            update_last_updated_file(options)
+        except (InvalidConfig, UrlsCollectionException) as e:
+            log(e.message, Bcolors.FAIL)
+        except Exception as e:
+            log(f"Error polling {', '.join(sources)}: {e}", Bcolors.FAIL)
+
+    def download_submitted(self, urls):
+        log(f"{len(urls)} URLs submitted", Bcolors.OKGREEN)
+        try:
+            self.download(self.options, urls)
+        except Exception as e:
+            log(f"Error downloading the submitted urls: {e}", Bcolors.FAIL)
+
+    def download(self, options, urls, chapter_updates=None):
+        if not urls:
+            log("No new urls to fetch.", Bcolors.OKGREEN)
+            return
+
+        log(f"Unique URLs to fetch ({len(urls)}):", Bcolors.HEADER)
+        for url in urls:
+            log(f"\t{url}", Bcolors.OKBLUE)
+
+        if options.dry_run:
+            log(
+                "Not adding any stories to Calibre because dry-run is set to True",
+                Bcolors.HEADER,
+            )
+            return
+
+        if self.calibre:
+            # The library may have been changed by something else since the last time.
+            self.calibre.clear_query_cache()
+        download_urls(
+            options,
+            urls,
+            self.calibre,
+            self.fff_helper,
+            self.chapter_cache,
+            chapter_updates or {},
+        )
+
+
+def watch(options):
+    try:
+        calibre = get_calibre_helper(options)
+        setup_login(options)
+    except CalibreException as e:
+        log(str(e), Bcolors.FAIL)
+        return
+    except InvalidConfig as e:
+        log(e.message, Bcolors.FAIL)
+        return
+
+    keep_sessions()
+    # Each poll only needs what has changed since the one before.
+    options.since_last_update = True
+    watcher = Watcher(options, calibre)
+
+    schedule = get_poll_schedule(options)
+    next_polls = {s: monotonic() for s in schedule}
+    submitted_urls = Queue()
+    server = UrlSubmissionServer(
+        options.socket or os.path.join(options.cache_dir, SOCKET_FILENAME),
+        submitted_urls,
+        options.mirror,
+    )
+    try:
+        server.start()
+    except InvalidConfig as e:
+        log(e.message, Bcolors.FAIL)
+        return
+
+    log(f"Watching for new urls. Submit urls on the socket {server.path}")
+    try:
+        while True:
+            due = sorted(s for s, t in next_polls.items() if t <= monotonic())
+            if due:
+                watcher.poll(due)
+                for s in due:
+                    next_polls[s] = monotonic() + schedule[s]
+
+            timeout = None
+            if next_polls:
+                timeout = max(0, min(next_polls.values()) - monotonic())
+            urls = wait_for_submitted_urls(submitted_urls, timeout)
+            if urls:
+                watcher.download_submitted(urls)
+    except KeyboardInterrupt:
+        log("Stopped watching", Bcolors.HEADER)
+    finally:
+        server.stop()
@@ -0,0 +1,102 @@
+"""Helpers for the performance tests: timing a function, and comparing the timings
+with the baseline in baseline.json.
+
+Timings are divided by the time of a fixed calibration workload measured alongside
+them, so that the baseline can be compared across machines.
+
+Set RUN_PERFORMANCE_TESTS=1 to run the performance tests, and
+UPDATE_PERFORMANCE_BASELINE=1 as well to record new baselines instead of comparing
+with the old ones.
+"""
+
+import json
+import math
+import os
+from statistics import median
+from time import perf_counter
+
+import pytest
+
+BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "baseline.json"
+)
+RUN_PERFORMANCE_TESTS = bool(os.environ.get("RUN_PERFORMANCE_TESTS"))
+UPDATE_BASELINE = bool(os.environ.get("UPDATE_PERFORMANCE_BASELINE"))
+
+REPEATS = 15
+# A slowdown has to be at least this big, as well as statistically significant, to
+# fail a test.
+TOLERANCE = 0.2
+SIGNIFICANCE = 0.01
+
+
+def _calibration_workload():
+    total = 0
+    for i in range(100000):
+        total += len(str(i * i))
+    return total
+
+
+def _time(func):
+    start = perf_counter()
+    func()
+    return perf_counter() - start
+
+
+def measure(func, repeats=REPEATS):
+    """Time func repeats times. Each timing is divided by the time of the
+    calibration workload run right before it, so that the machine getting faster
+    or slower during the run affects both."""
+    func()  # Warm up caches, e.g. compiled regular expressions.
+    samples = []
+    for _ in range(repeats):
+        calibration = _time(_calibration_workload)
+        samples.append(_time(func) / calibration)
+    return samples
+
+
+def mann_whitney_p_value(baseline, samples):
+    """One-sided p-value for samples being slower than baseline, with the normal
+    approximation of the Mann-Whitney U test."""
+    ranked = sorted([(v, 0) for v in baseline] + [(v, 1) for v in samples])
+    rank_sum = sum(rank for rank, (_, group) in enumerate(ranked, 1) if group == 1)
+    n1, n2 = len(samples), len(baseline)
+    u = rank_sum - n1 * (n1 + 1) / 2
+    mean = n1 * n2 / 2
+    sd = math.sqrt(n1 * n2 * (n1 + n2 + 1) / 12)
+    z = (u - mean) / sd
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def load_baseline():
+    if not os.path.isfile(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH, "r") as f:
+        return json.loads(f.read())
+
+
+def save_baseline(name, samples):
+    baseline = load_baseline()
+    baseline[name] = [round(s, 4) for s in samples]
+    with open(BASELINE_PATH, "w") as f:
+        f.write(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+
+
+def assert_no_regression(name, samples):
+    """Fail if samples are significantly slower than the baseline."""
+    if UPDATE_BASELINE:
+        save_baseline(name, samples)
+        return
+
+    baseline = load_baseline().get(name)
+    if baseline is None:
+        pytest.skip(
+            f"No baseline for {name}: record one with UPDATE_PERFORMANCE_BASELINE=1"
+        )
+
+    slowdown = median(samples) / median(baseline) - 1
+    p_value = mann_whitney_p_value(baseline, samples)
+    assert not (slowdown > TOLERANCE and p_value < SIGNIFICANCE), (
+        f"{name} is {slowdown:.0%} slower than the baseline "
+        f"(median {median(samples):.3f} vs {median(baseline):.3f}, p={p_value:.4f})"
+    )
@@ -0,0 +1,109 @@
+import json
+import os
+import re
+from unittest.mock import patch
+
+import pytest
+
+from src.calibre import CalibreHelper, collate_search_terms
+from src.download import downloader
+from src.fanficfare_helper import FanFicFareHelper, check_fff_output
+from src.get_urls import normalise_urls
+from src.utils import get_all_metadata_options
+
+from .benchmark import RUN_PERFORMANCE_TESTS, assert_no_regression, measure
+
+pytestmark = pytest.mark.skipif(
+    not RUN_PERFORMANCE_TESTS,
+    reason="Performance tests only run with RUN_PERFORMANCE_TESTS=1",
+)
+
+FIXTURES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "fixtures"
+)
+
+
+def _get_metadata():
+    with open(os.path.join(FIXTURES_DIR, "fic_metadata.json"), "r") as f:
+        return json.loads(f.read())
+
+
+def _get_fanficfare_output(log_lines):
+    """Output like FanFicFare's when updating a long work: a log line per chapter,
+    then the metadata."""
+    lines = [
+        f"Fetching https://archiveofourown.org/works/65727421/chapters/{i} "
+        f"(chapter {i} of {log_lines})"
+        for i in range(log_lines)
+    ]
+    return "\n".join(lines) + "\n" + json.dumps(_get_metadata(), indent=2)
+
+
+def test_normalise_urls():
+    urls = [
+        f"http://archiveofourown.org/works/{i}/chapters/{i * 7}?view_adult=true"
+        for i in range(100000)
+    ]
+
+    assert_no_regression("normalise_urls", measure(lambda: normalise_urls(urls)))
+
+
+def test_collate_search_terms():
+    urls = [f"https://archiveofourown.org/works/{i}" for i in range(5000)]
+
+    def collate():
+        for _ in range(100):
+            collate_search_terms(urls=urls, book_formats=["EPUB"])
+
+    assert_no_regression("collate_search_terms", measure(collate))
+
+
+def test_check_fff_output():
+    output = _get_fanficfare_output(5000)
+
+    assert_no_regression("check_fff_output", measure(lambda: check_fff_output(output)))
+
+
+def test_get_all_metadata_options():
+    metadata = _get_metadata()
+
+    def get_options():
+        for _ in range(1000):
+            get_all_metadata_options(metadata)
+
+    assert_no_regression("get_all_metadata_options", measure(get_options))
+
+
+def _fake_subprocess_output(command, **kwargs):
+    # Every work is in the library already, with id 12, and is re-added with id 13.
+    if command[0] == "fanficfare":
+        return _get_fanficfare_output(50)
+    if command[:2] == ["calibredb", "search"]:
+        return "12,13"
+    if command[:2] == ["calibredb", "list"]:
+        url = re.search(r'url:=([^"]*)"', command[2]).group(1)
+        return json.dumps([{"id": 13, "*identifier": f"url:{url}"}])
+    return ""
+
+
+def test_download(tmp_path):
+    """A full download of 100 works, with the calibredb and fanficfare subprocesses
+    mocked out, to measure our own overhead."""
+    calibre = CalibreHelper(library_path=str(tmp_path))
+    fff_helper = FanFicFareHelper(config_path=None)
+    error_file = str(tmp_path / "errors.txt")
+    urls = [f"https://archiveofourown.org/works/{i}" for i in range(100)]
+
+    def download_all():
+        for url in urls:
+            downloader(url, error_file, fff_helper, calibre, force=False)
+
+    with patch("src.calibre.check_subprocess_output", _fake_subprocess_output), patch(
+        "src.fanficfare_helper.check_subprocess_output", _fake_subprocess_output
+    ):
+        # Fewer samples than the other tests, which are much faster, but enough for
+        # a slowdown to be significant.
+        samples = measure(download_all, 10)
+
+    assert not os.path.exists(error_file)
+    assert_no_regression("download", samples)
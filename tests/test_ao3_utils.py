@@ -8,7 +8,7 @@ from .mock_ao3 import MockAO3
 oldest_date = datetime.strptime("01.01.2020", "%d.%m.%Y")
 
 
-@patch("src.ao3_utils.AO3", MockAO3)
+@patch("ao3.AO3", MockAO3)
 def test_get_ao3_bookmark_urls():
     urls = ao3_utils.get_ao3_bookmark_urls(
         user="testuser",
@@ -39,7 +39,7 @@ def test_get_ao3_bookmark_urls_max_count_zero():
     assert urls == set([])
 
 
-@patch("src.ao3_utils.AO3", MockAO3)
+@patch("ao3.AO3", MockAO3)
 def test_get_ao3_users_work_urls():
     urls = ao3_utils.get_ao3_users_work_urls(
         user="testuser",
@@ -70,7 +70,7 @@ def test_get_ao3_users_work_urls_max_count_zero():
     assert urls == set([])
 
 
-@patch("src.ao3_utils.AO3", MockAO3)
+@patch("ao3.AO3", MockAO3)
 def test_get_ao3_gift_urls():
     urls = ao3_utils.get_ao3_gift_urls(
         user="testuser", cookie="cookie", max_count=3, oldest_date=oldest_date
@@ -91,7 +91,7 @@ def test_get_ao3_gift_urls_max_count_zero():
     assert urls == set([])
 
 
-@patch("src.ao3_utils.AO3", MockAO3)
+@patch("ao3.AO3", MockAO3)
 def test_get_ao3_marked_for_later_urls():
     urls = ao3_utils.get_ao3_marked_for_later_urls(
         user="testuser", cookie="cookie", max_count=3, oldest_date=oldest_date
@@ -112,7 +112,7 @@ def test_get_ao3_marked_for_later_urls_max_count_zero():
     assert urls == set([])
 
 
-@patch("src.ao3_utils.AO3", MockAO3)
+@patch("ao3.AO3", MockAO3)
 def test_get_ao3_work_subscription_urls_no_oldest_date():
     urls = ao3_utils.get_ao3_work_subscription_urls(
         user="testuser", cookie="testcookie", max_count=5, oldest_date=None
@@ -135,7 +135,7 @@ def test_get_ao3_work_subscription_urls_no_oldest_date_max_count_zero():
     assert urls == set([])
 
 
-@patch("src.ao3_utils.AO3", MockAO3)
+@patch("ao3.AO3", MockAO3)
 def test_get_ao3_work_subscription_urls_with_oldest_date():
     # We only want works published *after* 01.01.2023, not including that date
     oldest_work_date = datetime.strptime("01.01.2023", "%d.%m.%Y")
@@ -158,7 +158,7 @@ def test_get_ao3_work_subscription_urls_with_oldest_date_max_count_zero():
     assert urls == set([])
 
 
-@patch("src.ao3_utils.AO3", MockAO3)
+@patch("ao3.AO3", MockAO3)
 def test_get_ao3_series_subscription_urls():
     urls = ao3_utils.get_ao3_series_subscription_urls(
         user="testuser", cookie="cookie", max_count=3, oldest_date=oldest_date
@@ -182,7 +182,7 @@ def test_get_ao3_series_subscription_urls_max_count_zero():
     assert urls == set([])
 
 
-@patch("src.ao3_utils.AO3", MockAO3)
+@patch("ao3.AO3", MockAO3)
 def test_get_ao3_user_subscription_urls():
     urls = ao3_utils.get_ao3_user_subscription_urls(
         user="testuser", cookie="cookie", max_count=3, oldest_date=oldest_date
@@ -209,7 +209,7 @@ def test_get_ao3_user_subscription_urls_max_count_zero():
     assert urls == set([])
 
 
-@patch("src.ao3_utils.AO3", MockAO3)
+@patch("ao3.AO3", MockAO3)
 def test_get_ao3_series_work_urls():
     urls = ao3_utils.get_ao3_series_work_urls(
         user="testuser",
@@ -238,7 +238,7 @@ def test_get_ao3_series_work_urls_max_count_zero():
     assert urls == set([])
 
 
-@patch("src.ao3_utils.AO3", MockAO3)
+@patch("ao3.AO3", MockAO3)
 def test_get_ao3_collection_work_urls():
     urls = ao3_utils.get_ao3_collection_work_urls(
         user="testuser",
@@ -267,7 +267,7 @@ def test_get_ao3_collection_work_urls_max_count_zero():
     assert urls == set([])
 
 
-@patch("src.ao3_utils.AO3", MockAO3)
+@patch("ao3.AO3", MockAO3)
 def test_get_ao3_subscribed_users_work_counts():
     counts = ao3_utils.get_ao3_subscribed_users_work_counts(
         user="testuser", cookie="testcookie"
@@ -276,7 +276,7 @@ def test_get_ao3_subscribed_users_work_counts():
     assert counts == {"user1": 10, "user2": 20, "user3": 30}
 
 
-@patch("src.ao3_utils.AO3", MockAO3)
+@patch("ao3.AO3", MockAO3)
 def test_get_ao3_subscribed_series_work_stats():
     stats = ao3_utils.get_ao3_subscribed_series_work_stats(
         user="testuser", cookie="testcookie"
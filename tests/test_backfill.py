@@ -0,0 +1,60 @@
+from argparse import Namespace
+from unittest.mock import MagicMock, patch
+
+from src.backfill import backfill, get_backfill_options
+
+
+def test_get_backfill_options():
+    options = get_backfill_options(
+        {"words": 100, "rating": "General Audiences", "series": [("1", "Series")]}
+    )
+
+    assert options == {"#words": 100, "#rating": "General Audiences"}
+
+
+def _options(dry_run=False):
+    return Namespace(
+        library="library", calibre_user=None, calibre_password=None, dry_run=dry_run
+    )
+
+
+@patch("src.backfill.BACKFILL_CHUNK_SIZE", 2)
+@patch("src.backfill.CalibreHelper")
+@patch("src.backfill.scan_epubs")
+def test_backfill_writes_in_chunks(mock_scan, mock_helper):
+    calibre = MagicMock()
+    calibre.get_all_format_paths.return_value = {"1": "1.epub", "2": "2.epub"}
+    calibre.get_changed_metadata.side_effect = lambda book_id, options: (
+        {} if book_id == "4" else options
+    )
+    mock_helper.return_value = calibre
+    mock_scan.return_value = iter(
+        [
+            ("1", {"words": 10}),
+            ("2", {}),
+            ("3", {"words": 30}),
+            ("4", {"words": 40}),
+            ("5", {"words": 50}),
+        ]
+    )
+
+    backfill(_options())
+
+    assert [c.args[0] for c in calibre.set_metadata_many.call_args_list] == [
+        {"1": {"#words": 10}, "3": {"#words": 30}},
+        {"5": {"#words": 50}},
+    ]
+
+
+@patch("src.backfill.CalibreHelper")
+@patch("src.backfill.scan_epubs")
+def test_backfill_dry_run(mock_scan, mock_helper):
+    calibre = MagicMock()
+    calibre.get_all_format_paths.return_value = {"1": "1.epub"}
+    calibre.get_changed_metadata.side_effect = lambda book_id, options: options
+    mock_helper.return_value = calibre
+    mock_scan.return_value = iter([("1", {"words": 10})])
+
+    backfill(_options(dry_run=True))
+
+    calibre.set_metadata_many.assert_not_called()
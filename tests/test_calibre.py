@@ -0,0 +1,488 @@
+import json
+import re
+import shutil
+import sqlite3
+from contextlib import closing
+from unittest.mock import patch
+
+import pytest
+
+from src import report
+from src.ao3_utils import AO3_SERIES_KEYS
+from src.calibre import (
+    SCHEMA_VERSION,
+    SCHEMA_VERSION_PREF,
+    CalibreException,
+    CalibreHelper,
+    chunk_urls,
+    collate_search_terms,
+    get_bulk_fields,
+)
+from src.utils import TAG_TYPES
+
+CUSTOM_COLUMNS = "\n".join(
+    f"{c} ({i})" for i, c in enumerate(["words"] + AO3_SERIES_KEYS + TAG_TYPES)
+)
+
+
+def test_collate_search_terms():
+    search_terms = collate_search_terms(
+        urls=["https://archiveofourown.org/works/1"], book_formats=["epub"]
+    )
+
+    assert search_terms == (
+        '(identifiers:"url:=https://archiveofourown.org/works/1") AND '
+        '(formats:"=EPUB")'
+    )
+
+
+def test_collate_search_terms_with_quotes():
+    search_terms = collate_search_terms(
+        authors=['Author "Nickname'], series=["It's \\ a Series"]
+    )
+
+    assert search_terms == (
+        '(author:"=Author \\"Nickname" OR author:"(Author \\"Nickname)") AND '
+        '(allseries:"=It\'s \\\\ a Series")'
+    )
+
+
+@patch("src.calibre.check_and_clean_output", return_value="1")
+def test_search_with_quotes(mock_output):
+    calibre = CalibreHelper(library_path="http://localhost:8080/#library")
+
+    assert calibre.search(authors=["O'Brien \"Bob"]) == ["1"]
+    assert mock_output.call_args[0][0][2] == (
+        '(author:"=O\'Brien \\"Bob" OR author:"(O\'Brien \\"Bob)")'
+    )
+
+
+def _create_metadata_db(library, schema_version=None):
+    with closing(sqlite3.connect(library / "metadata.db")) as db:
+        db.execute("CREATE TABLE preferences (id INTEGER PRIMARY KEY, key, val)")
+        if schema_version is not None:
+            db.execute(
+                "INSERT INTO preferences (key, val) VALUES (?, ?)",
+                (SCHEMA_VERSION_PREF, json.dumps(schema_version)),
+            )
+        db.commit()
+
+
+@patch("src.calibre.which", lambda name: f"/usr/bin/{name}")
+def test_check_library_migrates_schema_in_one_process(tmp_path):
+    _create_metadata_db(tmp_path)
+    calibre = CalibreHelper(library_path=str(tmp_path))
+
+    with patch("src.calibre.check_and_clean_output", return_value="") as mock_output:
+        calibre.check_library()
+
+    assert mock_output.call_count == 1
+    command = mock_output.call_args[0][0]
+    assert command[:2] == ["calibre-debug", "-c"]
+    assert SCHEMA_VERSION_PREF in command[2]
+
+
+@patch("src.calibre.which", lambda name: f"/usr/bin/{name}")
+def test_check_library_skips_migrated_library(tmp_path):
+    _create_metadata_db(tmp_path, SCHEMA_VERSION)
+    calibre = CalibreHelper(library_path=str(tmp_path))
+
+    with patch("src.calibre.check_and_clean_output") as mock_output:
+        calibre.check_library()
+
+    mock_output.assert_not_called()
+
+
+@patch("src.calibre.which", lambda name: f"/usr/bin/{name}")
+def test_check_library_checks_columns_on_server(tmp_path):
+    calibre = CalibreHelper(library_path="http://localhost:8080/#library")
+
+    with patch(
+        "src.calibre.check_and_clean_output", return_value=CUSTOM_COLUMNS
+    ) as mock_output:
+        calibre.check_library()
+
+    # The columns are all there already, so they're only listed.
+    mock_output.assert_called_once()
+    assert mock_output.call_args[0][0][:2] == ["calibredb", "custom_columns"]
+
+
+@patch("src.calibre.which", lambda name: None)
+def test_check_library_without_calibredb(tmp_path):
+    calibre = CalibreHelper(library_path=str(tmp_path))
+
+    with pytest.raises(CalibreException) as e:
+        calibre.check_library()
+    assert "Calibredb is not installed" in e.value.message
+
+
+def _fake_calibredb(command, retries=0):
+    if command[:2] == ["calibredb", "search"]:
+        return "1,2"
+    if command[:2] == ["calibredb", "list"]:
+        return json.dumps(
+            [
+                {"id": i, "title": f"Work {i}", "*identifier": f"url:{url}"}
+                for i, url in ((1, "https://a.org/1"), (2, "https://a.org/2"))
+            ]
+        )
+    return ""
+
+
+@patch("src.calibre.check_and_clean_output", side_effect=_fake_calibredb)
+def test_query_cache(mock_output):
+    calibre = CalibreHelper(library_path="library")
+    run_report = report.start_report()
+    try:
+        assert calibre.get_author_works_count("author") == 2
+        works = calibre.list_titles_and_urls(authors=["author"])
+        assert calibre.search(urls=["https://a.org/2", "https://a.org/1"]) == ["1", "2"]
+        assert calibre.search(urls=["https://a.org/1", "https://a.org/2"]) == ["1", "2"]
+    finally:
+        report.stop_report()
+
+    assert [w["url"] for w in works] == ["https://a.org/1", "https://a.org/2"]
+    assert mock_output.call_count == 2
+    assert run_report.counters["calibre_query_cache_hits"] == 2
+    assert run_report.counters["calibre_query_cache_misses"] == 2
+
+
+@patch("src.calibre.check_and_clean_output", side_effect=_fake_calibredb)
+def test_query_cache_invalidation(mock_output):
+    calibre = CalibreHelper(library_path="library")
+    calibre.search(urls=["https://a.org/1"])
+    calibre.search(urls=["https://a.org/3"])
+    calibre.search(series=["My Series"])
+    calibre.list_titles_and_urls(authors=["author"])
+    assert mock_output.call_count == 4
+
+    # Only the search for the new book's url and the unlimited searches can change.
+    calibre.add("book.epub", url="https://a.org/3")
+    calibre.search(urls=["https://a.org/1"])
+    calibre.search(urls=["https://a.org/3"])
+    calibre.search(series=["My Series"])
+    calibre.list_titles_and_urls(authors=["author"])
+    assert mock_output.call_count == 5 + 3
+
+    # Setting a series changes series searches, and searches that found the book.
+    calibre.set_metadata(2, {"#series00": "Other Series", "#words": 100})
+    calibre.search(urls=["https://a.org/1"])
+    calibre.search(urls=["https://a.org/3"])
+    calibre.search(series=["My Series"])
+    calibre.list_titles_and_urls(authors=["author"])
+    assert mock_output.call_count == 9 + 4
+
+    # Removing a book changes searches that found it.
+    calibre.remove(7)
+    calibre.search(urls=["https://a.org/1"])
+    assert mock_output.call_count == 14
+
+
+def test_chunk_urls():
+    urls = [f"https://archiveofourown.org/works/{i}" for i in range(10)]
+
+    assert chunk_urls(urls, max_count=4) == [urls[:4], urls[4:8], urls[8:]]
+    # Each url and its " OR " separator is 40 characters long.
+    assert chunk_urls(urls, max_length=100) == [
+        urls[i : i + 2] for i in range(0, 10, 2)
+    ]
+    assert chunk_urls([]) == []
+
+
+def test_lookup_urls_in_index(tmp_path):
+    _create_metadata_db(tmp_path)
+    with closing(sqlite3.connect(tmp_path / "metadata.db")) as db:
+        db.execute("CREATE TABLE identifiers (id INTEGER PRIMARY KEY, book, type, val)")
+        db.executemany(
+            "INSERT INTO identifiers (book, type, val) VALUES (?, ?, ?)",
+            [
+                (1, "url", "https://a.org/1"),
+                (2, "url", "https://a.org/2"),
+                (3, "url", "https://a.org/2"),
+                (4, "isbn", "https://a.org/3"),
+            ],
+        )
+        db.commit()
+    calibre = CalibreHelper(library_path=str(tmp_path))
+
+    with patch("src.calibre.check_and_clean_output") as mock_output:
+        ids = calibre.lookup_urls(
+            ["https://a.org/1", "https://a.org/2", "https://a.org/3"]
+        )
+
+    mock_output.assert_not_called()
+    assert ids == {"https://a.org/1": "1", "https://a.org/2": "3"}
+
+
+def _fake_calibredb_list(command, retries=0):
+    urls = re.findall(r'url:=([^"]*)"', command[2])
+    return json.dumps(
+        [
+            {"id": int(url.split("/")[-1]), "*identifier": f"url:{url}"}
+            for url in urls
+            if int(url.split("/")[-1]) % 2 == 0
+        ]
+    )
+
+
+@patch("src.calibre.MAX_URLS_PER_SEARCH", 10)
+@patch("src.calibre.check_and_clean_output", side_effect=_fake_calibredb_list)
+def test_lookup_urls_in_chunks(mock_output):
+    calibre = CalibreHelper(library_path="http://localhost:8080/#library")
+    urls = [f"https://a.org/{i}" for i in range(25)]
+
+    ids = calibre.lookup_urls(urls)
+
+    assert mock_output.call_count == 3
+    assert ids == {url: str(i) for i, url in enumerate(urls) if i % 2 == 0}
+
+
+def test_export_many_clones_library_files(tmp_path):
+    library = tmp_path / "library"
+    book_dir = library / "Author" / "Title (1)"
+    book_dir.mkdir(parents=True)
+    (book_dir / "Title - Author.epub").write_text("epub 1")
+    _create_metadata_db(library)
+    with closing(sqlite3.connect(library / "metadata.db")) as db:
+        db.execute("CREATE TABLE books (id INTEGER PRIMARY KEY, path)")
+        db.execute("CREATE TABLE data (id INTEGER PRIMARY KEY, book, format, name)")
+        db.executemany(
+            "INSERT INTO books (id, path) VALUES (?, ?)",
+            [(1, "Author/Title (1)"), (2, "Author/Other (2)")],
+        )
+        db.executemany(
+            "INSERT INTO data (book, format, name) VALUES (?, ?, ?)",
+            [(1, "EPUB", "Title - Author"), (2, "EPUB", "Other - Author")],
+        )
+        db.commit()
+    calibre = CalibreHelper(library_path=str(library))
+    location = tmp_path / "export"
+    location.mkdir()
+
+    with patch("src.calibre.check_and_clean_output") as mock_output:
+        filepaths = calibre.export_many(["1", "2"], str(location))
+
+    # The file of book 2 is missing, so it's exported with calibredb.
+    mock_output.assert_called_once()
+    assert mock_output.call_args[0][0][:3] == ["calibredb", "export", "2"]
+    assert filepaths == {"1": str(location / "1.epub")}
+    assert (location / "1.epub").read_text() == "epub 1"
+
+
+def test_export_many_exports_books_that_fail_to_clone(tmp_path):
+    library = tmp_path / "library"
+    for book_id in [1, 2]:
+        book_dir = library / "Author" / f"Title ({book_id})"
+        book_dir.mkdir(parents=True)
+        (book_dir / "Title - Author.epub").write_text(f"epub {book_id}")
+    _create_metadata_db(library)
+    with closing(sqlite3.connect(library / "metadata.db")) as db:
+        db.execute("CREATE TABLE books (id INTEGER PRIMARY KEY, path)")
+        db.execute("CREATE TABLE data (id INTEGER PRIMARY KEY, book, format, name)")
+        db.executemany(
+            "INSERT INTO books (id, path) VALUES (?, ?)",
+            [(1, "Author/Title (1)"), (2, "Author/Title (2)")],
+        )
+        db.executemany(
+            "INSERT INTO data (book, format, name) VALUES (?, ?, ?)",
+            [(1, "EPUB", "Title - Author"), (2, "EPUB", "Title - Author")],
+        )
+        db.commit()
+    calibre = CalibreHelper(library_path=str(library))
+    location = tmp_path / "export"
+    location.mkdir()
+
+    def clone_file(source, destination):
+        if "(2)" in source:
+            raise OSError("Input/output error")
+        shutil.copy(source, destination)
+
+    with patch("src.calibre.clone_file", clone_file), patch(
+        "src.calibre.check_and_clean_output"
+    ) as mock_output:
+        filepaths = calibre.export_many(["1", "2"], str(location))
+
+    assert mock_output.call_args[0][0][:3] == ["calibredb", "export", "2"]
+    assert filepaths == {"1": str(location / "1.epub")}
+    assert (location / "1.epub").read_text() == "epub 1"
+
+
+def _create_metadata_tables(library):
+    with closing(sqlite3.connect(library / "metadata.db")) as db:
+        db.executescript(
+            """
+            CREATE TABLE books (id INTEGER PRIMARY KEY, series_index);
+            CREATE TABLE tags (id INTEGER PRIMARY KEY, name);
+            CREATE TABLE books_tags_link (id INTEGER PRIMARY KEY, book, tag);
+            CREATE TABLE series (id INTEGER PRIMARY KEY, name);
+            CREATE TABLE books_series_link (id INTEGER PRIMARY KEY, book, series);
+            CREATE TABLE custom_columns (
+                id INTEGER PRIMARY KEY, label, datatype, is_multiple, normalized
+            );
+            INSERT INTO custom_columns VALUES (1, 'words', 'int', 0, 0);
+            INSERT INTO custom_columns VALUES (2, 'characters', 'text', 1, 1);
+            INSERT INTO custom_columns VALUES (3, 'series00', 'series', 0, 1);
+            CREATE TABLE custom_column_1 (id INTEGER PRIMARY KEY, book, value);
+            CREATE TABLE custom_column_2 (id INTEGER PRIMARY KEY, value);
+            CREATE TABLE books_custom_column_2_link (id INTEGER PRIMARY KEY, book, value);
+            CREATE TABLE custom_column_3 (id INTEGER PRIMARY KEY, value);
+            CREATE TABLE books_custom_column_3_link (
+                id INTEGER PRIMARY KEY, book, value, extra
+            );
+
+            INSERT INTO books VALUES (1, 2.0);
+            INSERT INTO series VALUES (1, 'My Series');
+            INSERT INTO books_series_link (book, series) VALUES (1, 1);
+            INSERT INTO custom_column_1 (book, value) VALUES (1, 1000);
+            INSERT INTO custom_column_2 VALUES (1, 'Jane Grey'), (2, 'Captain Scarlet');
+            INSERT INTO books_custom_column_2_link (book, value) VALUES (1, 1), (1, 2);
+            INSERT INTO custom_column_3 VALUES (1, 'Other Series');
+            INSERT INTO books_custom_column_3_link (book, value, extra)
+                VALUES (1, 1, 3.0);
+            """
+        )
+        db.commit()
+
+
+def test_get_changed_metadata(tmp_path):
+    _create_metadata_db(tmp_path)
+    _create_metadata_tables(tmp_path)
+    calibre = CalibreHelper(library_path=str(tmp_path))
+
+    changed = calibre.get_changed_metadata(
+        1,
+        {
+            "#words": 1200,
+            "series": "My Series [2]",
+            "#series00": "Other Series [3]",
+            "tags": "",
+            "#characters": "Captain Scarlet,Jane Grey",
+            "#status": "Completed",
+        },
+    )
+
+    # #status isn't a column in this library, so it's left for calibre to reject.
+    assert changed == {"#words": 1200, "#status": "Completed"}
+    assert calibre.get_changed_metadata(1, {"series": "", "#words": ""}) == {
+        "series": "",
+        "#words": "",
+    }
+
+
+def test_get_changed_metadata_without_index():
+    calibre = CalibreHelper(library_path="http://localhost:8080/#library")
+    options = {"#words": 1000, "tags": ""}
+
+    assert calibre.get_changed_metadata(1, options) == options
+
+
+def test_get_bulk_fields():
+    fields = get_bulk_fields(
+        {
+            1: {"#words": 100, "series": "My Series [2]", "tags": ""},
+            2: {"#words": 200, "#series00": "Other Series [1.5]", "series": ""},
+        }
+    )
+
+    assert fields == {
+        "#words": {1: 100, 2: 200},
+        "series": {1: "My Series", 2: ""},
+        "series_index": {1: 2.0},
+        "#series00": {2: "Other Series"},
+        "#series00_index": {2: 1.5},
+        "tags": {1: ""},
+    }
+
+
+@patch("src.calibre.METADATA_BATCH_SIZE", 2)
+@patch("src.calibre.METADATA_BOOKS_PER_PROCESS", 3)
+def test_set_metadata_many_in_batches(tmp_path):
+    calibre = CalibreHelper(library_path=str(tmp_path))
+    scripts = []
+
+    def fake_calibre_debug(command, retries=0):
+        updates_path = re.search(r"open\('(.*?)'\)", command[2]).group(1)
+        with open(updates_path) as f:
+            scripts.append(json.loads(f.read()))
+        return ""
+
+    with patch("src.calibre.check_and_clean_output", side_effect=fake_calibre_debug):
+        calibre.set_metadata_many({i: {"#words": i * 10} for i in range(1, 6)})
+
+    assert scripts == [
+        [{"#words": {"1": 10, "2": 20}}, {"#words": {"3": 30}}],
+        [{"#words": {"4": 40, "5": 50}}],
+    ]
+
+
+def test_get_all_tags_from_index(tmp_path):
+    _create_metadata_db(tmp_path)
+    _create_metadata_tables(tmp_path)
+    with closing(sqlite3.connect(tmp_path / "metadata.db")) as db:
+        db.execute("INSERT INTO tags VALUES (1, 'fandoms.Merlin'), (2, 'Favourite')")
+        db.execute("INSERT INTO books_tags_link (book, tag) VALUES (1, 1), (1, 2)")
+        db.execute("INSERT INTO books_tags_link (book, tag) VALUES (2, 2)")
+        db.commit()
+    calibre = CalibreHelper(library_path=str(tmp_path))
+
+    with patch("src.calibre.check_and_clean_output") as mock_output:
+        all_tags = calibre.get_all_tags()
+
+    mock_output.assert_not_called()
+    assert all_tags == {"1": ["fandoms.Merlin", "Favourite"], "2": ["Favourite"]}
+
+
+def test_get_tag_items(tmp_path):
+    _create_metadata_db(tmp_path)
+    _create_metadata_tables(tmp_path)
+    with closing(sqlite3.connect(tmp_path / "metadata.db")) as db:
+        db.execute("INSERT INTO tags VALUES (1, 'fanfic.Fluff'), (2, 'Unused')")
+        db.execute("INSERT INTO books_tags_link (book, tag) VALUES (1, 1), (2, 1)")
+        db.commit()
+    calibre = CalibreHelper(library_path=str(tmp_path))
+
+    items = calibre.get_tag_items(["tags", "#characters", "#fandoms"])
+
+    assert items == {
+        "tags": {1: ("fanfic.Fluff", 2), 2: ("Unused", 0)},
+        "#characters": {1: ("Jane Grey", 1), 2: ("Captain Scarlet", 1)},
+    }
+
+
+def test_get_all_format_paths(tmp_path):
+    book_dir = tmp_path / "Author" / "Title (1)"
+    book_dir.mkdir(parents=True)
+    (book_dir / "Title - Author.epub").write_text("epub 1")
+    _create_metadata_db(tmp_path)
+    with closing(sqlite3.connect(tmp_path / "metadata.db")) as db:
+        db.execute("CREATE TABLE books (id INTEGER PRIMARY KEY, path)")
+        db.execute("CREATE TABLE data (id INTEGER PRIMARY KEY, book, format, name)")
+        db.execute("INSERT INTO books VALUES (1, 'Author/Title (1)')")
+        db.execute(
+            "INSERT INTO data (book, format, name) VALUES (1, 'EPUB', ?)",
+            ("Title - Author",),
+        )
+        db.commit()
+
+    paths = CalibreHelper(library_path=str(tmp_path)).get_all_format_paths()
+
+    assert paths == {"1": str(book_dir / "Title - Author.epub")}
+    assert (
+        CalibreHelper(
+            library_path="http://localhost:8080/#library"
+        ).get_all_format_paths()
+        is None
+    )
+
+
+@patch("src.calibre.check_and_clean_output")
+def test_set_metadata_is_timed(mock_output):
+    calibre = CalibreHelper(library_path="http://localhost:8080/#library")
+    run_report = report.start_report()
+    try:
+        calibre.set_metadata(1, {"#words": 100})
+    finally:
+        report.stop_report()
+
+    mock_output.assert_called_once()
+    assert len(run_report.phase_seconds["set_metadata"]) == 1
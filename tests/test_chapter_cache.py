@@ -0,0 +1,52 @@
+from src.chapter_cache import ChapterCache, get_chapter_listing
+
+
+def _get_metadata(chapter_dates):
+    return {
+        "storyId": "12345",
+        "dateUpdated": "2025-01-03",
+        "zchapters": [
+            [
+                i + 1,
+                {
+                    "url": f"https://archiveofourown.org/works/12345/chapters/{100 + i}",
+                    "date": date,
+                },
+            ]
+            for i, date in enumerate(chapter_dates)
+        ],
+    }
+
+
+def test_get_chapter_listing():
+    metadata = _get_metadata(["2025-01-01", "2025-01-02"])
+
+    assert get_chapter_listing(metadata) == {
+        "100": "2025-01-01",
+        "101": "2025-01-02",
+    }
+
+
+def test_changed_chapters_nothing_cached(tmp_path):
+    cache = ChapterCache(str(tmp_path))
+
+    assert cache.changed_chapters(_get_metadata(["2025-01-01"])) is None
+
+
+def test_changed_chapters_no_changes(tmp_path):
+    cache = ChapterCache(str(tmp_path))
+    cache.update(_get_metadata(["2025-01-01", "2025-01-02"]))
+
+    # A new chapter doesn't count as a change.
+    metadata = _get_metadata(["2025-01-01", "2025-01-02", "2025-01-03"])
+
+    assert cache.changed_chapters(metadata) == []
+
+
+def test_changed_chapters_with_changes(tmp_path):
+    cache = ChapterCache(str(tmp_path))
+    cache.update(_get_metadata(["2025-01-01", "2025-01-02"]))
+
+    metadata = _get_metadata(["2025-01-01", "2025-02-01"])
+
+    assert cache.changed_chapters(metadata) == ["101"]
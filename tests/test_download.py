@@ -0,0 +1,131 @@
+from threading import Lock
+from unittest.mock import MagicMock
+from zipfile import ZipFile
+
+from src.chapter_cache import ChapterCache
+from src.download import _refresh_from_chapter_cache, do_download
+from src.epub_utils import REFETCH_CHAPTER_MARK
+
+CONTAINER = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>"""
+
+OPF = """<?xml version="1.0"?>
+<package version="2.0" xmlns="http://www.idpf.org/2007/opf">
+  <manifest>%s</manifest>
+  <spine>%s</spine>
+</package>"""
+
+URL = "https://archiveofourown.org/works/1"
+
+
+def _write_epub(path, chapters):
+    manifest = "".join(
+        f'<item id="file{i}" href="file{i}.xhtml"/>' for i in range(len(chapters))
+    )
+    spine = "".join(f'<itemref idref="file{i}"/>' for i in range(len(chapters)))
+    with ZipFile(path, "w") as epub:
+        epub.writestr("META-INF/container.xml", CONTAINER)
+        epub.writestr("content.opf", OPF % (manifest, spine))
+        for i, chapter in enumerate(chapters):
+            epub.writestr(f"file{i}.xhtml", chapter)
+    return str(path)
+
+
+class InPlaceFanFicFare(object):
+    """Updates the epub it's given in place, like FanFicFare with --update-epub."""
+
+    def __init__(self, chapters):
+        self.chapters = chapters
+
+    def download(self, fic_to_download, location, **kwargs):
+        _write_epub(fic_to_download, self.chapters)
+        metadata = {"title": "Title", "author": "Author", "output_filename": "x"}
+        return fic_to_download, metadata
+
+
+def _calibre(exported_epub):
+    calibre = MagicMock()
+    calibre.write_lock = Lock()
+    calibre.search.return_value = ["1"]
+    calibre.export.return_value = exported_epub
+    calibre.lookup_urls.return_value = {URL: "2"}
+    return calibre
+
+
+def _download(tmp_path, new_chapters, monkeypatch):
+    monkeypatch.setattr("src.download._set_metadata", MagicMock())
+    exported_epub = _write_epub(tmp_path / "1.epub", ["One"])
+    calibre = _calibre(exported_epub)
+
+    do_download(str(tmp_path), URL, InPlaceFanFicFare(new_chapters), calibre, False)
+
+    return calibre
+
+
+def test_do_download_adds_epub_updated_in_place(tmp_path, monkeypatch):
+    calibre = _download(tmp_path, ["One", "Two"], monkeypatch)
+
+    calibre.add.assert_called_once_with(book_filepath=str(tmp_path / "1.epub"), url=URL)
+    calibre.remove.assert_called_once_with("1")
+
+
+def test_do_download_skips_unchanged_epub(tmp_path, monkeypatch):
+    calibre = _download(tmp_path, ["One"], monkeypatch)
+
+    calibre.add.assert_not_called()
+    calibre.remove.assert_not_called()
+
+
+def _chapter(chapter_id):
+    return (
+        f'<meta name="chapterurl" content="{URL}/chapters/{chapter_id}" />'
+        f"<p>Chapter {chapter_id}</p>"
+    )
+
+
+def _chapter_metadata(chapter_dates):
+    return {
+        "storyId": "1",
+        "zchapters": [
+            [i, {"url": f"{URL}/chapters/{chapter_id}", "date": date}]
+            for i, (chapter_id, date) in enumerate(chapter_dates.items(), 1)
+        ],
+    }
+
+
+def test_refresh_from_chapter_cache_refetches_changed_chapters(tmp_path):
+    chapter_cache = ChapterCache(str(tmp_path / "cache"))
+    chapter_cache.update(_chapter_metadata({"10": "2025-01-01", "11": "2025-01-01"}))
+    exported_epub = _write_epub(tmp_path / "1.epub", [_chapter(10), _chapter(11)])
+    fff_helper = MagicMock()
+    fff_helper.get_metadata_only.return_value = _chapter_metadata(
+        {"10": "2025-01-01", "11": "2025-02-01"}
+    )
+
+    _refresh_from_chapter_cache(
+        URL, exported_epub, str(tmp_path), fff_helper, chapter_cache
+    )
+
+    with ZipFile(exported_epub) as epub:
+        assert f"{URL}/chapters/10" in epub.read("file0.xhtml").decode()
+        assert REFETCH_CHAPTER_MARK in epub.read("file1.xhtml").decode()
+    fff_helper.download.assert_called_once_with(
+        exported_epub, str(tmp_path), update_always=True, always_overwrite=True
+    )
+
+
+def test_refresh_from_chapter_cache_needs_cached_chapters(tmp_path):
+    chapter_cache = ChapterCache(str(tmp_path / "cache"))
+    fff_helper = MagicMock()
+
+    assert (
+        _refresh_from_chapter_cache(
+            URL, str(tmp_path / "1.epub"), str(tmp_path), fff_helper, chapter_cache
+        )
+        is None
+    )
+    fff_helper.get_metadata_only.assert_not_called()
@@ -0,0 +1,58 @@
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from src.epub_scan import get_title_page_fields, scan_epubs
+
+TITLE_PAGE = """<h3><a href="https://archiveofourown.org/works/1">A Work</a></h3>
+<div>
+<b>Rating:</b> Teen And Up Audiences<br />
+<b>Series:</b> <a class="serieslink" href="https://archiveofourown.org/series/2">\
+Tom &amp; Jerry [3]</a>, <a class="serieslink" \
+href="https://archiveofourown.org/series/4">Other Series [1]</a><br />
+<b>Words:</b> 12,345<br />
+</div>"""
+
+
+def test_get_title_page_fields():
+    fields = get_title_page_fields(TITLE_PAGE)
+
+    assert fields == {
+        "words": 12345,
+        "rating": "Teen And Up Audiences",
+        "series": [("2", "Tom & Jerry"), ("4", "Other Series")],
+    }
+    assert get_title_page_fields("<p>No metadata</p>") == {}
+
+
+def test_scan_epubs(tmp_path):
+    paths = {}
+    for book_id in ["1", "2", "3"]:
+        path = tmp_path / f"{book_id}.epub"
+        with ZipFile(path, "w") as epub:
+            epub.writestr("OEBPS/file0001.xhtml", "<p>One</p>")
+            if book_id != "2":
+                epub.writestr(
+                    "OEBPS/title_page.xhtml", f"<b>Words:</b> {book_id}000<br />"
+                )
+        paths[book_id] = str(path)
+
+    results = list(scan_epubs(paths, workers=2))
+
+    assert results == [("1", {"words": 1000}), ("3", {"words": 3000})]
+
+
+def test_scan_epubs_skips_corrupt_epubs(tmp_path):
+    good = tmp_path / "1.epub"
+    with ZipFile(good, "w") as epub:
+        epub.writestr("OEBPS/title_page.xhtml", "<b>Words:</b> 100<br />")
+    corrupt = tmp_path / "2.epub"
+    with ZipFile(corrupt, "w", compression=ZIP_DEFLATED) as epub:
+        epub.writestr("OEBPS/title_page.xhtml", "<b>Words:</b> 200<br />" * 100)
+    data = bytearray(corrupt.read_bytes())
+    # Garble the compressed title page, just after its local file header.
+    start = data.index(b"title_page.xhtml") + len(b"title_page.xhtml")
+    data[start : start + 20] = b"\xff" * 20
+    corrupt.write_bytes(bytes(data))
+
+    results = list(scan_epubs({"1": str(good), "2": str(corrupt)}, workers=2))
+
+    assert results == [("1", {"words": 100})]
@@ -0,0 +1,68 @@
+from zipfile import ZipFile
+
+from src.epub_utils import (
+    REFETCH_CHAPTER_MARK,
+    mark_chapters_for_refetch,
+    read_title_page,
+)
+
+CONTAINER = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>"""
+
+OPF = """<?xml version="1.0"?>
+<package version="2.0" xmlns="http://www.idpf.org/2007/opf">
+  <metadata><dc:date xmlns:dc="http://purl.org/dc/elements/1.1/">%s</dc:date></metadata>
+  <manifest>
+    <item id="title_page" href="OEBPS/title_page.xhtml"/>
+    <item id="file0001" href="OEBPS/file0001.xhtml"/>
+    <item id="file0002" href="OEBPS/file0002.xhtml"/>
+  </manifest>
+  <spine>
+    <itemref idref="title_page"/>
+    <itemref idref="file0001"/>
+    <itemref idref="file0002"/>
+  </spine>
+</package>"""
+
+
+def _write_epub(path, date="2024-01-01", updated="2024-01-01", chapter_2="Two"):
+    with ZipFile(path, "w") as epub:
+        epub.writestr("mimetype", "application/epub+zip")
+        epub.writestr("META-INF/container.xml", CONTAINER)
+        epub.writestr("content.opf", OPF % date)
+        epub.writestr("OEBPS/title_page.xhtml", f"<p>Updated: {updated}</p>")
+        epub.writestr("OEBPS/file0001.xhtml", "<p>One</p>")
+        epub.writestr("OEBPS/file0002.xhtml", f"<p>{chapter_2}</p>")
+    return str(path)
+
+
+def test_read_title_page(tmp_path):
+    epub = _write_epub(tmp_path / "1.epub", updated="2024-02-01")
+
+    assert read_title_page(epub) == "<p>Updated: 2024-02-01</p>"
+    (tmp_path / "broken.epub").write_text("not a zip")
+    assert read_title_page(str(tmp_path / "broken.epub")) is None
+
+
+def test_mark_chapters_for_refetch(tmp_path):
+    path = str(tmp_path / "1.epub")
+    with ZipFile(path, "w") as epub:
+        epub.writestr("mimetype", "application/epub+zip")
+        for i in [1, 2]:
+            epub.writestr(
+                f"OEBPS/file000{i}.xhtml",
+                f'<meta name="chapterurl" content="https://example.com/{i}" />',
+            )
+
+    assert mark_chapters_for_refetch(path, lambda url: url.endswith("/2")) == 1
+    with ZipFile(path) as epub:
+        assert epub.namelist()[0] == "mimetype"
+        assert "https://example.com/1" in epub.read("OEBPS/file0001.xhtml").decode()
+        assert REFETCH_CHAPTER_MARK in epub.read("OEBPS/file0002.xhtml").decode()
+
+    (tmp_path / "broken.epub").write_text("not a zip")
+    assert mark_chapters_for_refetch(str(tmp_path / "broken.epub"), bool) is None
@@ -0,0 +1,77 @@
+import os
+
+from src.calibre import CalibreException
+from src.export_staging import ExportStager
+
+
+class FakeCalibre(object):
+    def __init__(self, fail=False, error=None):
+        self.exported = []
+        self.fail = fail
+        self.error = error
+
+    def export_many(self, book_ids, location):
+        if self.fail:
+            raise CalibreException("calibredb export failed")
+        if self.error:
+            raise self.error
+        self.exported.append(book_ids)
+        filepaths = {}
+        for book_id in book_ids:
+            filepaths[book_id] = os.path.join(location, f"{book_id}.epub")
+            with open(filepaths[book_id], "w") as f:
+                f.write(book_id)
+        return filepaths
+
+
+def test_export_stager(tmp_path):
+    calibre = FakeCalibre()
+    stager = ExportStager(calibre, list(range(10)), window=4)
+    try:
+        filepath = stager.take(0, str(tmp_path))
+        assert filepath == str(tmp_path / "0.epub")
+        with open(filepath, "r") as f:
+            assert f.read() == "0"
+
+        for book_id in range(1, 10):
+            assert stager.take(book_id, str(tmp_path))
+        # Each book is only staged once.
+        assert stager.take(3, str(tmp_path)) is None
+        assert stager.take(12, str(tmp_path)) is None
+    finally:
+        stager.close()
+
+    assert calibre.exported == [
+        ["0", "1", "2", "3"],
+        ["4", "5", "6", "7"],
+        ["8", "9"],
+    ]
+    assert not os.path.exists(stager.staging_dir)
+
+
+def test_export_stager_prefetches_next_window(tmp_path):
+    calibre = FakeCalibre()
+    stager = ExportStager(calibre, list(range(10)), window=4)
+    try:
+        stager.take(0, str(tmp_path))
+        stager.exports[1].result()
+    finally:
+        stager.close()
+
+    assert calibre.exported == [["0", "1", "2", "3"], ["4", "5", "6", "7"]]
+
+
+def test_export_stager_export_fails(tmp_path):
+    stager = ExportStager(FakeCalibre(fail=True), [1, 2])
+    try:
+        assert stager.take(1, str(tmp_path)) is None
+    finally:
+        stager.close()
+
+
+def test_export_stager_copy_fails(tmp_path):
+    stager = ExportStager(FakeCalibre(error=OSError("No space left on device")), [1])
+    try:
+        assert stager.take(1, str(tmp_path)) is None
+    finally:
+        stager.close()
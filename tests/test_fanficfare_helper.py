@@ -0,0 +1,24 @@
+from unittest.mock import patch
+
+from src.fanficfare_helper import FANFICFARE_RETRIES, FanFicFareHelper
+
+OUTPUT = '{"output_filename": "work.epub"}'
+
+
+@patch("src.fanficfare_helper.check_subprocess_output", return_value=OUTPUT)
+def test_download_from_url_is_retried(mock_output, tmp_path):
+    FanFicFareHelper(None).download(
+        "https://archiveofourown.org/works/1", str(tmp_path)
+    )
+
+    assert mock_output.call_args.kwargs["retries"] == FANFICFARE_RETRIES
+
+
+@patch("src.fanficfare_helper.check_subprocess_output", return_value=OUTPUT)
+def test_epub_update_is_not_retried(mock_output, tmp_path):
+    epub = tmp_path / "1.epub"
+    epub.write_text("epub")
+
+    FanFicFareHelper(None).download(str(epub), str(tmp_path))
+
+    assert mock_output.call_args.kwargs["retries"] == 0
@@ -0,0 +1,75 @@
+from src.image_cache import ImageCache, is_image_content_type
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"0" * 92
+JPEG = b"\xff\xd8\xff" + b"1" * 97
+
+
+def test_is_image_content_type():
+    assert is_image_content_type("image/png")
+    assert is_image_content_type("Image/JPEG; charset=binary")
+    assert not is_image_content_type("text/html; charset=utf-8")
+    assert not is_image_content_type("application/xml")
+    assert not is_image_content_type(None)
+
+
+def test_get_and_put(tmp_path):
+    cache = ImageCache(str(tmp_path), max_size=1000)
+    cache.put("https://example.com/banner.png", PNG)
+    cache.save()
+
+    cache = ImageCache(str(tmp_path), max_size=1000)
+    assert cache.get("https://example.com/banner.png") == PNG
+    assert cache.get("https://example.com/other.png") is None
+
+
+def test_same_image_stored_once(tmp_path):
+    cache = ImageCache(str(tmp_path), max_size=1000)
+    cache.put("https://example.com/banner.png", PNG)
+    cache.put("https://example.org/copy-of-banner.png", PNG)
+
+    assert cache.total_size() == len(PNG)
+    assert cache.get("https://example.org/copy-of-banner.png") == PNG
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ImageCache(str(tmp_path), max_size=250)
+    cache.put("https://example.com/1.png", PNG)
+    cache.put("https://example.com/2.jpg", JPEG)
+    cache.get("https://example.com/1.png")
+
+    cache.put("https://example.com/3.png", PNG.replace(b"0", b"3"))
+    cache.save()
+
+    assert cache.get("https://example.com/1.png") == PNG
+    assert cache.get("https://example.com/2.jpg") is None
+    assert cache.total_size() == 200
+
+
+def test_save_merges_other_processes_entries(tmp_path):
+    cache_1 = ImageCache(str(tmp_path), max_size=1000)
+    cache_2 = ImageCache(str(tmp_path), max_size=1000)
+    cache_1.put("https://example.com/1.png", PNG)
+    cache_2.put("https://example.com/2.jpg", JPEG)
+    cache_1.save()
+    cache_2.save()
+
+    cache = ImageCache(str(tmp_path), max_size=1000)
+    assert cache.get("https://example.com/1.png") == PNG
+    assert cache.get("https://example.com/2.jpg") == JPEG
+
+
+def test_save_keeps_entries_other_processes_forgot_and_put_again(tmp_path):
+    cache = ImageCache(str(tmp_path), max_size=1000)
+    cache.put("https://example.com/1.png", PNG)
+    cache.save()
+
+    cache_1 = ImageCache(str(tmp_path), max_size=1000)
+    cache_2 = ImageCache(str(tmp_path), max_size=1000)
+    cache_2.put("https://example.com/1.png", JPEG)
+    cache_2.save()
+    # The first process only forgets the image it knew about.
+    cache_1._forget("https://example.com/1.png")
+    cache_1.save()
+
+    cache = ImageCache(str(tmp_path), max_size=1000)
+    assert cache.get("https://example.com/1.png") == JPEG
@@ -2,7 +2,10 @@ import os.path
 from argparse import Namespace
 from unittest.mock import patch
 
+import pytest
+
 from src import options
+from src.exceptions import InvalidConfig
 
 valid_config_path = os.path.join(
     os.path.dirname(os.path.realpath(__file__)), "fixtures", "valid_config.ini"
@@ -12,7 +15,17 @@ valid_config_path = os.path.join(
 def test_get_config_file_arguments():
     namespace = Namespace(config=valid_config_path, command="download")
 
-    config_file_args = options.get_config_file_arguments(namespace)
+    config_file_args = options.get_config_file_arguments(
+        namespace,
+        {
+            "use-browser-cookie",
+            "expand-series",
+            "force",
+            "dry-run",
+            "since-last-update",
+            "fix",
+        },
+    )
 
     assert config_file_args == [
         "download",
@@ -75,6 +88,13 @@ def test_set_up_options_from_config_file():
         "since_last_update": True,
         "expand_series": True,
         "force": False,
+        "time_budget": None,
+        "workers": 1,
+        "poll_intervals": {},
+        "socket": None,
+        "report": None,
+        "trace": None,
+        "profile": None,
         "input": "tests/fixtures/fanfiction.txt",
         "library": "tests/fixtures/Calibre Fanfic Library",
         "calibre_password": "password123",
@@ -88,10 +108,16 @@ def test_set_up_options_from_config_file():
         "config": valid_config_path,
         "fanficfare_config": "tests/fixtures/personal.ini",
         "last_update_file": "tests/fixtures/last_update.json",
+        "cache_dir": "cache",
+        "image_cache_size": None,
         "mirror": "https://archiveofourown.org",
         "analysis_dir": "tests/fixtures/analysis",
         "analysis_type": ["incomplete_works"],
         "fix": False,
+        "strip_tag_prefix": None,
+        "tag_pattern": None,
+        "tag_replacement": "",
+        "tag_mapping": None,
     }
 
 
@@ -126,6 +152,13 @@ def test_set_up_options_from_cli():
         "since_last_update": False,
         "expand_series": False,
         "force": False,
+        "time_budget": None,
+        "workers": 1,
+        "poll_intervals": {},
+        "socket": None,
+        "report": None,
+        "trace": None,
+        "profile": None,
         "input": "fanfiction.txt",
         "library": None,
         "calibre_password": None,
@@ -139,6 +172,8 @@ def test_set_up_options_from_cli():
         "config": None,
         "fanficfare_config": None,
         "last_update_file": "last_update.json",
+        "cache_dir": "cache",
+        "image_cache_size": None,
         "mirror": "https://archiveofourown.org",
         "analysis_dir": "analysis",
         "analysis_type": [
@@ -148,6 +183,10 @@ def test_set_up_options_from_cli():
             "incomplete_works",
         ],
         "fix": False,
+        "strip_tag_prefix": None,
+        "tag_pattern": None,
+        "tag_replacement": "",
+        "tag_mapping": None,
     }
 
 
@@ -186,6 +225,13 @@ def test_set_up_options_from_config_file_and_override_with_cli():
         "since_last_update": True,
         "expand_series": True,
         "force": False,
+        "time_budget": None,
+        "workers": 1,
+        "poll_intervals": {},
+        "socket": None,
+        "report": None,
+        "trace": None,
+        "profile": None,
         "input": "tests/fixtures/fanfiction.txt",
         "library": "tests/fixtures/Calibre Fanfic Library",
         "calibre_password": "password123",
@@ -199,8 +245,57 @@ def test_set_up_options_from_config_file_and_override_with_cli():
         "config": valid_config_path,
         "fanficfare_config": "tests/fixtures/personal.ini",
         "last_update_file": "tests/fixtures/last_update.json",
+        "cache_dir": "cache",
+        "image_cache_size": None,
         "mirror": "https://archiveofourown.org",
         "analysis_dir": "tests/fixtures/analysis",
         "analysis_type": ["incomplete_works"],
         "fix": False,
+        "strip_tag_prefix": None,
+        "tag_pattern": None,
+        "tag_replacement": "",
+        "tag_mapping": None,
     }
+
+
+def test_set_up_options_for_library_command_without_login():
+    args = ["fanficmanagement.py", "retag", "-l", "library"]
+    with patch("sys.argv", args):
+        command, namespace = options.set_up_options()
+
+    assert command == "retag"
+    assert namespace.library == "library"
+    assert namespace.user is None
+
+
+def test_set_up_options_from_config_file_with_numbers(tmp_path):
+    config_path = tmp_path / "config.ini"
+    config_path.write_text(
+        "[login]\nuser=testuser\ncookie=testcookie\n\n"
+        "[import]\ntime-budget=1\nworkers=1\nforce=False\n"
+    )
+    args = ["fanficmanagement.py", "download", "-C", str(config_path)]
+    with patch("sys.argv", args):
+        command, namespace = options.set_up_options()
+
+    assert namespace.time_budget == 1
+    assert namespace.workers == 1
+    assert namespace.force is False
+
+
+def test_set_up_options_from_config_file_with_invalid_flag(tmp_path):
+    config_path = tmp_path / "config.ini"
+    config_path.write_text(
+        "[login]\nuser=testuser\ncookie=testcookie\n\n[import]\nforce=maybe\n"
+    )
+    args = ["fanficmanagement.py", "download", "-C", str(config_path)]
+    with patch("sys.argv", args):
+        with pytest.raises(InvalidConfig, match="'force' .* should be True or False"):
+            options.set_up_options()
+
+
+def test_set_up_options_with_no_workers():
+    args = ["fanficmanagement.py", "download", "-u", "a", "-c", "b", "--workers", "0"]
+    with patch("sys.argv", args):
+        with pytest.raises(InvalidConfig, match="'workers' should be at least 1"):
+            options.set_up_options()
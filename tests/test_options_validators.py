@@ -3,6 +3,7 @@ from argparse import ArgumentTypeError, Namespace
 import pytest
 
 from src import options
+from src.exceptions import InvalidConfig
 
 
 def test_validate_sources_valid():
@@ -160,3 +161,31 @@ def test_validate_analysis_types_invalid_source():
         ArgumentTypeError, match="Valid 'analysis_type' options are .* not foobar"
     ):
         options.validate_analysis_type(namespace)
+
+
+def test_validate_workers_valid():
+    namespace = Namespace(workers=4)
+    options.validate_workers(namespace)
+
+    assert namespace.workers == 4
+
+
+def test_validate_workers_invalid():
+    namespace = Namespace(workers=0)
+    with pytest.raises(InvalidConfig, match="'workers' should be at least 1, not 0"):
+        options.validate_workers(namespace)
+
+
+def test_validate_time_budget_none():
+    namespace = Namespace(time_budget=None)
+    options.validate_time_budget(namespace)
+
+    assert namespace.time_budget is None
+
+
+def test_validate_time_budget_invalid():
+    namespace = Namespace(time_budget=-5)
+    with pytest.raises(
+        InvalidConfig, match="'time_budget' should be a number of minutes above 0"
+    ):
+        options.validate_time_budget(namespace)
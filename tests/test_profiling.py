@@ -0,0 +1,44 @@
+import pstats
+from threading import Thread
+
+from src import profiling
+
+
+def _sort_numbers():
+    return sorted(str(i) for i in range(1000))
+
+
+def _work_in_thread():
+    with profiling.thread_profile():
+        _sort_numbers()
+
+
+def test_profiling(tmp_path):
+    profiling.start_profiling(str(tmp_path))
+    try:
+        data = [str(i) * 10 for i in range(10000)]
+        profiling.snapshot("urls_collected")
+        thread = Thread(target=_work_in_thread)
+        thread.start()
+        thread.join()
+    finally:
+        profiling.stop_profiling()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "memory_01_urls_collected.txt",
+        "memory_02_end.txt",
+        profiling.PSTATS_FILENAME,
+        profiling.SUMMARY_FILENAME,
+    ]
+    assert (
+        "test_profiling.py" in (tmp_path / "memory_01_urls_collected.txt").read_text()
+    )
+    functions = pstats.Stats(str(tmp_path / profiling.PSTATS_FILENAME)).stats
+    assert "_sort_numbers" in {name for _, _, name in functions}
+    assert len(data) == 10000
+
+
+def test_no_profiling():
+    profiling.snapshot("urls_collected")
+    with profiling.thread_profile():
+        pass
@@ -0,0 +1,49 @@
+import json
+
+from src import report
+from src.utils import subprocess_listeners
+
+
+def test_timed_without_report():
+    assert report.get_report() is None
+
+    with report.timed("search"):
+        pass
+
+
+def test_run_report(tmp_path):
+    run_report = report.start_report()
+    try:
+        report.set_current_url("https://archiveofourown.org/works/1")
+        with report.timed("search"):
+            pass
+        with report.timed("search"):
+            pass
+        for listener in subprocess_listeners:
+            listener(["calibredb", "search", "x"], 0.5)
+        report.count("http_requests", 3)
+        run_report.record_work("https://archiveofourown.org/works/1", 2.0)
+        run_report.record_work("https://archiveofourown.org/works/2", 4.0)
+    finally:
+        report.set_current_url(None)
+        report.stop_report()
+
+    assert subprocess_listeners == []
+
+    path = tmp_path / "report.json"
+    run_report.write(str(path))
+    with open(path, "r") as f:
+        result = json.loads(f.read())
+
+    assert result["phases"]["search"]["count"] == 2
+    assert result["phases"]["subprocess:calibredb"]["total_seconds"] == 0.5
+    assert result["counters"] == {
+        "subprocess_spawns": 1,
+        "http_requests": 3,
+        "subprocess_spawns_by_command": {"calibredb": 1},
+    }
+    assert [w["url"][-1] for w in result["slowest_works"]] == ["2", "1"]
+    assert set(result["slowest_works"][1]["phases"]) == {
+        "search",
+        "subprocess:calibredb",
+    }
@@ -0,0 +1,111 @@
+from argparse import Namespace
+from unittest.mock import MagicMock, patch
+
+from src.retag import add_column_values, get_retag_updates, retag, split_tags
+
+
+def test_split_tags():
+    options = split_tags(
+        ["fandoms.Harry Potter", "freeformtags.Fluff...", "Favourite", "fandoms.Merlin"]
+    )
+
+    assert options == {
+        "#fandoms": "Harry Potter,Merlin",
+        "#freeformtags": "Fluff…",
+        "tags": "Favourite",
+    }
+    assert split_tags(["Favourite", "notatype.tag"]) is None
+
+
+def test_get_retag_updates():
+    updates = get_retag_updates(
+        {"1": ["rating.Teen"], "2": ["Favourite"], "3": ["status.In-Progress"]}
+    )
+
+    assert updates == {
+        "1": {"#rating": "Teen", "tags": ""},
+        "3": {"#status": "In-Progress", "tags": ""},
+    }
+
+
+def test_add_column_values():
+    options = {"#fandoms": "Merlin,Harry Potter", "#rating": "Teen", "tags": ""}
+    current = {
+        "#fandoms": ("multiple", {"merlin", "Lord of the Mysteries"}),
+        "#rating": ("multiple", set()),
+        "tags": ("multiple", {"fandoms.Merlin"}),
+    }
+
+    assert add_column_values(options, current) == {
+        "#fandoms": "Lord of the Mysteries,merlin,Harry Potter",
+        "#rating": "Teen",
+        "tags": "",
+    }
+
+
+def _options(dry_run=False):
+    return Namespace(
+        library="library", calibre_user=None, calibre_password=None, dry_run=dry_run
+    )
+
+
+@patch("src.retag.RETAG_CHUNK_SIZE", 2)
+@patch("src.retag.CalibreHelper")
+def test_retag_in_chunks(mock_helper):
+    calibre = MagicMock()
+    calibre.get_all_tags.return_value = {
+        str(i): [f"fandoms.Fandom {i}"] for i in [10, 2, 1]
+    }
+    calibre.get_metadata_values.return_value = {}
+    mock_helper.return_value = calibre
+
+    retag(_options())
+
+    calibre.check_library.assert_called_once()
+    assert [c.args[0] for c in calibre.set_metadata_many.call_args_list] == [
+        {
+            "1": {"#fandoms": "Fandom 1", "tags": ""},
+            "2": {"#fandoms": "Fandom 2", "tags": ""},
+        },
+        {"10": {"#fandoms": "Fandom 10", "tags": ""}},
+    ]
+
+
+@patch("src.retag.CalibreHelper")
+def test_retag_dry_run(mock_helper):
+    calibre = MagicMock()
+    calibre.get_all_tags.return_value = {"1": ["fandoms.Merlin"]}
+    mock_helper.return_value = calibre
+
+    retag(_options(dry_run=True))
+
+    calibre.set_metadata_many.assert_not_called()
+
+
+@patch("src.retag.CalibreHelper")
+def test_retag_keeps_column_values(mock_helper):
+    calibre = MagicMock()
+    calibre.get_all_tags.return_value = {"1": ["fandoms.Merlin", "Favourite"]}
+    calibre.get_metadata_values.return_value = {
+        "#fandoms": ("multiple", {"Harry Potter"}),
+        "tags": ("multiple", {"fandoms.Merlin", "Favourite"}),
+    }
+    mock_helper.return_value = calibre
+
+    retag(_options())
+
+    calibre.set_metadata_many.assert_called_once_with(
+        {"1": {"#fandoms": "Harry Potter,Merlin", "tags": "Favourite"}}
+    )
+
+
+@patch("src.retag.CalibreHelper")
+def test_retag_server_library(mock_helper):
+    calibre = MagicMock()
+    calibre.get_all_tags.return_value = {"1": ["fandoms.Merlin"]}
+    calibre.get_metadata_values.return_value = None
+    mock_helper.return_value = calibre
+
+    retag(_options())
+
+    calibre.set_metadata_many.assert_not_called()
@@ -0,0 +1,116 @@
+from unittest.mock import patch
+
+from src import scheduler
+
+works_info = {
+    "https://archiveofourown.org/works/2": {
+        "id": 2,
+        "words": 500000,
+        "status": ["Completed"],
+    },
+    "https://archiveofourown.org/works/3": {
+        "id": 3,
+        "words": 1000,
+        "status": ["In-Progress"],
+    },
+    "https://archiveofourown.org/works/4": {
+        "id": 4,
+        "words": 100000,
+        "status": ["In-Progress"],
+    },
+    "https://archiveofourown.org/works/5": {
+        "id": 5,
+        "words": 2000,
+        "status": ["Completed"],
+    },
+}
+
+
+def test_get_download_jobs_order():
+    urls = {f"https://archiveofourown.org/works/{i}" for i in range(1, 6)}
+    chapter_updates = {"https://archiveofourown.org/works/4": []}
+
+    jobs = scheduler.get_download_jobs(urls, works_info, chapter_updates)
+
+    assert [(j["url"][-1], j["priority"]) for j in jobs] == [
+        ("1", scheduler.PRIORITY_NEW),
+        ("4", scheduler.PRIORITY_SUBSCRIPTION_UPDATE),
+        ("3", scheduler.PRIORITY_UPDATE),
+        ("5", scheduler.PRIORITY_COMPLETE),
+        ("2", scheduler.PRIORITY_COMPLETE),
+    ]
+
+
+def test_time_budget_no_limit():
+    budget = scheduler.TimeBudget(None)
+
+    assert budget.fits({"cost": 10**9})
+
+
+def test_time_budget_scales_estimates():
+    with patch("src.scheduler.monotonic", return_value=0):
+        budget = scheduler.TimeBudget(100)
+
+    job = {"cost": 30}
+    with patch("src.scheduler.monotonic", return_value=60):
+        assert budget.fits(job)
+        # The first job took twice as long as estimated, so the next one is
+        # expected to take 60 seconds, which doesn't fit in the 40 left.
+        budget.record(job, 60)
+        assert not budget.fits(job)
+
+
+def test_split_into_lanes_single_worker():
+    jobs = [{"url": "a", "words": 500000}, {"url": "b", "words": 100}]
+
+    lanes, lane_workers = scheduler.split_into_lanes(jobs, 1)
+
+    assert lanes == {scheduler.LANE_ALL: jobs}
+    assert lane_workers == {scheduler.LANE_ALL: 1}
+
+
+def test_split_into_lanes_several_workers():
+    jobs = [
+        {"url": "a", "words": 500000},
+        {"url": "b", "words": 100},
+        {"url": "c", "words": None},
+    ]
+
+    lanes, lane_workers = scheduler.split_into_lanes(jobs, 8)
+
+    assert lanes == {
+        scheduler.LANE_SHORT: [jobs[1], jobs[2]],
+        scheduler.LANE_LONG: [jobs[0]],
+    }
+    assert lane_workers == {scheduler.LANE_SHORT: 6, scheduler.LANE_LONG: 2}
+
+
+def test_run_in_lanes():
+    jobs = scheduler.get_download_jobs(
+        [f"https://archiveofourown.org/works/{i}" for i in range(1, 6)], works_info
+    )
+    done = []
+
+    stats, skipped = scheduler.run_in_lanes(
+        jobs, 4, lambda job: done.append(job["url"]), scheduler.TimeBudget(None)
+    )
+
+    assert sorted(done) == sorted(j["url"] for j in jobs)
+    assert skipped == []
+    summary = stats.summary()
+    assert summary[scheduler.LANE_LONG]["jobs"] == 2
+    assert summary[scheduler.LANE_SHORT]["jobs"] == 3
+
+
+def test_run_in_lanes_out_of_time():
+    jobs = scheduler.get_download_jobs(
+        [f"https://archiveofourown.org/works/{i}" for i in range(1, 6)], works_info
+    )
+    done = []
+
+    stats, skipped = scheduler.run_in_lanes(
+        jobs, 1, lambda job: done.append(job["url"]), scheduler.TimeBudget(0)
+    )
+
+    assert done == []
+    assert skipped == jobs
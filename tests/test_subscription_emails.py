@@ -0,0 +1,117 @@
+from email.message import EmailMessage
+
+from src import subscription_emails
+
+
+def _make_email(subject, body):
+    message = EmailMessage()
+    message["Subject"] = subject
+    message["From"] = "Archive of Our Own <do-not-reply@archiveofourown.org>"
+    message.set_content(body)
+    return message
+
+
+def test_parse_subscription_email_single_chapter():
+    message = _make_email(
+        "[AO3] testauthor posted Chapter 12 of Test Work",
+        "testauthor posted a new chapter of Test Work (2,345 words):\n"
+        "http://archiveofourown.org/works/12345/chapters/67890\n",
+    )
+
+    updates = subscription_emails.parse_subscription_email(message)
+
+    assert updates == {"https://archiveofourown.org/works/12345": ["67890"]}
+
+
+def test_parse_subscription_email_several_chapters():
+    message = _make_email(
+        "[AO3] Subscription Updates",
+        "https://archiveofourown.org/works/1/chapters/10\n"
+        "https://archiveofourown.org/works/1/chapters/11\n"
+        "https://archiveofourown.org/works/2/chapters/20\n"
+        "https://archiveofourown.org/works/2/chapters/20\n",
+    )
+
+    updates = subscription_emails.parse_subscription_email(message)
+
+    assert updates == {
+        "https://archiveofourown.org/works/1": ["10", "11"],
+        "https://archiveofourown.org/works/2": ["20"],
+    }
+
+
+def test_parse_subscription_email_not_from_ao3():
+    message = _make_email(
+        "Look at this fic",
+        "https://archiveofourown.org/works/12345/chapters/67890\n",
+    )
+
+    assert subscription_emails.parse_subscription_email(message) == {}
+
+
+def test_merge_chapter_updates():
+    all_updates = {"https://archiveofourown.org/works/1": ["10"]}
+    updates = {
+        "https://archiveofourown.org/works/1": ["10", "11"],
+        "https://archiveofourown.org/works/2": ["20"],
+    }
+
+    subscription_emails.merge_chapter_updates(all_updates, updates)
+
+    assert all_updates == {
+        "https://archiveofourown.org/works/1": ["10", "11"],
+        "https://archiveofourown.org/works/2": ["20"],
+    }
+
+
+class FakeIMAP(object):
+    """An IMAP server with one folder of unread emails, by uid."""
+
+    def __init__(self, emails):
+        self.emails = emails
+        self.readonly = None
+        self.stored = []
+
+    def __call__(self, srv):
+        return self
+
+    def login(self, user, passwd):
+        pass
+
+    def select(self, folder, readonly=False):
+        self.readonly = readonly
+        return "OK", [b"2"]
+
+    def uid(self, command, *args):
+        if command == "search":
+            return "OK", [b" ".join(self.emails)]
+        if command == "fetch":
+            return "OK", [(b"", self.emails[args[0]].as_bytes())]
+        if command == "store":
+            self.stored.append(args[0])
+            return "OK", []
+
+    def logout(self):
+        pass
+
+
+def test_get_chapter_updates_from_imap(monkeypatch):
+    server = FakeIMAP(
+        {
+            b"1": _make_email(
+                "[AO3] testauthor posted Chapter 2 of Test Work",
+                "https://archiveofourown.org/works/12345/chapters/67890\n",
+            ),
+            b"2": _make_email("Hello", "No fics here.\n"),
+        }
+    )
+    monkeypatch.setattr(subscription_emails.imaplib, "IMAP4_SSL", server)
+
+    chapter_updates = subscription_emails.get_chapter_updates_from_imap(
+        "imap.example.com", "user", "password", "Fics"
+    )
+
+    assert chapter_updates == {"https://archiveofourown.org/works/12345": ["67890"]}
+    # Marking the emails as read is left to FanFicFare's get_urls_from_imap.
+    assert server.readonly
+    assert server.stored == []
@@ -0,0 +1,109 @@
+import json
+import re
+from argparse import Namespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from src.exceptions import InvalidConfig
+from src.tags import get_new_tag_name, get_rename_steps, get_tag_renames, tags
+
+
+def test_get_new_tag_name():
+    assert get_new_tag_name("fanfic.Fluff", prefix="fanfic.") == "Fluff"
+    assert get_new_tag_name("Fluff", prefix="fanfic.") == "Fluff"
+    assert (
+        get_new_tag_name(
+            "Harry Potter - J. K. Rowling",
+            pattern=re.compile(r" - J\. K\. Rowling$"),
+        )
+        == "Harry Potter"
+    )
+    assert (
+        get_new_tag_name("fanfic.Fluffy", prefix="fanfic.", mapping={"Fluffy": "Fluff"})
+        == "Fluff"
+    )
+
+
+def test_get_tag_renames():
+    items = {
+        "tags": {1: ("fanfic.Fluff", 3), 2: ("fluff", 2), 3: ("Angst", 5)},
+        "#fandoms": {4: ("fanfic.Merlin", 1), 5: ("fanfic.", 1)},
+    }
+
+    renames = get_tag_renames(
+        items, lambda name: get_new_tag_name(name, prefix="fanfic.")
+    )
+
+    assert renames == [
+        ("tags", 1, "fanfic.Fluff", "Fluff", 3, True),
+        ("#fandoms", 4, "fanfic.Merlin", "Merlin", 1, False),
+    ]
+
+
+def _options(tmp_path, dry_run=False):
+    mapping_path = tmp_path / "mapping.json"
+    mapping_path.write_text(json.dumps({"Fluffy": "Fluff"}))
+    return Namespace(
+        library="library",
+        calibre_user=None,
+        calibre_password=None,
+        dry_run=dry_run,
+        strip_tag_prefix="fanfic.",
+        tag_pattern=None,
+        tag_replacement="",
+        tag_mapping=str(mapping_path),
+    )
+
+
+@patch("src.tags.CalibreHelper")
+def test_tags_renames_each_tag_once(mock_helper, tmp_path):
+    calibre = MagicMock()
+    calibre.get_tag_items.return_value = {
+        "tags": {1: ("fanfic.Fluffy", 300), 2: ("Fluff", 20), 3: ("Angst", 5)},
+        "#freeformtags": {1: ("fanfic.Hurt/Comfort", 10)},
+    }
+    mock_helper.return_value = calibre
+
+    tags(_options(tmp_path))
+
+    calibre.rename_tags.assert_called_once_with(
+        [{"tags": {1: "Fluff"}, "#freeformtags": {1: "Hurt/Comfort"}}]
+    )
+
+
+@patch("src.tags.CalibreHelper")
+def test_tags_dry_run(mock_helper, tmp_path):
+    calibre = MagicMock()
+    calibre.get_tag_items.return_value = {"tags": {1: ("fanfic.Fluff", 3)}}
+    mock_helper.return_value = calibre
+
+    tags(_options(tmp_path, dry_run=True))
+
+    calibre.rename_tags.assert_not_called()
+
+
+def test_get_rename_steps_renames_chains_in_order():
+    mapping = {"A": "B", "B": "C", "C": "D", "E": "d"}
+    items = {"tags": {1: ("A", 1), 2: ("B", 1), 3: ("C", 1), 4: ("E", 1)}}
+    renames = get_tag_renames(
+        items, lambda name: get_new_tag_name(name, mapping=mapping)
+    )
+
+    # E is merged into D, which C is renamed to.
+    assert [r[5] for r in renames] == [False, False, True, True]
+    assert get_rename_steps(renames) == [
+        {"tags": {3: "D", 4: "d"}},
+        {"tags": {2: "C"}},
+        {"tags": {1: "B"}},
+    ]
+
+
+def test_get_rename_steps_rejects_circles():
+    items = {"tags": {1: ("A", 1), 2: ("B", 1)}}
+    renames = get_tag_renames(
+        items, lambda name: get_new_tag_name(name, mapping={"A": "B", "B": "A"})
+    )
+
+    with pytest.raises(InvalidConfig, match="go round in a circle: A -> B -> A"):
+        get_rename_steps(renames)
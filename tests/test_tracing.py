@@ -0,0 +1,48 @@
+import json
+
+from src import report, tracing
+from src.utils import subprocess_listeners
+
+
+def test_span_without_tracer():
+    assert not tracing.is_tracing()
+
+    with tracing.span("downloader", url="https://archiveofourown.org/works/1"):
+        pass
+
+
+def test_trace(tmp_path):
+    tracer = tracing.start_tracing()
+    try:
+        with tracing.span("downloader", url="https://archiveofourown.org/works/1"):
+            with report.timed("search"):
+                for listener in subprocess_listeners:
+                    listener(["calibredb", "search", "x", "--password=secret"], 0)
+        tracing.add_span_ending_now("GET https://archiveofourown.org", 0.2, "http")
+    finally:
+        tracing.stop_tracing()
+
+    path = tmp_path / "trace.json"
+    tracer.write(str(path))
+    with open(path, "r") as f:
+        events = json.loads(f.read())["traceEvents"]
+
+    spans = {e["name"]: e for e in events if e["ph"] == "X"}
+    assert set(spans) == {
+        "downloader",
+        "search",
+        "calibredb",
+        "GET https://archiveofourown.org",
+    }
+    assert spans["downloader"]["args"] == {"url": "https://archiveofourown.org/works/1"}
+    assert spans["calibredb"]["args"]["command"] == (
+        "calibredb search x '--password=****'"
+    )
+    # Spans are nested: each one starts and ends within its parent.
+    for child, parent in [("search", "downloader"), ("calibredb", "search")]:
+        assert spans[child]["ts"] >= spans[parent]["ts"]
+        assert (
+            spans[child]["ts"] + spans[child]["dur"]
+            <= spans[parent]["ts"] + spans[parent]["dur"]
+        )
+    assert [e["ph"] for e in events].count("M") == 1
@@ -3,6 +3,8 @@ import locale
 import os.path
 import time
 from argparse import Namespace
+from subprocess import CalledProcessError
+from time import monotonic
 from unittest.mock import MagicMock, Mock, patch
 
 import pytest
@@ -72,7 +74,7 @@ def test_setup_login_cookie(capsys):
     assert options.cookie == "testcookie"
 
 
-@patch("src.utils.browser_cookie3.firefox", mock_load_cookie)
+@patch("browser_cookie3.firefox", mock_load_cookie)
 def test_setup_login_use_browser_cookie(capsys):
     options = Namespace(
         cookie=None, use_browser_cookie=True, mirror=utils.AO3_DEFAULT_URL
@@ -85,7 +87,7 @@ def test_setup_login_use_browser_cookie(capsys):
     assert options.cookie == "test_browser_cookie"
 
 
-@patch("src.utils.browser_cookie3.firefox", mock_load_cookie)
+@patch("browser_cookie3.firefox", mock_load_cookie)
 def test_setup_login_cookie_and_use_browser_cookie(capsys):
     options = Namespace(
         cookie="testcookie", use_browser_cookie=True, mirror=utils.AO3_DEFAULT_URL
@@ -98,7 +100,7 @@ def test_setup_login_cookie_and_use_browser_cookie(capsys):
     assert options.cookie == "test_browser_cookie"
 
 
-@patch("src.utils.browser_cookie3.firefox", mock_load_no_cookie)
+@patch("browser_cookie3.firefox", mock_load_no_cookie)
 def test_setup_login_use_browser_cookie_but_browser_cookie_not_found(capsys):
     options = Namespace(
         cookie=None, use_browser_cookie=True, mirror=utils.AO3_DEFAULT_URL
@@ -110,7 +112,7 @@ def test_setup_login_use_browser_cookie_but_browser_cookie_not_found(capsys):
         utils.setup_login(options)
 
 
-@patch("src.utils.browser_cookie3.firefox", mock_load_no_cookie)
+@patch("browser_cookie3.firefox", mock_load_no_cookie)
 def test_setup_login_cookie_and_use_browser_cookie_but_browser_cookie_not_found(capsys):
     options = Namespace(
         cookie="testcookie", use_browser_cookie=True, mirror=utils.AO3_DEFAULT_URL
@@ -160,3 +162,75 @@ def test_get_all_metadata_options():
         "series": "Doth the Worm hath Sentience? [4]",
         "tags": "",
     }
+
+
+def test_parse_ao3_number():
+    assert utils.parse_ao3_number("2,464") == 2464
+    assert utils.parse_ao3_number("1,234,567") == 1234567
+    assert utils.parse_ao3_number("12") == 12
+
+
+def test_percentile():
+    values = [5, 1, 4, 2, 3, 6, 7, 8, 9, 10]
+
+    assert utils.percentile(values, 50) == 5
+    assert utils.percentile(values, 95) == 10
+    assert utils.percentile([], 50) is None
+
+
+def test_command_name():
+    assert utils.command_name(["calibredb", "search", "x"]) == "calibredb"
+    assert utils.command_name(["/usr/bin/fanficfare", "--json-meta", "url"]) == (
+        "fanficfare"
+    )
+    assert (
+        utils.command_name(["/usr/bin/python3", "/src/image_cache.py", "x"])
+        == "image_cache.py"
+    )
+
+
+def test_clone_file(tmp_path):
+    source = tmp_path / "source.epub"
+    source.write_bytes(b"epub" * 100000)
+
+    utils.clone_file(str(source), str(tmp_path / "clone.epub"))
+
+    assert (tmp_path / "clone.epub").read_bytes() == source.read_bytes()
+
+
+def test_check_subprocess_output():
+    assert utils.check_subprocess_output(["echo", "a b"]) == "a b\n"
+
+    with pytest.raises(CalledProcessError) as e:
+        utils.check_subprocess_output(["sh", "-c", "echo failed >&2; exit 3"])
+    assert e.value.returncode == 3
+    assert e.value.output == "failed\n"
+
+
+def test_check_subprocess_output_retries_after_timeout(tmp_path):
+    # Hangs the first time it's run, and succeeds the second time.
+    script = f"if [ -e {tmp_path}/ran ]; then echo done; else touch {tmp_path}/ran; sleep 10; fi"
+
+    assert (
+        utils.check_subprocess_output(["sh", "-c", script], timeout=0.5, retries=1)
+        == "done\n"
+    )
+
+
+def test_check_subprocess_output_timeout():
+    start = monotonic()
+    with pytest.raises(utils.SubprocessTimeoutError) as e:
+        utils.check_subprocess_output(["sleep", "10"], timeout=0.2, retries=1)
+    assert "killed after running for 0.2 seconds" in e.value.output
+    assert monotonic() - start < 5
+
+
+def test_check_subprocess_output_abort_on():
+    start = monotonic()
+    with pytest.raises(CalledProcessError) as e:
+        utils.check_subprocess_output(
+            ["sh", "-c", "echo 'HTTP Error 429'; sleep 10"],
+            abort_on=lambda line: "429" in line,
+        )
+    assert e.value.output == "HTTP Error 429\n"
+    assert monotonic() - start < 5
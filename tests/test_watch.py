@@ -0,0 +1,130 @@
+import socket
+from argparse import Namespace
+from queue import Queue
+from unittest.mock import MagicMock, patch
+
+from src.watch import (
+    DEFAULT_POLL_MINUTES,
+    UrlSubmissionServer,
+    Watcher,
+    get_poll_schedule,
+    wait_for_submitted_urls,
+)
+
+
+def _submit(path, text):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        client.sendall(text.encode("utf-8"))
+        client.shutdown(socket.SHUT_WR)
+        return client.makefile("r").read()
+
+
+def test_get_poll_schedule():
+    options = Namespace(
+        sources=["bookmarks", "later", "stdin"], poll_intervals={"later": 5}
+    )
+
+    assert get_poll_schedule(options) == {
+        "bookmarks": DEFAULT_POLL_MINUTES * 60,
+        "later": 300,
+    }
+
+
+def test_url_submission_server(tmp_path):
+    path = str(tmp_path / "watch.sock")
+    queue = Queue()
+    server = UrlSubmissionServer(path, queue)
+    server.start()
+    try:
+        response = _submit(
+            path,
+            "https://archiveofourown.org/works/1/chapters/2\n"
+            "http://archiveofourown.org/works/3\n"
+            "https://example.com/not-a-work\n",
+        )
+    finally:
+        server.stop()
+
+    assert response.endswith("Queued 2 urls\n")
+    assert "Malformed url: 'https://example.com/not-a-work'" in response
+    assert wait_for_submitted_urls(queue, 0) == {
+        "https://archiveofourown.org/works/1",
+        "https://archiveofourown.org/works/3",
+    }
+
+
+def test_wait_for_submitted_urls_nothing_submitted():
+    assert wait_for_submitted_urls(Queue(), 0) == set()
+
+
+def _watcher_options():
+    return Namespace(
+        dry_run=False, fanficfare_config=None, cache_dir="cache", image_cache_size=None
+    )
+
+
+@patch("src.watch.download_urls")
+def test_watcher_download_without_library(mock_download_urls):
+    options = _watcher_options()
+    watcher = Watcher(options, None)
+
+    watcher.download(options, {"https://archiveofourown.org/works/1"})
+
+    mock_download_urls.assert_called_once()
+
+
+def test_url_submission_server_idle_client(tmp_path):
+    path = str(tmp_path / "watch.sock")
+    queue = Queue()
+    server = UrlSubmissionServer(path, queue)
+    server.start()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as idle_client:
+        idle_client.connect(path)
+        idle_client.sendall(b"https://archiveofourown.org/works/1\n")
+        try:
+            # The idle client doesn't hold up the others.
+            assert _submit(path, "https://archiveofourown.org/works/2\n") == (
+                "Queued 1 urls\n"
+            )
+            assert queue.get(timeout=1) == {"https://archiveofourown.org/works/2"}
+        finally:
+            server.stop()
+
+
+@patch("src.watch.SUBMISSION_TIMEOUT_SECONDS", 0.1)
+def test_url_submission_server_timeout(tmp_path):
+    path = str(tmp_path / "watch.sock")
+    queue = Queue()
+    server = UrlSubmissionServer(path, queue)
+    server.start()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(path)
+            client.sendall(b"https://archiveofourown.org/works/1\n")
+            response = client.makefile("r").read()
+    finally:
+        server.stop()
+
+    assert response.endswith("Queued 1 urls\n")
+    assert queue.get(timeout=1) == {"https://archiveofourown.org/works/1"}
+
+
+@patch("src.watch.update_last_updated_file")
+@patch("src.watch.get_urls", side_effect=OSError("Connection reset by peer"))
+def test_watcher_poll_error(mock_get_urls, mock_update_last_updated_file):
+    watcher = Watcher(_watcher_options(), None)
+
+    watcher.poll(["bookmarks"])
+
+    mock_update_last_updated_file.assert_not_called()
+
+
+@patch("src.watch.download_urls", side_effect=ValueError("Bad value"))
+def test_watcher_download_submitted_error(mock_download_urls):
+    calibre = MagicMock()
+    watcher = Watcher(_watcher_options(), calibre)
+
+    watcher.download_submitted({"https://archiveofourown.org/works/1"})
+
+    mock_download_urls.assert_called_once()